@@ -0,0 +1 @@
+"""Scale benchmarks for jasmin-slurm-sync, run with python -m benchmarks."""
@@ -0,0 +1,81 @@
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import pathlib
+import typing
+
+import tap
+
+from . import scenario
+
+
+class BenchmarkArgParser(tap.Tap):
+    """Measure a sync against synthetic portals and a fake sacctmgr."""
+
+    users: list[int] = [1000, 10000, 50000]  # Numbers of users to sync.
+    drift: list[float] = [0.01, 0.1]  # Fractions of users and workspaces out of sync.
+    workspaces: typing.Optional[int] = None  # Default is one per 20 users.
+    consortia: int = 20
+    seed: int = 0
+    rate_limited: bool = False  # Use the default sacctmgr rate limits.
+    page_size: int = 0  # Fetch portal listings in pages of this size.
+    pipeline: bool = False  # Apply users' changes while their grants are fetched.
+    output: typing.Optional[pathlib.Path] = None  # Also write results as JSON.
+
+
+COLUMNS = [
+    ("users", "users", "{}"),
+    ("drift", "drift", "{:.0%}"),
+    ("slurm_read", "slurm s", "{:.2f}"),
+    ("portal_read", "portal s", "{:.2f}"),
+    ("plan", "plan s", "{:.2f}"),
+    ("apply", "apply s", "{:.2f}"),
+    ("pipeline", "pipeline s", "{:.2f}"),
+    ("total", "total s", "{:.2f}"),
+    ("changes", "changes", "{}"),
+    ("read", "reads", "{}"),
+    ("write", "writes", "{}"),
+    ("http_requests", "http", "{}"),
+    ("peak_memory_mib", "peak MiB", "{:.0f}"),
+    ("converged", "converged", "{}"),
+]
+
+
+def row(result: dict[str, typing.Any]) -> list[str]:
+    values = {**result, **result["phases"], **result["sacctmgr_calls"]}
+    return [fmt.format(values.get(key, 0)) for key, _, fmt in COLUMNS]
+
+
+def main() -> None:
+    args = BenchmarkArgParser().parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    results = []
+    print("  ".join(f"{title:>9}" for _, title, _ in COLUMNS))
+    for users in args.users:
+        for drift in args.drift:
+            # A fresh process for each scenario, so peak memory is measured separately.
+            with concurrent.futures.ProcessPoolExecutor(
+                1, mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                result = pool.submit(
+                    scenario.run,
+                    users,
+                    drift,
+                    args.workspaces or max(users // 20, 1),
+                    args.consortia,
+                    args.seed,
+                    args.rate_limited,
+                    args.page_size,
+                    args.pipeline,
+                ).result()
+            results.append(result)
+            print("  ".join(f"{x:>9}" for x in row(result)), flush=True)
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Synthetic projects and accounts portals, served through an httpx mock transport."""
+
+import random
+import typing
+
+import httpx
+
+from jasmin_slurm_sync import settings as settings_module
+
+# Relative chance of a user having 0, 1, 2... group workspaces.
+WORKSPACES_PER_USER = [20, 35, 20, 12, 8, 5]
+
+
+class SyntheticPortal:
+    """Users, group workspaces and consortia, with the grants between them.
+
+    Workspace popularity follows a Zipf distribution, so a few workspaces have most of the users.
+    """
+
+    def __init__(
+        self,
+        settings: settings_module.SyncSettings,
+        users: int,
+        workspaces: int,
+        consortia: int,
+        rng: random.Random,
+    ) -> None:
+        self.settings = settings
+        self.requests = 0
+
+        self.consortia = [
+            {"id": i, "name": f"consortium{i:03d}"} for i in range(consortia)
+        ]
+        self.services = [
+            {
+                "name": f"gws{i:05d}",
+                "category": 1,
+                "has_active_requirements": True,
+                "consortium": rng.randrange(consortia),
+                "project_fairshare": rng.randint(1, 10),
+                "consortium_fairshare": 10,
+            }
+            for i in range(workspaces)
+        ]
+        names = [x["name"] for x in self.services]
+        weights = [1 / (rank + 1) for rank in range(workspaces)]
+        self.grants: dict[str, set[str]] = {}
+        for i in range(users):
+            count = rng.choices(
+                range(len(WORKSPACES_PER_USER)), weights=WORKSPACES_PER_USER
+            )[0]
+            self.grants[f"user{i:06d}"] = set(rng.choices(names, weights, k=count))
+
+        # Every service has the same consortium fairshare, so it doesn't matter which one wins.
+        consortium_names = {x["id"]: x["name"] for x in self.consortia}
+        self.accounts = {
+            consortium_names[x["consortium"]]: ("root", 10) for x in self.services
+        }
+        self.accounts.update(
+            {
+                x["name"]: (consortium_names[x["consortium"]], x["project_fairshare"])
+                for x in self.services
+            }
+        )
+        self.accounts[settings.default_account] = ("root", 1)
+        self.accounts[settings.no_project_account] = ("root", 1)
+
+    def expected_accounts(self, username: str) -> set[str]:
+        """The SLURM accounts a user should end up with."""
+        accounts = {self.settings.default_account, *self.grants[username]}
+        if len(accounts) <= 1:
+            accounts.add(self.settings.no_project_account)
+        return accounts
+
+    def user_grants(self, username: str) -> list[dict[str, typing.Any]]:
+        category, service = self.settings.list_users_role.split("/")
+        grants = [
+            {
+                "role": {"name": "USER"},
+                "service": {"name": service, "category": {"name": category}},
+            }
+        ]
+        grants.extend(
+            {
+                "role": {"name": "USER"},
+                "service": {"name": x, "category": {"name": "group_workspaces"}},
+            }
+            for x in sorted(self.grants[username])
+        )
+        return grants
+
+    @staticmethod
+    def listing(
+        request: httpx.Request,
+        items: list[typing.Any],
+        key: typing.Optional[str] = None,
+    ) -> httpx.Response:
+        """Respond with a listing, a page at a time if limit and offset are given."""
+        if "limit" not in request.url.params:
+            return httpx.Response(200, json=items if key is None else {key: items})
+        limit = int(request.url.params["limit"])
+        offset = int(request.url.params.get("offset", 0))
+        return httpx.Response(
+            200,
+            json={
+                "count": len(items),
+                "next": None,
+                "results": items[offset : offset + limit],
+            },
+        )
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        """Respond to a request to either portal."""
+        self.requests += 1
+        url = str(request.url.copy_with(query=None))
+        projects = self.settings.api_projects_base_url
+        accounts = self.settings.api_accounts_base_url
+        category, service = self.settings.list_users_role.split("/")
+
+        if url == projects + "services/":
+            return self.listing(request, self.services)
+        if url == projects + "consortia/":
+            return self.listing(request, self.consortia)
+        if url == accounts + f"categories/{category}/services/{service}/roles/USER/":
+            return self.listing(
+                request, [{"user": {"username": x}} for x in self.grants], "accesses"
+            )
+        if url.startswith(accounts + "users/") and url.endswith("/grants/"):
+            username = url.removeprefix(accounts + "users/").removesuffix("/grants/")
+            if username in self.grants:
+                return httpx.Response(200, json=self.user_grants(username))
+        return httpx.Response(404)
+
+
+class FakeApiClient:
+    """Stands in for the accounts portal API client, serving the synthetic portal."""
+
+    def __init__(self, portal: SyntheticPortal) -> None:
+        self.client = httpx.AsyncClient(transport=httpx.MockTransport(portal.handle))
+
+    def get_async_httpx_client(self) -> httpx.AsyncClient:
+        return self.client
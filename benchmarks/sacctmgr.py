@@ -0,0 +1,185 @@
+"""Fake sacctmgr, backed by a JSON file rather than slurmdbd.
+
+Only the commands and output formats used by jasmin-slurm-sync are supported.
+The file to use is given by the FAKE_SACCTMGR_STORE environment variable,
+and every invocation is appended to the file given by FAKE_SACCTMGR_LOG.
+"""
+
+import fcntl
+import json
+import os
+import pathlib
+import sys
+import typing
+
+# Name of the cluster reported by sacctmgr show cluster.
+CLUSTER = "benchmark"
+
+
+class Store:
+    """Accounts and users' associations, as slurmdbd would hold them."""
+
+    def __init__(
+        self,
+        accounts: typing.Optional[dict[str, tuple[str, int]]] = None,
+        users: typing.Optional[dict[str, tuple[str, list[str]]]] = None,
+    ) -> None:
+        # Account name: (parent, fairshare). The root account is always there.
+        self.accounts = accounts if accounts is not None else {}
+        # Username: (default account, accounts).
+        self.users = users if users is not None else {}
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> "Store":
+        data = json.loads(path.read_text())
+        return cls(
+            {k: (v[0], v[1]) for k, v in data["accounts"].items()},
+            {k: (v[0], v[1]) for k, v in data["users"].items()},
+        )
+
+    def save(self, path: pathlib.Path) -> None:
+        path.write_text(json.dumps({"accounts": self.accounts, "users": self.users}))
+
+    def show_associations(self, options: dict[str, str]) -> list[str]:
+        users = set(options["users"].split(",")) if "users" in options else None
+        accounts = (
+            set(options["accounts"].split(",")) if "accounts" in options else None
+        )
+        lines = []
+        if users is None:
+            if accounts is None or "root" in accounts:
+                lines.append("root|||1")
+            for name, (parent, fairshare) in self.accounts.items():
+                if accounts is None or name in accounts:
+                    lines.append(f"{name}|{parent}||{fairshare}")
+        for username, (_, user_accounts) in self.users.items():
+            if users is None or username in users:
+                lines.extend(
+                    f"{x}||{username}|1"
+                    for x in user_accounts
+                    if accounts is None or x in accounts
+                )
+        return lines
+
+    def show_users(self, names: typing.Optional[str]) -> list[str]:
+        wanted = set(names.split(",")) if names else None
+        return [
+            f"{username}|{default_account}"
+            for username, (default_account, _) in self.users.items()
+            if wanted is None or username in wanted
+        ]
+
+    def add_users(self, usernames: str, accounts: str) -> None:
+        for username in usernames.split(","):
+            default_account, user_accounts = self.users.get(
+                username, (accounts.split(",")[0], [])
+            )
+            for account in accounts.split(","):
+                if account not in self.accounts:
+                    raise ValueError(f"No account {account}")
+                if account not in user_accounts:
+                    user_accounts.append(account)
+            self.users[username] = (default_account, user_accounts)
+
+    def remove_users(self, usernames: str, accounts: str) -> None:
+        for username in usernames.split(","):
+            if username not in self.users:
+                continue
+            default_account, user_accounts = self.users[username]
+            user_accounts = [x for x in user_accounts if x not in accounts.split(",")]
+            if user_accounts:
+                self.users[username] = (default_account, user_accounts)
+            else:
+                del self.users[username]
+
+    def set_default_account(self, usernames: str, account: str) -> None:
+        for username in usernames.split(","):
+            if username in self.users:
+                self.users[username] = (account, self.users[username][1])
+
+    def create_account(self, name: str, parent: str, fairshare: int) -> None:
+        if name in self.accounts:
+            raise ValueError(f"Account {name} already exists")
+        if parent != "root" and parent not in self.accounts:
+            raise ValueError(f"No parent account {parent}")
+        self.accounts[name] = (parent, fairshare)
+
+    def load_file(self, path: pathlib.Path) -> None:
+        """Load accounts from a sacctmgr flat file."""
+        parent = "root"
+        for line in path.read_text().splitlines():
+            kind, _, rest = line.partition(" - ")
+            fields = rest.split(":")
+            name = fields[0].strip("'")
+            if kind == "Parent":
+                parent = name
+            elif kind == "Account":
+                fairshare = next(
+                    int(x.split("=")[1]) for x in fields if x.startswith("Fairshare=")
+                )
+                if name not in self.accounts:
+                    self.create_account(name, parent, fairshare)
+
+
+def options(args: list[str]) -> dict[str, str]:
+    """Get the key=value options from a command's arguments."""
+    return dict(x.split("=", 1) for x in args if "=" in x)
+
+
+def run(store: Store, args: list[str]) -> list[str]:
+    """Run a sacctmgr command against the store, returning the lines of output."""
+    words = [x for x in args if not x.startswith("-") and "=" not in x]
+    opts = options(args)
+    match words:
+        case ["show", "associations", *_]:
+            return store.show_associations(opts)
+        case ["show", "user", *rest]:
+            return store.show_users(rest[0] if rest else None)
+        case ["show", "cluster"]:
+            return [CLUSTER]
+        case ["list", "transactions"]:
+            return []
+        case ["add", "user", usernames]:
+            store.add_users(usernames, opts["account"])
+        case ["remove", "user", usernames]:
+            store.remove_users(usernames, opts["account"])
+        case ["modify", "user", usernames, "set"]:
+            store.set_default_account(usernames, opts["defaultaccount"])
+        case ["create", "account"]:
+            store.create_account(opts["name"], opts["parent"], int(opts["fairshare"]))
+        case ["modify", "account", "where", "set"]:
+            parent, fairshare = store.accounts[opts["name"]]
+            store.accounts[opts["name"]] = (
+                opts.get("parent", parent),
+                int(opts.get("fairshare", fairshare)),
+            )
+        case ["load"]:
+            store.load_file(pathlib.Path(opts["file"]))
+        case _:
+            raise ValueError(f"Unsupported command {args}")
+    return []
+
+
+def main(argv: list[str]) -> int:
+    args = argv[1:]
+    with open(os.environ["FAKE_SACCTMGR_LOG"], "a") as log:
+        log.write(json.dumps(args) + "\n")
+
+    path = pathlib.Path(os.environ["FAKE_SACCTMGR_STORE"])
+    with open(path.with_suffix(".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        store = Store.load(path)
+        try:
+            output = run(store, args)
+        except (ValueError, KeyError) as err:
+            print(f" Error: {err}", file=sys.stderr)
+            return 1
+        if args[0] == "-i":
+            store.save(path)
+    if output:
+        print("\n".join(output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,205 @@
+"""Run a single sync against a synthetic portal and fake sacctmgr, and measure it."""
+
+import asyncio
+import collections
+import json
+import os
+import pathlib
+import random
+import sys
+import tempfile
+import time
+import typing
+import unittest.mock
+
+from jasmin_slurm_sync import cli, ratelimit
+from jasmin_slurm_sync import settings as settings_module
+from jasmin_slurm_sync import sync, utils
+
+from . import portal as portal_module
+from . import sacctmgr
+
+CONFIG = """
+api_client_base_url = "https://accounts.example.com/"
+api_client_id = "benchmark"
+api_client_secret = "benchmark"
+api_client_scopes = []
+api_projects_base_url = "https://projects.example.com/api/"
+api_accounts_base_url = "https://accounts.example.com/api/v1/"
+list_users_role = "jasmin/slurm"
+unmanaged_accounts = []
+unmanaged_users = []
+no_project_account = "no-project"
+default_account = "default-account"
+slurm_cluster = "{cluster}"
+extra_account_mapping = {{}}
+"""
+
+# Settings to stop rate limits from dominating the measurements.
+UNLIMITED = """
+sacctmgr_read_rate = 1000000.0
+sacctmgr_write_rate = 1000000.0
+"""
+
+SHIM = """#!{python}
+import sys
+sys.path.insert(0, {root!r})
+from benchmarks import sacctmgr
+sys.exit(sacctmgr.main(sys.argv))
+"""
+
+
+def drifted_store(
+    portal: portal_module.SyntheticPortal,
+    settings: settings_module.SyncSettings,
+    drift: float,
+    rng: random.Random,
+) -> sacctmgr.Store:
+    """SLURM as it would be after a sync, with a fraction of accounts and users changed."""
+    accounts = dict(portal.accounts)
+    workspaces = [x["name"] for x in portal.services]
+    for name in rng.sample(workspaces, int(len(workspaces) * drift)):
+        del accounts[name]
+
+    store = sacctmgr.Store(accounts)
+    for username in portal.grants:
+        store.users[username] = (
+            settings.default_account,
+            sorted(x for x in portal.expected_accounts(username) if x in accounts),
+        )
+    for username in rng.sample(sorted(portal.grants), int(len(portal.grants) * drift)):
+        # Default accounts are only corrected along with other changes,
+        # so they are only changed for users who are also in the wrong accounts.
+        user_accounts = store.users[username][1]
+        change = rng.randrange(3)
+        if change == 0:
+            # A new user.
+            del store.users[username]
+        elif change == 1:
+            # Removed from an account.
+            user_accounts.pop(rng.randrange(len(user_accounts)))
+        else:
+            # Added to an account they shouldn't be in, which became their default.
+            stale = rng.choice(sorted(accounts.keys() - set(user_accounts)))
+            user_accounts.append(stale)
+            store.users[username] = (stale, user_accounts)
+    return store
+
+
+def converged(
+    portal: portal_module.SyntheticPortal,
+    settings: settings_module.SyncSettings,
+    store: sacctmgr.Store,
+) -> bool:
+    """Check whether SLURM now matches the portal."""
+    return all(
+        username in store.users
+        and set(store.users[username][1]) == portal.expected_accounts(username)
+        and store.users[username][0] == settings.default_account
+        for username in portal.grants
+    ) and all(store.accounts.get(k) == v for k, v in portal.accounts.items())
+
+
+class Timer:
+    """Time each phase of a sync."""
+
+    def __init__(self) -> None:
+        self.phases: dict[str, float] = {}
+
+    async def __call__(
+        self, name: str, awaitable: typing.Awaitable[typing.Any]
+    ) -> typing.Any:
+        started = time.perf_counter()
+        result = await awaitable
+        self.phases[name] = time.perf_counter() - started
+        return result
+
+
+async def measure(
+    settings: settings_module.SyncSettings,
+    args: cli.SyncArgParser,
+    portal: portal_module.SyntheticPortal,
+    pipeline: bool = False,
+) -> dict[str, typing.Any]:
+    """Sync once, timing each phase, or the whole pipeline if it is used."""
+    syncer = sync.SLURMSyncer(
+        settings, args, api_client=portal_module.FakeApiClient(portal)  # type: ignore
+    )
+    timer = Timer()
+    started = time.perf_counter()
+    # The synthetic users don't have Unix accounts.
+    with unittest.mock.patch("pwd.getpwnam"):
+        if pipeline:
+            changes = await timer("pipeline", syncer.pipeline())
+            timer.phases["total"] = time.perf_counter() - started
+            return {"phases": timer.phases, "changes": changes}
+        await timer("slurm_read", syncer.slurm_associations)
+        await timer("portal_read", syncer.portal_user_services)
+        changes = await timer("plan", syncer.plan())
+        await timer("apply", syncer.executor.apply(changes))
+    timer.phases["total"] = time.perf_counter() - started
+    return {"phases": timer.phases, "changes": len(changes)}
+
+
+def run(
+    users: int,
+    drift: float,
+    workspaces: int,
+    consortia: int,
+    seed: int,
+    rate_limited: bool,
+    page_size: int = 0,
+    pipeline: bool = False,
+) -> dict[str, typing.Any]:
+    """Set up a synthetic portal and SLURM, then measure a sync against them.
+
+    Run in a fresh process for each scenario, so that peak memory isn't shared between them.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmp = pathlib.Path(tmpdir)
+        config = tmp / "config.toml"
+        config.write_text(
+            f"portal_page_size = {page_size}\n"
+            + CONFIG.format(cluster=sacctmgr.CLUSTER)
+            + ("" if rate_limited else UNLIMITED)
+        )
+        settings = settings_module.load_settings(config)
+        args = cli.SyncArgParser().parse_args(["--config", str(config)])
+
+        rng = random.Random(seed)
+        portal = portal_module.SyntheticPortal(
+            settings, users, workspaces, consortia, rng
+        )
+        store_path = tmp / "store.json"
+        drifted_store(portal, settings, drift, rng).save(store_path)
+
+        # Put the fake sacctmgr first on the PATH.
+        bin_dir = tmp / "bin"
+        bin_dir.mkdir()
+        shim = bin_dir / "sacctmgr"
+        shim.write_text(
+            SHIM.format(
+                python=sys.executable, root=str(pathlib.Path(__file__).parent.parent)
+            )
+        )
+        shim.chmod(0o755)
+        log_path = tmp / "sacctmgr.log"
+        log_path.touch()
+        os.environ["PATH"] = f"{bin_dir}{os.pathsep}{os.environ['PATH']}"
+        os.environ["FAKE_SACCTMGR_STORE"] = str(store_path)
+        os.environ["FAKE_SACCTMGR_LOG"] = str(log_path)
+
+        result = asyncio.run(measure(settings, args, portal, pipeline))
+
+        calls = [json.loads(x) for x in log_path.read_text().splitlines()]
+        result.update(
+            users=users,
+            drift=drift,
+            sacctmgr_calls=collections.Counter(
+                ratelimit.RateLimiter.command_class(["sacctmgr", *x]) for x in calls
+            ),
+            http_requests=portal.requests,
+            peak_memory_mib=utils.peak_memory() / 1024,
+            converged=converged(portal, settings, sacctmgr.Store.load(store_path)),
+        )
+    return result
@@ -2,43 +2,129 @@ import asyncio
 import logging
 import os
 import pathlib
+import sys
+import time
+import typing
+
 import sdnotify  # type: ignore
 
-from . import cli
+from . import cli, errors, metrics, schedule
 from . import settings as settings_module
-from . import sync
+from . import state as state_module
+from . import sync, tracing, trigger
+from .sync import pool
 
 system_notify = sdnotify.SystemdNotifier()
-args = cli.SyncArgParser().parse_args()
-logging.basicConfig(level=logging.INFO)
-
 logger = logging.getLogger(__name__)
+args: cli.SyncArgParser
+
+
+async def run_sync(syncer: sync.SLURMSyncer) -> int:
+    """Run a sync, splitting the users between workers if asked to."""
+    if args.workers > 1:
+        return await pool.sync_in_workers(syncer)
+    return await syncer.sync()
+
+
+async def run_cycle(syncer: sync.SLURMSyncer) -> int:
+    """Run a sync, profiling it if asked to."""
+    if args.profile is not None:
+        with tracing.Profile(args.profile):
+            return await run_sync(syncer)
+    return await run_sync(syncer)
 
-logger.info("Starting sync of SLURM users.")
-system_notify.notify(f"MAINPID={os.getpid()}")
-system_notify.notify("READY=1")
 
+async def main() -> int:
+    """Sync until stopped, or once, returning the exit status."""
+    # Kept between cycles so that users who haven't changed can be skipped.
+    state = state_module.SyncState()
+    # Only one sync runs at a time, whether it is a full sync or a requested one.
+    sync_lock = asyncio.Lock()
+    syncer: typing.Optional[sync.SLURMSyncer] = None
 
-async def main() -> None:
+    async def sync_one(kind: str, name: str) -> None:
+        """Sync a single user or account, reusing what the latest syncer already knows."""
+        async with sync_lock:
+            if syncer is None:
+                raise RuntimeError("The first sync has not started yet.")
+            await syncer.refresh_token()
+            if kind == "user":
+                await syncer.sync_users({name})
+            else:
+                await syncer.sync_accounts([name])
+
+    if args.run_forever and args.trigger_socket is not None:
+        await trigger.TriggerServer(args.trigger_socket, sync_one).start()
+    if args.metrics_port is not None:
+        await metrics.REGISTRY.serve(args.metrics_host, args.metrics_port)
+
+    # Settings are only read again, and the syncer rebuilt, when the config file changes.
+    # Otherwise the syncer and its connections to the portals are kept between cycles.
+    settings_loader = settings_module.SettingsLoader(pathlib.Path(args.config))
+    scheduler = schedule.Scheduler()
     while True:
         logger.debug("Loading settings.")
-        settings = settings_module.load_settings(pathlib.Path(args.config))
+        settings, changed = settings_loader.load()
+
+        async with sync_lock:
+            if syncer is None or changed:
+                logger.debug("Create syncer.")
+                if syncer is not None:
+                    await syncer.close()
+                syncer = sync.SLURMSyncer(settings, args, state=state)
+            else:
+                await syncer.new_cycle()
 
-        logger.debug("Create syncer.")
-        syncer = sync.SLURMSyncer(settings, args)
+            logger.debug("Do the sync.")
+            # Only report the phases this sync goes through.
+            metrics.PHASE_DURATION.clear()
+            # Stop a daemon's sync before it runs into the next one.
+            deadline = settings.daemon_cycle_deadline if args.run_forever else 0
+            changes: typing.Optional[int] = None
+            failed = False
+            with metrics.Timer() as timer:
+                try:
+                    changes = await asyncio.wait_for(
+                        run_cycle(syncer), deadline or None
+                    )
+                except asyncio.TimeoutError:
+                    logger.error(
+                        "Sync took longer than %s secs, so it was stopped.", deadline
+                    )
+                    # The snapshot may have been left half updated, so read it again.
+                    state.associations = None
+                except errors.UserSyncError as err:
+                    # Only syncs of selected users fail like this, and run once.
+                    logger.error(str(err))
+                    failed = True
 
-        logger.debug("Do the sync.")
-        await syncer.sync()
+        delay = scheduler.next_delay(settings, timer.elapsed, changes)
+        metrics.CYCLE_DURATION.set(timer.elapsed)
+        if changes is not None:
+            metrics.LAST_SUCCESS.set(time.time())
+        metrics.SLEEP_TIME.set(delay)
+        if args.metrics_file is not None:
+            metrics.REGISTRY.write(args.metrics_file)
 
         if args.run_forever:
-            logger.info(
-                "Finished sync, sleeping for %s secs.", settings.daemon_sleep_time
-            )
-            await asyncio.sleep(settings.daemon_sleep_time)
+            logger.info("Finished sync, sleeping for %.0f secs.", delay)
+            await asyncio.sleep(delay)
         else:
             logger.info("Running in one-shot mode. Quitting.")
+            await syncer.close()
             system_notify.notify("STOPPING=1")
-            break
+            return 1 if failed else 0
+
+
+# Worker processes import this module too, so only sync when it is run.
+if __name__ == "__main__":
+    args = cli.SyncArgParser().parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.spans is not None:
+        tracing.log_spans(args.spans)
 
+    logger.info("Starting sync of SLURM users.")
+    system_notify.notify(f"MAINPID={os.getpid()}")
+    system_notify.notify("READY=1")
 
-asyncio.run(main())
+    sys.exit(asyncio.run(main()))
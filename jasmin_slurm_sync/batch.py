@@ -0,0 +1,231 @@
+import collections
+import logging
+import subprocess as sp
+import typing
+
+from . import cli
+from . import journal as journal_module
+from . import metrics, plan
+from . import settings as settings_module
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+
+def group_changes(
+    changes: typing.Mapping[str, typing.AbstractSet[str]],
+) -> list[tuple[list[str], list[str]]]:
+    """Group user: accounts changes into as few (users, accounts) pairs as possible.
+
+    sacctmgr applies a command to every combination of the users and accounts given,
+    so a group is only valid if every user in it needs the change for every account in it.
+    Changes can be grouped either by the set of accounts each user needs or by account,
+    and whichever gives the fewest groups is used.
+    """
+    by_accounts: dict[frozenset[str], list[str]] = collections.defaultdict(list)
+    by_account: dict[str, list[str]] = collections.defaultdict(list)
+    for username, accounts in sorted(changes.items()):
+        if accounts:
+            by_accounts[frozenset(accounts)].append(username)
+            for account in accounts:
+                by_account[account].append(username)
+
+    if len(by_accounts) <= len(by_account):
+        return sorted(
+            (users, sorted(accounts)) for accounts, users in by_accounts.items()
+        )
+    return sorted((users, [account]) for account, users in by_account.items())
+
+
+def chunks(items: list[str], size: int) -> typing.Iterator[list[str]]:
+    """Split a list into chunks of at most size items."""
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+class AssociationBatch:
+    """Collects changes to users' SLURM associations and applies them in bulk.
+
+    Changes are applied in the same order as when syncing a single user:
+    additions first, then default account changes, then removals.
+    If there is a journal, the changes made by each command are recorded in it.
+    """
+
+    def __init__(
+        self,
+        settings: settings_module.SyncSettings,
+        args: cli.SyncArgParser,
+        runner: utils.CommandRunner,
+        journal: typing.Optional[journal_module.Journal] = None,
+    ) -> None:
+        self.settings = settings
+        self.args = args
+        self.runner = runner
+        self.journal = journal
+
+        self.to_be_added: dict[str, set[str]] = collections.defaultdict(set)
+        self.to_be_removed: dict[str, set[str]] = collections.defaultdict(set)
+        self.default_accounts: dict[str, str] = {}
+        # Users a command failed for, whose other changes are still made.
+        self.failed: set[str] = set()
+
+    def add_user_to_account(self, username: str, account: str) -> None:
+        """Queue adding a user to an account."""
+        self.to_be_added[username].add(account)
+
+    def remove_user_from_account(self, username: str, account: str) -> None:
+        """Queue removing a user from an account."""
+        self.to_be_removed[username].add(account)
+
+    def update_default_account(self, username: str, account: str) -> None:
+        """Queue changing a user's default account."""
+        self.default_accounts[username] = account
+
+    def record_done(self, operations: typing.Iterable[plan.UserOperation]) -> None:
+        if self.journal is not None:
+            self.journal.done(operations)
+
+    async def run(
+        self,
+        args: list[str],
+        users: list[str],
+        single_user_args: typing.Callable[[str], list[str]],
+    ) -> list[str]:
+        """Run a batched sacctmgr command, falling back to one command per user on failure.
+
+        Users the command fails for on their own are logged and recorded in failed,
+        and the rest carry on. Returns the users the command succeeded for.
+        """
+        try:
+            cmd_output = await self.runner.run(args)
+        except sp.CalledProcessError:
+            if len(users) == 1:
+                logger.error("Command failed for user %s: %s", users[0], " ".join(args))
+                metrics.SACCTMGR_FAILURES.inc()
+                self.failed.add(users[0])
+                return []
+            logger.error(
+                "Batched command failed for %s users, retrying one user at a time.",
+                len(users),
+            )
+            done = []
+            for username in users:
+                done.extend(
+                    await self.run(
+                        single_user_args(username), [username], single_user_args
+                    )
+                )
+            return done
+        if cmd_output.stderr:
+            logger.error(cmd_output.stderr)
+        if cmd_output.stdout:
+            logger.debug(cmd_output.stdout)
+        return users
+
+    async def flush_additions(self) -> None:
+        """Add users to accounts."""
+        for users, accounts in group_changes(self.to_be_added):
+            account_list = ",".join(accounts)
+            for users_chunk in chunks(users, self.settings.sacctmgr_batch_size):
+                done = await self.run(
+                    [
+                        "sacctmgr",
+                        "-i",
+                        "add",
+                        "user",
+                        ",".join(users_chunk),
+                        f"account={account_list}",
+                    ],
+                    users_chunk,
+                    lambda username: [
+                        "sacctmgr",
+                        "-i",
+                        "add",
+                        "user",
+                        username,
+                        f"account={account_list}",
+                    ],
+                )
+                for username in done:
+                    logger.info("Added user %s to account %s", username, account_list)
+                self.record_done(
+                    plan.AddAssociation(x, y) for x in done for y in accounts
+                )
+        self.to_be_added.clear()
+
+    async def flush_default_accounts(self) -> None:
+        """Change users' default accounts."""
+        by_account: dict[str, list[str]] = collections.defaultdict(list)
+        for username, account in sorted(self.default_accounts.items()):
+            by_account[account].append(username)
+
+        for account, users in sorted(by_account.items()):
+            for users_chunk in chunks(users, self.settings.sacctmgr_batch_size):
+                done = await self.run(
+                    [
+                        "sacctmgr",
+                        "-i",
+                        "modify",
+                        "user",
+                        ",".join(users_chunk),
+                        "set",
+                        f"defaultaccount={account}",
+                    ],
+                    users_chunk,
+                    lambda username: [
+                        "sacctmgr",
+                        "-i",
+                        "modify",
+                        "user",
+                        username,
+                        "set",
+                        f"defaultaccount={account}",
+                    ],
+                )
+                for username in done:
+                    logger.info(
+                        "Changed user %s's default account to %s",
+                        username,
+                        account,
+                    )
+                self.record_done(plan.SetDefaultAccount(x, account) for x in done)
+        self.default_accounts.clear()
+
+    async def flush_removals(self) -> None:
+        """Remove users from accounts."""
+        for users, accounts in group_changes(self.to_be_removed):
+            account_list = ",".join(accounts)
+            for users_chunk in chunks(users, self.settings.sacctmgr_batch_size):
+                done = await self.run(
+                    [
+                        "sacctmgr",
+                        "-i",
+                        "remove",
+                        "user",
+                        ",".join(users_chunk),
+                        f"account={account_list}",
+                    ],
+                    users_chunk,
+                    lambda username: [
+                        "sacctmgr",
+                        "-i",
+                        "remove",
+                        "user",
+                        username,
+                        f"account={account_list}",
+                    ],
+                )
+                for username in done:
+                    logger.info(
+                        "Removed user %s from account %s", username, account_list
+                    )
+                self.record_done(
+                    plan.RemoveAssociation(x, y) for x in done for y in accounts
+                )
+        self.to_be_removed.clear()
+
+    async def flush(self) -> None:
+        """Apply all the queued changes."""
+        await self.flush_additions()
+        await self.flush_default_accounts()
+        await self.flush_removals()
@@ -1,7 +1,10 @@
 import pathlib
+import typing
 
 import tap
 
+from . import shard as shard_module
+
 
 class SyncArgParser(tap.Tap):
     """Utility to sync SLURM accounts with LDAP tags."""
@@ -9,3 +12,76 @@ class SyncArgParser(tap.Tap):
     config: pathlib.Path = pathlib.Path("config.toml")
     dry_run: bool = False
     run_forever: bool = False
+    trigger_socket: typing.Optional[pathlib.Path] = None  # Socket for sync requests.
+    user: list[str] = []  # Only sync these users.
+    account: list[str] = []  # Only sync these accounts.
+    user_file: typing.Optional[pathlib.Path] = None  # File of users to sync.
+    account_file: typing.Optional[pathlib.Path] = None  # File of accounts to sync.
+    plan_out: typing.Optional[pathlib.Path] = None  # Write planned changes as JSON.
+    apply_plan: typing.Optional[pathlib.Path] = None  # Apply a saved plan.
+    record: typing.Optional[pathlib.Path] = None  # Save what is read to a directory.
+    replay: typing.Optional[pathlib.Path] = None  # Sync against a recording.
+    metrics_file: typing.Optional[pathlib.Path] = None  # Write metrics after each sync.
+    metrics_port: typing.Optional[int] = None  # Serve metrics on this port.
+    metrics_host: str = "localhost"  # Address to serve metrics on.
+    profile: typing.Optional[pathlib.Path] = None  # Save a profile of each sync here.
+    spans: typing.Optional[pathlib.Path] = None  # Log timings as JSON to this file.
+    shard: typing.Optional[str] = None  # Only sync users in shard i/N.
+    workers: int = 1  # Sync users in this many processes.
+    journal: typing.Optional[pathlib.Path] = None  # Journal changes to resume a sync.
+
+    def configure(self) -> None:
+        """Allow --user and --account to be given more than once."""
+        self.add_argument("--user", action="extend", nargs="+")
+        self.add_argument("--account", action="extend", nargs="+")
+
+    def process_args(self) -> None:
+        """Add users and accounts listed in files, one per line."""
+        if self.user_file is not None:
+            self.user = self.user + self.user_file.read_text().split()
+        if self.account_file is not None:
+            self.account = self.account + self.account_file.read_text().split()
+        if (self.user or self.account) and self.run_forever:
+            self.error("Users and accounts can't be selected when running forever.")
+        if self.targeted and self.plan_out is not None:
+            self.error("--plan_out can only be used for a full sync.")
+        if self.apply_plan is not None and (
+            self.run_forever or self.targeted or self.plan_out is not None
+        ):
+            self.error("--apply_plan can only be used on its own.")
+        if (self.record is not None or self.replay is not None) and self.run_forever:
+            self.error("Syncs can only be recorded or replayed in one-shot mode.")
+        if self.record is not None and self.replay is not None:
+            self.error("--record and --replay can't be used together.")
+        if self.shard is not None:
+            try:
+                shard_module.Shard.parse(self.shard)
+            except ValueError as err:
+                self.error(str(err))
+        if (self.shard is not None or self.workers > 1) and (
+            self.run_forever
+            or self.targeted
+            or self.plan_out is not None
+            or self.apply_plan is not None
+            or self.record is not None
+            or self.replay is not None
+        ):
+            self.error(
+                "--shard and --workers can only be used for a one-shot full sync."
+            )
+        if self.journal is not None and (
+            self.dry_run
+            or self.replay is not None
+            or self.shard is not None
+            or self.workers > 1
+        ):
+            self.error(
+                "--journal can't be used with --dry_run, --replay, --shard or --workers."
+            )
+        if self.workers < 1:
+            self.error("--workers must be at least 1.")
+
+    @property
+    def targeted(self) -> bool:
+        """Whether only some users and accounts are to be synced."""
+        return bool(self.user or self.account)
@@ -8,3 +8,7 @@ class NoUnixUser(UserSyncError):
 
 class NotInRequiredAccounts(UserSyncError):
     """Error raised when the user isn't in a SLURM account which they are required to be in for syncing."""
+
+
+class GrantsUnavailable(UserSyncError):
+    """Error raised when the user's grants could not be fetched from the accounts portal."""
@@ -0,0 +1,327 @@
+import asyncio
+import logging
+import pathlib
+import subprocess as sp
+import tempfile
+import typing
+
+from . import batch, cli
+from . import journal as journal_module
+from . import plan
+from . import settings as settings_module
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+
+def account_command(operation: plan.AccountOperation) -> list[str]:
+    """The sacctmgr command which carries out a change to an account."""
+    if isinstance(operation, plan.CreateAccount):
+        return [
+            "sacctmgr",
+            "-i",
+            "create",
+            "account",
+            f"name={operation.account}",
+            f"parent={operation.parent}",
+            f"fairshare={operation.fairshare}",
+        ]
+    if isinstance(operation, plan.SetParent):
+        change = f"parent={operation.parent}"
+    elif isinstance(operation, plan.SetFairshare):
+        change = f"fairshare={operation.fairshare}"
+    else:
+        change = "maxjobs=0"
+    return [
+        "sacctmgr",
+        "-i",
+        "modify",
+        "account",
+        "where",
+        f"name={operation.account}",
+        "set",
+        change,
+    ]
+
+
+def load_file(cluster: str, creations: typing.Iterable[plan.CreateAccount]) -> str:
+    """Render accounts to be created in the flat file format read by sacctmgr load.
+
+    Accounts are grouped under their parents, in the order they are first used,
+    so parents which are created here come before their children.
+    """
+    children: dict[str, list[plan.CreateAccount]] = {}
+    for creation in creations:
+        children.setdefault(creation.parent, []).append(creation)
+
+    lines = [f"Cluster - '{cluster}'"]
+    for parent, accounts in children.items():
+        lines.append(f"Parent - '{parent}'")
+        lines.extend(
+            f"Account - '{x.account}':Description='{x.account}':Fairshare={x.fairshare}"
+            for x in accounts
+        )
+    return "\n".join(lines) + "\n"
+
+
+def account_levels(
+    operations: typing.Iterable[plan.AccountOperation],
+) -> list[list[list[plan.AccountOperation]]]:
+    """Group changes to accounts into levels, where each level can be made concurrently.
+
+    Within a level there is a list of changes for each account, to be made in order.
+    An account's changes come a level after those of the parent it is being given,
+    if that parent is being created or moved too.
+    Deactivations come last, once any children have been moved away.
+    """
+    by_account: dict[str, list[plan.AccountOperation]] = {}
+    parents: dict[str, str] = {}
+    for operation in operations:
+        by_account.setdefault(operation.account, []).append(operation)
+        if isinstance(operation, (plan.CreateAccount, plan.SetParent)):
+            parents[operation.account] = operation.parent
+
+    def depth(account: str) -> int:
+        depth = 0
+        seen = {account}
+        while parents.get(account) in parents and parents[account] not in seen:
+            account = parents[account]
+            seen.add(account)
+            depth += 1
+        return depth
+
+    levels: dict[int, list[list[plan.AccountOperation]]] = {}
+    deactivations = []
+    for account, account_operations in by_account.items():
+        if all(isinstance(x, plan.DeactivateAccount) for x in account_operations):
+            deactivations.append(account_operations)
+        else:
+            levels.setdefault(depth(account), []).append(account_operations)
+    ordered = [levels[x] for x in sorted(levels)]
+    if deactivations:
+        ordered.append(deactivations)
+    return ordered
+
+
+class Executor:
+    """Apply a plan to SLURM.
+
+    This is the only place which changes SLURM, so decides how changes are ordered and batched.
+    Account changes are made first, loading new accounts in bulk where possible,
+    and otherwise a level of the hierarchy at a time, with the accounts in each level
+    changed concurrently. Then changes to users are grouped into as few sacctmgr commands as possible.
+    If there is a journal, changes are recorded in it before they are made and once they are done.
+    """
+
+    def __init__(
+        self,
+        settings: settings_module.SyncSettings,
+        args: cli.SyncArgParser,
+        runner: utils.CommandRunner,
+        journal: typing.Optional[journal_module.Journal] = None,
+    ) -> None:
+        self.settings = settings
+        self.args = args
+        self.runner = runner
+        self.journal = journal
+        # Users whose changes failed, so they can be synced again next time.
+        self.failed_users: set[str] = set()
+        # Changes to accounts which were tried but failed.
+        self.failed_accounts: set[plan.AccountOperation] = set()
+
+    def record_done(self, operations: typing.Iterable[plan.Operation]) -> None:
+        if self.journal is not None:
+            self.journal.done(operations)
+
+    async def apply_account_operation(self, operation: plan.AccountOperation) -> None:
+        """Make a single change to an account."""
+        try:
+            cmd_output = await self.runner.run(account_command(operation))
+        except sp.CalledProcessError:
+            self.failed_accounts.add(operation)
+            raise
+        logger.info("Did %s", operation.describe())
+        self.record_done([operation])
+        if cmd_output.stderr:
+            logger.error(cmd_output.stderr)
+        if cmd_output.stdout:
+            logger.debug(cmd_output.stdout)
+
+    async def cluster_name(self) -> typing.Optional[str]:
+        """Name of the cluster to load accounts into, if it can be worked out."""
+        if self.settings.slurm_cluster is not None:
+            return self.settings.slurm_cluster
+        try:
+            cmd_output = await self.runner.run(
+                [
+                    "sacctmgr",
+                    "show",
+                    "cluster",
+                    "format=cluster",
+                    "--parsable2",
+                    "--noheader",
+                ]
+            )
+        except sp.CalledProcessError:
+            logger.error("Could not find the cluster to load accounts into.")
+            return None
+        clusters = cmd_output.stdout.decode("utf-8").split()
+        if len(clusters) != 1:
+            logger.warning(
+                "Found %s clusters, set slurm_cluster to load accounts in bulk.",
+                len(clusters),
+            )
+            return None
+        return clusters[0]
+
+    async def load_accounts(self, creations: list[plan.CreateAccount]) -> bool:
+        """Create accounts in a single sacctmgr load transaction.
+
+        Returns False if they could not be loaded, so must be created one at a time.
+        """
+        cluster = await self.cluster_name()
+        if cluster is None:
+            return False
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "accounts.cfg"
+            path.write_text(load_file(cluster, creations))
+            try:
+                cmd_output = await self.runner.run(
+                    ["sacctmgr", "-i", "load", f"file={path}"]
+                )
+            except sp.CalledProcessError:
+                logger.error(
+                    "Could not load %s accounts, creating them one at a time.",
+                    len(creations),
+                )
+                return False
+        logger.info("Loaded %s accounts into cluster %s", len(creations), cluster)
+        self.record_done(creations)
+        if cmd_output.stderr:
+            logger.error(cmd_output.stderr)
+        if cmd_output.stdout:
+            logger.debug(cmd_output.stdout)
+        return True
+
+    async def apply_account_operations(
+        self, operations: list[plan.AccountOperation]
+    ) -> None:
+        """Make the changes to accounts.
+
+        If enough accounts are being created, they are all created first in a single transaction.
+        The rest of the changes are made a level at a time, so parents are created or moved
+        before their children, with the accounts in each level changed concurrently.
+        """
+        creations = [x for x in operations if isinstance(x, plan.CreateAccount)]
+        if (
+            self.settings.sacctmgr_load_threshold
+            and len(creations) >= self.settings.sacctmgr_load_threshold
+            and await self.load_accounts(creations)
+        ):
+            operations = [
+                x for x in operations if not isinstance(x, plan.CreateAccount)
+            ]
+
+        async def apply_in_order(
+            account_operations: list[plan.AccountOperation],
+        ) -> None:
+            for operation in account_operations:
+                await self.apply_account_operation(operation)
+
+        for level in account_levels(operations):
+            await asyncio.gather(*(apply_in_order(x) for x in level))
+
+    async def apply_user_operations(self, operations: list[plan.UserOperation]) -> None:
+        """Make the changes to users in bulk."""
+        user_batch = batch.AssociationBatch(
+            self.settings, self.args, self.runner, self.journal
+        )
+        for operation in operations:
+            if isinstance(operation, plan.AddAssociation):
+                user_batch.add_user_to_account(operation.user, operation.account)
+            elif isinstance(operation, plan.SetDefaultAccount):
+                user_batch.update_default_account(operation.user, operation.account)
+            else:
+                user_batch.remove_user_from_account(operation.user, operation.account)
+        await user_batch.flush()
+        self.failed_users |= user_batch.failed
+
+    async def apply(self, changes: plan.Plan, journaled: bool = False) -> None:
+        """Apply all the changes in a plan.
+
+        They are recorded in the journal as planned first, unless they are already there.
+        """
+        if self.args.dry_run:
+            for operation in changes.operations:
+                logger.warning(
+                    "Would %s, but we are in dry run mode so not doing anything.",
+                    operation.describe(),
+                )
+            return
+
+        logger.info("Applying %s changes.", len(changes))
+        if self.journal is not None and not journaled:
+            self.journal.planned(changes.operations)
+        await self.apply_account_operations(changes.account_operations)
+        await self.apply_user_operations(changes.user_operations)
+
+    async def resume(self) -> int:
+        """Make the changes left in the journal by a sync which was interrupted.
+
+        The journal is rewritten to hold only those changes first, so it doesn't grow
+        if resuming is interrupted too. Changes which were tried but still can't be made
+        are logged and set aside, rather than being tried again every time.
+        Changes which were skipped because an account change failed are left in the journal
+        for the next time.
+        Returns the number of changes resumed.
+        """
+        if self.journal is None:
+            return 0
+        leftover = self.journal.pending()
+        if not leftover:
+            self.journal.finish()
+            return 0
+
+        logger.warning(
+            "Resuming %s changes left over from an interrupted sync.", len(leftover)
+        )
+        self.journal.compact(leftover)
+        self.failed_accounts.clear()
+        already_failed = set(self.failed_users)
+        try:
+            await self.apply(leftover, journaled=True)
+        except sp.CalledProcessError as err:
+            logger.error("Could not resume the interrupted sync: %s", err)
+        failed_users = self.failed_users - already_failed
+
+        # Only changes which were tried are set aside, the rest are still to be made.
+        pending = self.journal.pending()
+        failed, skipped = plan.Plan(), plan.Plan()
+        for account_operation in pending.account_operations:
+            if account_operation in self.failed_accounts:
+                failed.add(account_operation)
+            else:
+                skipped.add(account_operation)
+        for user_operation in pending.user_operations:
+            if user_operation.user in failed_users:
+                failed.add(user_operation)
+            else:
+                skipped.add(user_operation)
+        if failed:
+            logger.error(
+                "Setting aside %s changes which could not be made, in %s: %s",
+                len(failed),
+                self.journal.failed_path,
+                "; ".join(x.describe() for x in failed.operations),
+            )
+            self.journal.set_aside(failed)
+        if skipped:
+            logger.warning(
+                "Skipped %s changes after a change to an account failed, "
+                "leaving them to be resumed next time.",
+                len(skipped),
+            )
+            self.journal.compact(skipped)
+        else:
+            self.journal.finish()
+        return len(leftover) - len(skipped)
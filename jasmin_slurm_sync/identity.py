@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import pwd
+import time
+import typing
+
+from . import settings as settings_module
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+
+class UnixUsers:
+    """Look up whether users have Unix accounts, without blocking the event loop.
+
+    Answers are cached for ttl seconds if the user exists, and negative_ttl seconds if not,
+    so the cache can be kept between syncs. It can be filled in bulk with prefetch,
+    either by listing every user, if enumeration is on, or by looking them up concurrently.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600,
+        negative_ttl: float = 300,
+        enumerate_users: bool = False,
+        max_workers: int = 8,
+    ) -> None:
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.enumerate_users = enumerate_users
+        self.semaphore = asyncio.Semaphore(max_workers)
+        # Whether each user exists, and when that answer expires.
+        self.cache: dict[str, tuple[bool, float]] = {}
+
+    @classmethod
+    def from_settings(cls, settings: settings_module.SyncSettings) -> "UnixUsers":
+        """Create the cache from the settings."""
+        return cls(
+            ttl=settings.unix_user_ttl,
+            negative_ttl=settings.unix_user_negative_ttl,
+            enumerate_users=settings.unix_user_enumerate,
+            max_workers=settings.unix_user_lookup_workers,
+        )
+
+    def remember(self, username: str, exists: bool, now: float) -> None:
+        self.cache[username] = (
+            exists,
+            now + (self.ttl if exists else self.negative_ttl),
+        )
+
+    def cached(self, username: str) -> typing.Optional[bool]:
+        """Whether a user exists, if that is known and hasn't expired."""
+        entry = self.cache.get(username)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    async def lookup(self, username: str) -> bool:
+        """Check whether a user has a Unix account, ignoring the cache."""
+        async with self.semaphore:
+            with tracing.Span("getpwnam", user=username):
+                try:
+                    await asyncio.to_thread(pwd.getpwnam, username)
+                except KeyError:
+                    return False
+        return True
+
+    async def exists(self, username: str) -> bool:
+        """Check whether a user has a Unix account."""
+        exists = self.cached(username)
+        if exists is None:
+            exists = await self.lookup(username)
+            self.remember(username, exists, time.monotonic())
+        return exists
+
+    async def prefetch(self, usernames: typing.Iterable[str]) -> None:
+        """Fill the cache for users whose answers are missing or have expired."""
+        missing = [x for x in usernames if self.cached(x) is None]
+        if not missing:
+            return
+        if self.enumerate_users:
+            with tracing.Span("getpwall", users=len(missing)):
+                names = {x.pw_name for x in await asyncio.to_thread(pwd.getpwall)}
+            now = time.monotonic()
+            for username in missing:
+                self.remember(username, username in names, now)
+        else:
+            found = await asyncio.gather(*(self.lookup(x) for x in missing))
+            now = time.monotonic()
+            for username, exists in zip(missing, found):
+                self.remember(username, exists, now)
+        logger.debug("Looked up %s Unix users.", len(missing))
@@ -0,0 +1,103 @@
+import collections
+import json
+import logging
+import os
+import pathlib
+import typing
+
+from . import plan
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    """Durable record of the changes being made to SLURM, so an interrupted sync can be resumed.
+
+    The journal is a file of JSON lines, which is only ever appended to during a sync.
+    Changes are written as planned before they are applied, and as done once they have been,
+    and each write is synced to disk before carrying on. The changes which were planned
+    but not done are the ones left over when a sync was interrupted. Once a sync succeeds
+    the journal is emptied, so it only ever holds the changes of the current sync.
+    Changes which still can't be made when they are resumed are set aside in a file
+    next to the journal, ending in .failed, so they can be looked into.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self.failed_path = path.with_name(path.name + ".failed")
+
+    def write(
+        self, record: dict[str, typing.Any], path: typing.Optional[pathlib.Path] = None
+    ) -> None:
+        with (path or self.path).open("a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def planned(self, operations: typing.Iterable[plan.Operation]) -> None:
+        """Record changes which are about to be made."""
+        self.write({"planned": [plan.operation_to_json(x) for x in operations]})
+
+    def done(self, operations: typing.Iterable[plan.Operation]) -> None:
+        """Record changes which have been made."""
+        self.write({"done": [plan.operation_to_json(x) for x in operations]})
+
+    def records(self) -> typing.Iterator[dict[str, typing.Any]]:
+        """Read the journal, skipping a last line which was cut short by a crash."""
+        try:
+            lines = self.path.read_text().splitlines()
+        except FileNotFoundError:
+            return
+        for i, line in enumerate(lines):
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                if i != len(lines) - 1:
+                    raise
+                logger.warning(
+                    "Ignoring an incomplete line at the end of %s", self.path
+                )
+
+    def pending(self) -> plan.Plan:
+        """The changes which were planned but not done, in the order they were planned."""
+        planned: list[plan.Operation] = []
+        done: collections.Counter[plan.Operation] = collections.Counter()
+        for record in self.records():
+            planned.extend(
+                plan.operation_from_json(x) for x in record.get("planned", [])
+            )
+            done.update(plan.operation_from_json(x) for x in record.get("done", []))
+
+        pending = plan.Plan()
+        for operation in planned:
+            if done[operation]:
+                done[operation] -= 1
+            else:
+                pending.add(operation)
+        return pending
+
+    def compact(self, pending: plan.Plan) -> None:
+        """Replace the journal with just the changes which are still pending."""
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with tmp_path.open("w") as f:
+            f.write(
+                json.dumps(
+                    {"planned": [plan.operation_to_json(x) for x in pending.operations]}
+                )
+                + "\n"
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def set_aside(self, failed: plan.Plan) -> None:
+        """Record changes which could not be made, so they are no longer resumed."""
+        self.write(
+            {"failed": [plan.operation_to_json(x) for x in failed.operations]},
+            self.failed_path,
+        )
+
+    def finish(self) -> None:
+        """Empty the journal once a sync has succeeded."""
+        with self.path.open("w") as f:
+            os.fsync(f.fileno())
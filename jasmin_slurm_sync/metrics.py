@@ -0,0 +1,250 @@
+import asyncio
+import bisect
+import logging
+import math
+import os
+import pathlib
+import tempfile
+import time
+import typing
+
+from . import tracing
+
+logger = logging.getLogger(__name__)
+
+Labels = tuple[tuple[str, str], ...]
+MetricT = typing.TypeVar("MetricT", bound="Metric")
+
+# Buckets for durations in seconds, from a quick read to a slow write.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """A Prometheus metric, with a value for each combination of labels."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str) -> None:
+        self.name = name
+        self.description = description
+        self.values: dict[Labels, float] = {}
+
+    @staticmethod
+    def labels(labels: dict[str, str]) -> Labels:
+        return tuple(sorted(labels.items()))
+
+    def get(self, **labels: str) -> float:
+        return self.values.get(self.labels(labels), 0)
+
+    def clear(self) -> None:
+        """Forget every value, so none are left over from an earlier sync."""
+        self.values.clear()
+
+    def samples(self) -> typing.Iterator[tuple[str, Labels, float]]:
+        for labels, value in sorted(self.values.items()):
+            yield self.name, labels, value
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.description}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(
+            f"{name}{format_labels(labels)} {format_value(value)}"
+            for name, labels, value in self.samples()
+        )
+        return lines
+
+
+class Counter(Metric):
+    """A value which only goes up."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self.labels(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value which can be set to anything."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[self.labels(labels)] = value
+
+
+class Histogram(Metric):
+    """Counts of observations falling into buckets, with their sum."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        buckets: typing.Sequence[float] = DURATION_BUCKETS,
+    ) -> None:
+        super().__init__(name, description)
+        self.buckets = list(buckets)
+        self.counts: dict[Labels, list[int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self.labels(labels)
+        counts = self.counts.setdefault(key, [0] * (len(self.buckets) + 1))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.values[key] = self.values.get(key, 0) + value
+
+    def samples(self) -> typing.Iterator[tuple[str, Labels, float]]:
+        for labels, counts in sorted(self.counts.items()):
+            total = 0
+            for bound, count in zip([*self.buckets, math.inf], counts):
+                total += count
+                yield f"{self.name}_bucket", (
+                    *labels,
+                    ("le", format_value(bound)),
+                ), total
+            yield f"{self.name}_sum", labels, self.values[labels]
+            yield f"{self.name}_count", labels, total
+
+
+class Registry:
+    """A collection of metrics, rendered together in the Prometheus text format."""
+
+    def __init__(self) -> None:
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: MetricT) -> MetricT:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self.register(Counter(name, description))
+
+    def gauge(self, name: str, description: str) -> Gauge:
+        return self.register(Gauge(name, description))
+
+    def histogram(self, name: str, description: str) -> Histogram:
+        return self.register(Histogram(name, description))
+
+    def render(self) -> str:
+        return "\n".join(line for x in self.metrics for line in x.render()) + "\n"
+
+    def write(self, path: pathlib.Path) -> None:
+        """Write the metrics for the node exporter's textfile collector.
+
+        The file is replaced atomically, so it is never read half written.
+        """
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        with os.fdopen(fd, "w") as f:
+            f.write(self.render())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Answer a single HTTP request with the metrics."""
+        try:
+            # Read the request line and headers, which are ignored.
+            while (await reader.readline()).strip():
+                pass
+            body = self.render().encode("utf-8")
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                + f"Content-Length: {len(body)}\r\n".encode("ascii")
+                + b"Connection: close\r\n\r\n"
+                + body
+            )
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> asyncio.AbstractServer:
+        """Serve the metrics over HTTP for Prometheus to scrape."""
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        logger.info("Serving metrics on %s:%s", host, port)
+        return server
+
+
+REGISTRY = Registry()
+
+PHASE_DURATION = REGISTRY.gauge(
+    "jasmin_slurm_sync_phase_duration_seconds",
+    "Time taken by each phase of the last sync.",
+)
+CYCLE_DURATION = REGISTRY.gauge(
+    "jasmin_slurm_sync_cycle_duration_seconds", "Time taken by the last sync."
+)
+SLEEP_TIME = REGISTRY.gauge(
+    "jasmin_slurm_sync_daemon_sleep_seconds", "Time to sleep between syncs."
+)
+LAST_SUCCESS = REGISTRY.gauge(
+    "jasmin_slurm_sync_last_success_timestamp_seconds",
+    "When the last sync finished successfully.",
+)
+EXAMINED = REGISTRY.gauge(
+    "jasmin_slurm_sync_examined", "Users and accounts compared in the last sync."
+)
+CHANGED = REGISTRY.gauge(
+    "jasmin_slurm_sync_changed", "Users and accounts changed by the last sync."
+)
+SACCTMGR_CALLS = REGISTRY.counter(
+    "jasmin_slurm_sync_sacctmgr_calls_total", "sacctmgr commands run."
+)
+SACCTMGR_FAILURES = REGISTRY.counter(
+    "jasmin_slurm_sync_sacctmgr_failures_total",
+    "sacctmgr commands which failed for a single user.",
+)
+SACCTMGR_DURATION = REGISTRY.histogram(
+    "jasmin_slurm_sync_sacctmgr_duration_seconds", "Time taken by sacctmgr commands."
+)
+RATELIMIT_WAIT = REGISTRY.counter(
+    "jasmin_slurm_sync_ratelimit_wait_seconds_total",
+    "Time spent waiting for the sacctmgr rate limit.",
+)
+PORTAL_DURATION = REGISTRY.histogram(
+    "jasmin_slurm_sync_portal_request_duration_seconds",
+    "Time taken by requests to the portals.",
+)
+PORTAL_ERRORS = REGISTRY.counter(
+    "jasmin_slurm_sync_portal_errors_total", "Failed requests to the portals."
+)
+
+
+class Timer:
+    """Context manager which measures how long its block takes."""
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+        return self
+
+    def __exit__(self, *exc_info: typing.Any) -> None:
+        self.elapsed = time.perf_counter() - self.started
+
+
+async def timed(phase: str, awaitable: typing.Awaitable[typing.Any]) -> typing.Any:
+    """Await something, recording how long it took as a phase of the sync."""
+    with Timer() as timer, tracing.Span("phase", phase=phase):
+        result = await awaitable
+    PHASE_DURATION.set(timer.elapsed, phase=phase)
+    return result
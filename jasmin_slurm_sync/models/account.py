@@ -2,74 +2,86 @@ import collections
 import logging
 import typing
 
-from .. import cli
+from .. import cli, plan
 from .. import settings as settings_module
-from .. import utils
 
 logger = logging.getLogger(__name__)
 
 AccountInfo = collections.namedtuple("AccountInfo", ["name", "parent", "fairshare"])
 
 
+class AccountIndex:
+    """Existing and expected SLURM accounts, indexed by name.
+
+    Built once per sync and shared by all the Account models.
+    """
+
+    __slots__ = ("expected", "existing")
+
+    def __init__(
+        self,
+        expected_slurm_accounts: typing.Iterable[AccountInfo],
+        existing_slurm_accounts: typing.Iterable[AccountInfo],
+    ) -> None:
+        self.expected = {x.name: x for x in expected_slurm_accounts}
+        self.existing = {x.name: x for x in existing_slurm_accounts}
+
+    def depth(self, account_name: str) -> int:
+        """How far an account is below root, once SLURM matches the portal.
+
+        Accounts which won't be in the portal are placed under their existing parents,
+        and accounts which are in neither directly under root.
+        """
+        depth = 0
+        seen = set()
+        while account_name != "root" and account_name not in seen:
+            seen.add(account_name)
+            depth += 1
+            info = self.expected.get(account_name) or self.existing.get(account_name)
+            if info is None:
+                break
+            account_name = info.parent
+        return depth
+
+    def levels(self, account_names: typing.Iterable[str]) -> list[list[str]]:
+        """Group accounts by depth, from the top of the hierarchy down."""
+        by_depth: dict[int, list[str]] = collections.defaultdict(list)
+        for name in account_names:
+            by_depth[self.depth(name)].append(name)
+        return [sorted(by_depth[x]) for x in sorted(by_depth)]
+
+
 class Account:
     """Representation of SLURM accounts themselves."""
 
+    __slots__ = ("settings", "args", "changes", "account_name", "existing", "expected")
+
     def __init__(
         self,
         account_name: str,
-        expected_slurm_accounts: set[AccountInfo],
-        existing_slurm_accounts: set[AccountInfo],
+        index: AccountIndex,
         settings: settings_module.SyncSettings,
         args: cli.SyncArgParser,
+        changes: plan.Plan,
     ):
         self.settings = settings
         self.args = args
+        # Changes to the account are added to the plan, and applied by the executor.
+        self.changes = changes
 
         self.account_name = account_name
 
-        # Help out the type checker
-        self.existing: typing.Optional[AccountInfo]
-        self.expected: typing.Optional[AccountInfo]
-
         # Find the details of the existing and expected accounts.
-        if existing := [
-            x for x in existing_slurm_accounts if x.name == self.account_name
-        ]:
-            [self.existing] = existing
-        else:
-            self.existing = None
-        if expected := [
-            x for x in expected_slurm_accounts if x.name == self.account_name
-        ]:
-            [self.expected] = expected
-        else:
-            self.expected = None
+        self.existing: typing.Optional[AccountInfo] = index.existing.get(account_name)
+        self.expected: typing.Optional[AccountInfo] = index.expected.get(account_name)
 
     def create_account(self, expected: AccountInfo) -> None:
         if self.account_name not in self.settings.unmanaged_accounts:
-            args = [
-                "sacctmgr",
-                "-i",
-                "create",
-                "account",
-                f"name={self.account_name}",
-                f"parent={expected.parent}",
-                f"fairshare={expected.fairshare}",
-            ]
-            if self.args.dry_run:
-                logger.warning(
-                    "Would create account %s, but we are in dry run mode so not doing anything.",
-                    self.account_name,
-                )
-            else:
-                cmd_output = utils.run_ratelimited(
-                    args, capture_output=True, check=True
+            self.changes.add(
+                plan.CreateAccount(
+                    self.account_name, expected.parent, expected.fairshare
                 )
-                logger.info("Created account %s", self.account_name)
-                if cmd_output.stderr:
-                    logger.error(cmd_output.stderr)
-                if cmd_output.stdout:
-                    logger.debug(cmd_output.stdout)
+            )
         else:
             logger.info(
                 "Not creating account %s, because account is not managed.",
@@ -78,30 +90,7 @@ class Account:
 
     def deactivate_account(self) -> None:
         if self.account_name not in self.settings.unmanaged_accounts:
-            args = [
-                "sacctmgr",
-                "-i",
-                "modify",
-                "account",
-                "where",
-                f"name={self.account_name}",
-                "set",
-                "maxjobs=0",
-            ]
-            if self.args.dry_run:
-                logger.warning(
-                    "Would deactivate account %s, but we are in dry run mode so not doing anything.",
-                    self.account_name,
-                )
-            else:
-                cmd_output = utils.run_ratelimited(
-                    args, capture_output=True, check=True
-                )
-                logger.info("Deactivated account %s", self.account_name)
-                if cmd_output.stderr:
-                    logger.error(cmd_output.stderr)
-                if cmd_output.stdout:
-                    logger.debug(cmd_output.stdout)
+            self.changes.add(plan.DeactivateAccount(self.account_name))
         else:
             logger.info(
                 "Not deactivating account %s, because account is not managed.",
@@ -110,36 +99,13 @@ class Account:
 
     def update_fairshare(self, expected: AccountInfo) -> None:
         if self.account_name not in self.settings.unmanaged_accounts:
-            args = [
-                "sacctmgr",
-                "-i",
-                "modify",
-                "account",
-                "where",
-                f"name={self.account_name}",
-                "set",
-                f"fairshare={expected.fairshare}",
-            ]
-            if self.args.dry_run:
-                logger.warning(
-                    "Would change fairshare of account %s to %s (currently %s), but we are in dry run mode so not doing anything.",
-                    self.account_name,
-                    expected.fairshare,
-                    getattr(self.existing, "fairshare", None),
-                )
-            else:
-                cmd_output = utils.run_ratelimited(
-                    args, capture_output=True, check=True
-                )
-                logger.info(
-                    "Changed fairshare of account %s to %s",
-                    self.account_name,
-                    expected.fairshare,
-                )
-                if cmd_output.stderr:
-                    logger.error(cmd_output.stderr)
-                if cmd_output.stdout:
-                    logger.debug(cmd_output.stdout)
+            logger.debug(
+                "Fairshare of account %s is %s, should be %s.",
+                self.account_name,
+                getattr(self.existing, "fairshare", None),
+                expected.fairshare,
+            )
+            self.changes.add(plan.SetFairshare(self.account_name, expected.fairshare))
         else:
             logger.info(
                 "Not changing fairshare of account %s to %s, because account is not managed.",
@@ -149,36 +115,13 @@ class Account:
 
     def update_parent(self, expected: AccountInfo) -> None:
         if self.account_name not in self.settings.unmanaged_accounts:
-            args = [
-                "sacctmgr",
-                "-i",
-                "modify",
-                "account",
-                "where",
-                f"name={self.account_name}",
-                "set",
-                f"parent={expected.parent}",
-            ]
-            if self.args.dry_run:
-                logger.warning(
-                    "Would change parent of account %s to %s (currently %s), but we are in dry run mode so not doing anything.",
-                    self.account_name,
-                    expected.parent,
-                    getattr(self.existing, "parent", None),
-                )
-            else:
-                cmd_output = utils.run_ratelimited(
-                    args, capture_output=True, check=True
-                )
-                logger.info(
-                    "Changed parent of account %s to %s.",
-                    self.account_name,
-                    expected.parent,
-                )
-                if cmd_output.stderr:
-                    logger.error(cmd_output.stderr)
-                if cmd_output.stdout:
-                    logger.debug(cmd_output.stdout)
+            logger.debug(
+                "Parent of account %s is %s, should be %s.",
+                self.account_name,
+                getattr(self.existing, "parent", None),
+                expected.parent,
+            )
+            self.changes.add(plan.SetParent(self.account_name, expected.parent))
         else:
             logger.info(
                 "Not changing parent of account %s to %s, because account is not managed.",
@@ -186,8 +129,8 @@ class Account:
                 expected.parent,
             )
 
-    def sync_account(self) -> None:
-        """Sync account to make sure SLURM is the same as the projects portal."""
+    def plan_sync(self) -> None:
+        """Plan the changes which make SLURM the same as the projects portal."""
         # If it does exist but shouldn't, deactivate it.
         if self.expected is None:
             self.deactivate_account()
@@ -0,0 +1,159 @@
+import logging
+import re
+import sys
+import typing
+
+from .. import utils
+from . import account
+
+logger = logging.getLogger(__name__)
+
+# Fields requested from sacctmgr show associations, in order.
+ASSOCIATION_FORMAT = ["account", "parentname", "user", "fairshare"]
+# Fields requested from sacctmgr show user, in order.
+USER_FORMAT = ["user", "defaultaccount"]
+# Fields requested from sacctmgr list transactions, in order.
+TRANSACTION_FORMAT = ["action", "where", "info"]
+
+# Names quoted in the where and info fields of transactions, eg. user='alice'.
+# Account associations have user='', which names no user.
+QUOTED_NAME = re.compile(r"\b(user|acct|name)\s*=\s*'([^']+)'")
+
+
+class AssociationSnapshot:
+    """In-memory, indexed copy of the SLURM association table.
+
+    Built once from sacctmgr's parsable output, and queried by name.
+    Can be kept up to date by re-reading only the users and accounts which have changed.
+    Users with the same accounts share a single frozenset of them.
+    """
+
+    def __init__(
+        self,
+        accounts: dict[str, account.AccountInfo],
+        user_accounts: dict[str, frozenset[str]],
+        default_accounts: dict[str, str],
+    ) -> None:
+        self.accounts = accounts
+        self.user_accounts = user_accounts
+        self.default_accounts = default_accounts
+        self.interner = utils.Interner()
+
+    @staticmethod
+    def association_rows(
+        associations_output: bytes,
+    ) -> typing.Iterator[tuple[str, str, str, str]]:
+        """Split the output of sacctmgr show associations --parsable2 into rows."""
+        for line in associations_output.decode("utf-8").splitlines():
+            fields = line.split("|")
+            if len(fields) != len(ASSOCIATION_FORMAT):
+                logger.debug("Ignoring unexpected association line %s", line)
+                continue
+            account_name, parent, username, fairshare = map(sys.intern, fields)
+            yield account_name, parent, username, fairshare
+
+    @staticmethod
+    def user_rows(users_output: bytes) -> typing.Iterator[tuple[str, str]]:
+        """Split the output of sacctmgr show user --parsable2 into rows."""
+        for line in users_output.decode("utf-8").splitlines():
+            fields = line.split("|")
+            if len(fields) != len(USER_FORMAT):
+                logger.debug("Ignoring unexpected user line %s", line)
+                continue
+            username, default_account = map(sys.intern, fields)
+            yield username, default_account
+
+    def add_associations(self, associations_output: bytes) -> None:
+        """Add the associations from sacctmgr's output to the snapshot.
+
+        Association rows without a user describe accounts and their place in the hierarchy,
+        rows with a user are the user's membership of an account.
+        """
+        new_accounts: dict[str, set[str]] = {}
+        for account_name, parent, username, fairshare in self.association_rows(
+            associations_output
+        ):
+            if username:
+                new_accounts.setdefault(username, set()).add(account_name)
+            # Accounts with no parent are the root of the tree: it isn't managed.
+            elif parent:
+                self.accounts[account_name] = account.AccountInfo(
+                    name=account_name, parent=parent, fairshare=int(fairshare)
+                )
+        for username, account_names in new_accounts.items():
+            self.user_accounts[username] = self.interner(
+                self.user_accounts.get(username, frozenset()) | account_names
+            )
+
+    @classmethod
+    def parse(
+        cls, associations_output: bytes, users_output: bytes
+    ) -> "AssociationSnapshot":
+        """Create the snapshot from the output of sacctmgr --parsable2 --noheader."""
+        snapshot = cls({}, {}, dict(cls.user_rows(users_output)))
+        snapshot.add_associations(associations_output)
+        return snapshot
+
+    def replace_users(
+        self,
+        usernames: typing.Iterable[str],
+        associations_output: bytes,
+        users_output: bytes,
+    ) -> None:
+        """Replace everything known about some users with a fresh read of them."""
+        for username in usernames:
+            self.user_accounts.pop(username, None)
+            self.default_accounts.pop(username, None)
+        self.add_associations(associations_output)
+        self.default_accounts.update(self.user_rows(users_output))
+
+    def replace_accounts(
+        self, account_names: typing.Iterable[str], associations_output: bytes
+    ) -> None:
+        """Replace everything known about some accounts with a fresh read of them.
+
+        This includes which users are members of the accounts.
+        """
+        account_names = set(account_names)
+        for name in account_names:
+            self.accounts.pop(name, None)
+        for username, user_accounts in self.user_accounts.items():
+            if user_accounts & account_names:
+                self.user_accounts[username] = self.interner(
+                    user_accounts - account_names
+                )
+        self.add_associations(associations_output)
+
+
+def changed_entities(
+    transactions_output: bytes,
+) -> typing.Optional[tuple[set[str], set[str]]]:
+    """Work out which users and accounts are changed by a list of sacctmgr transactions.
+
+    Returns None if any transaction could have changed associations,
+    but it is not clear which ones, in which case the snapshot must be reloaded.
+    """
+    users: set[str] = set()
+    accounts: set[str] = set()
+    for line in transactions_output.decode("utf-8").splitlines():
+        # The where clause can contain |, so only split off the action.
+        action, _, details = line.partition("|")
+        if "Cluster" in action:
+            logger.info("Transaction %s affects every association.", action)
+            return None
+        if not any(x in action for x in ["Association", "User", "Account"]):
+            continue
+
+        names = QUOTED_NAME.findall(details)
+        found = False
+        for key, name in names:
+            if key == "user" or (key == "name" and "User" in action):
+                users.add(name)
+                found = True
+            elif key == "acct" or (key == "name" and "Account" in action):
+                accounts.add(name)
+                found = True
+        if not found:
+            logger.info("Could not tell what transaction changed: %s", line)
+            return None
+    return users, accounts
@@ -0,0 +1,194 @@
+import dataclasses
+import json
+import pathlib
+import typing
+
+# Version of the JSON plan format.
+PLAN_VERSION = 1
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class CreateAccount:
+    """Create a SLURM account."""
+
+    op: typing.ClassVar[str] = "create_account"
+
+    account: str
+    parent: str
+    fairshare: int
+
+    def describe(self) -> str:
+        return f"create account {self.account} under {self.parent} with fairshare {self.fairshare}"
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class SetParent:
+    """Move a SLURM account to a different parent."""
+
+    op: typing.ClassVar[str] = "set_parent"
+
+    account: str
+    parent: str
+
+    def describe(self) -> str:
+        return f"change parent of account {self.account} to {self.parent}"
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class SetFairshare:
+    """Change the fairshare of a SLURM account."""
+
+    op: typing.ClassVar[str] = "set_fairshare"
+
+    account: str
+    fairshare: int
+
+    def describe(self) -> str:
+        return f"change fairshare of account {self.account} to {self.fairshare}"
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class DeactivateAccount:
+    """Stop jobs being run in a SLURM account."""
+
+    op: typing.ClassVar[str] = "deactivate_account"
+
+    account: str
+
+    def describe(self) -> str:
+        return f"deactivate account {self.account}"
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class AddAssociation:
+    """Add a user to a SLURM account."""
+
+    op: typing.ClassVar[str] = "add_association"
+
+    user: str
+    account: str
+
+    def describe(self) -> str:
+        return f"add user {self.user} to account {self.account}"
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class SetDefaultAccount:
+    """Change a user's default SLURM account."""
+
+    op: typing.ClassVar[str] = "set_default_account"
+
+    user: str
+    account: str
+
+    def describe(self) -> str:
+        return f"change user {self.user}'s default account to {self.account}"
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class RemoveAssociation:
+    """Remove a user from a SLURM account."""
+
+    op: typing.ClassVar[str] = "remove_association"
+
+    user: str
+    account: str
+
+    def describe(self) -> str:
+        return f"remove user {self.user} from account {self.account}"
+
+
+AccountOperation = typing.Union[
+    CreateAccount, SetParent, SetFairshare, DeactivateAccount
+]
+UserOperation = typing.Union[AddAssociation, SetDefaultAccount, RemoveAssociation]
+Operation = typing.Union[AccountOperation, UserOperation]
+
+# Operation classes by the name used for them in JSON.
+OPERATIONS: dict[str, type[Operation]] = {
+    CreateAccount.op: CreateAccount,
+    SetParent.op: SetParent,
+    SetFairshare.op: SetFairshare,
+    DeactivateAccount.op: DeactivateAccount,
+    AddAssociation.op: AddAssociation,
+    SetDefaultAccount.op: SetDefaultAccount,
+    RemoveAssociation.op: RemoveAssociation,
+}
+
+
+def operation_to_json(operation: Operation) -> dict[str, typing.Any]:
+    """Convert an operation to something which can be serialised as JSON."""
+    return {"op": operation.op, **dataclasses.asdict(operation)}
+
+
+def operation_from_json(item: dict[str, typing.Any]) -> Operation:
+    """Create an operation from the output of operation_to_json."""
+    fields = dict(item)
+    try:
+        operation_class = OPERATIONS[fields.pop("op")]
+    except KeyError as err:
+        raise ValueError(f"Unknown operation {item}") from err
+    try:
+        return operation_class(**fields)
+    except TypeError as err:
+        raise ValueError(f"Invalid operation {item}") from err
+
+
+class Plan:
+    """Ordered list of the changes needed to make SLURM match the portals.
+
+    Account changes are kept in the order they were planned, so parents can be created
+    before their children. Changes to users are applied after all the account changes.
+    """
+
+    def __init__(self, operations: typing.Iterable[Operation] = ()) -> None:
+        self.account_operations: list[AccountOperation] = []
+        self.user_operations: list[UserOperation] = []
+        for operation in operations:
+            self.add(operation)
+
+    def add(self, operation: Operation) -> None:
+        """Add an operation to the end of the plan."""
+        if isinstance(
+            operation, (AddAssociation, SetDefaultAccount, RemoveAssociation)
+        ):
+            self.user_operations.append(operation)
+        else:
+            self.account_operations.append(operation)
+
+    @property
+    def operations(self) -> list[Operation]:
+        """All the operations in the order they will be applied."""
+        return [*self.account_operations, *self.user_operations]
+
+    def changed(self) -> tuple[set[str], set[str]]:
+        """The users and accounts which the plan changes."""
+        return {x.user for x in self.user_operations}, {
+            x.account for x in self.account_operations
+        }
+
+    def __len__(self) -> int:
+        return len(self.account_operations) + len(self.user_operations)
+
+    def to_json(self) -> dict[str, typing.Any]:
+        """Convert the plan to something which can be serialised as JSON."""
+        return {
+            "version": PLAN_VERSION,
+            "operations": [operation_to_json(x) for x in self.operations],
+        }
+
+    @classmethod
+    def from_json(cls, data: dict[str, typing.Any]) -> "Plan":
+        """Create a plan from the output of to_json."""
+        if data.get("version") != PLAN_VERSION:
+            raise ValueError(f"Unsupported plan version {data.get('version')}")
+        return cls(operation_from_json(x) for x in data["operations"])
+
+    def dump(self, path: pathlib.Path) -> None:
+        """Save the plan to a JSON file."""
+        path.write_text(json.dumps(self.to_json(), indent=2) + "\n")
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> "Plan":
+        """Load a plan saved by dump."""
+        return cls.from_json(json.loads(path.read_text()))
@@ -0,0 +1,143 @@
+import asyncio
+import logging
+import random
+import typing
+
+import httpx
+
+from . import metrics, tracing
+from . import settings as settings_module
+
+logger = logging.getLogger(__name__)
+
+# Response codes which mean the request might succeed if it is tried again.
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+
+def pool_limits(settings: settings_module.SyncSettings) -> httpx.Limits:
+    """Connection pool limits for the portal's httpx client."""
+    return httpx.Limits(
+        max_connections=settings.portal_max_connections,
+        max_keepalive_connections=settings.portal_max_connections,
+    )
+
+
+class PortalFetcher:
+    """Fetch JSON from the portals with bounded concurrency, timeouts and retries."""
+
+    def __init__(
+        self, client: httpx.AsyncClient, settings: settings_module.SyncSettings
+    ) -> None:
+        self.client = client
+        self.settings = settings
+        self.semaphore = asyncio.Semaphore(settings.portal_max_in_flight)
+
+    def backoff(self, attempt: int) -> float:
+        """Time to wait before retrying, using exponential backoff with full jitter."""
+        ceiling = min(
+            self.settings.portal_retry_backoff_max,
+            self.settings.portal_retry_backoff * 2**attempt,
+        )
+        return random.uniform(0, ceiling)  # nosec B311
+
+    async def get_json(self, url: str) -> typing.Any:
+        """Get a URL and decode the JSON response.
+
+        Connection errors, timeouts and responses which indicate the portal is overloaded
+        are retried up to portal_retries times. Other errors are raised straight away.
+        """
+        attempt = 0
+        while True:
+            try:
+                async with self.semaphore:
+                    with metrics.Timer() as timer, tracing.Span(
+                        "portal", url=url, attempt=attempt
+                    ):
+                        response = await self.client.get(
+                            url, timeout=self.settings.portal_request_timeout
+                        )
+                metrics.PORTAL_DURATION.observe(timer.elapsed)
+                if response.is_error:
+                    metrics.PORTAL_ERRORS.inc(reason=str(response.status_code))
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.json()
+                error: Exception = httpx.HTTPStatusError(
+                    f"Server returned {response.status_code}",
+                    request=response.request,
+                    response=response,
+                )
+            except httpx.TransportError as err:
+                metrics.PORTAL_ERRORS.inc(reason=type(err).__name__)
+                error = err
+
+            if attempt >= self.settings.portal_retries:
+                raise error
+            delay = self.backoff(attempt)
+            attempt += 1
+            logger.info(
+                "Request to %s failed (%s), retrying in %.1fs.", url, error, delay
+            )
+            await asyncio.sleep(delay)
+
+    def page_url(self, url: str, offset: int) -> str:
+        """URL of the page of a listing starting at offset."""
+        return str(
+            httpx.URL(url).copy_merge_params(
+                {"limit": self.settings.portal_page_size, "offset": offset}
+            )
+        )
+
+    @staticmethod
+    def page_items(data: typing.Any, key: typing.Optional[str]) -> typing.Any:
+        """The items in a response, whether or not it is a page of a listing."""
+        if isinstance(data, dict) and "results" in data:
+            return data["results"]
+        if key is not None:
+            return data[key]
+        return data
+
+    async def iter_items(
+        self, url: str, key: typing.Optional[str] = None
+    ) -> typing.AsyncIterator[typing.Any]:
+        """Yield the items of a listing, which are under key if it isn't paginated.
+
+        If portal_page_size is set, the listing is fetched a page at a time.
+        When the first page gives the total count, the rest are fetched
+        portal_page_concurrency at a time, otherwise the next links are followed.
+        Listings which aren't paginated are returned in one go.
+        """
+        size = self.settings.portal_page_size
+        if size <= 0:
+            for item in self.page_items(await self.get_json(url), key):
+                yield item
+            return
+
+        data = await self.get_json(self.page_url(url, 0))
+        for item in self.page_items(data, key):
+            yield item
+        if not isinstance(data, dict) or "results" not in data:
+            return
+
+        count, next_url = data.get("count"), data.get("next")
+        del data
+        if count is not None:
+            offsets = range(size, count, size)
+            window = max(1, self.settings.portal_page_concurrency)
+            for i in range(0, len(offsets), window):
+                pages = await asyncio.gather(
+                    *(
+                        self.get_json(self.page_url(url, x))
+                        for x in offsets[i : i + window]
+                    )
+                )
+                for page in pages:
+                    for item in self.page_items(page, key):
+                        yield item
+                del pages
+        else:
+            while next_url:
+                page = await self.get_json(next_url)
+                for item in self.page_items(page, key):
+                    yield item
+                next_url = page.get("next")
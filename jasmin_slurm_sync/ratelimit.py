@@ -0,0 +1,93 @@
+import asyncio
+import logging
+import time
+import typing
+
+from . import metrics
+from . import settings as settings_module
+
+logger = logging.getLogger(__name__)
+
+# sacctmgr subcommands which only read from the database.
+READ_COMMANDS = {"show", "list"}
+
+
+class TokenBucket:
+    """Token bucket rate limiter.
+
+    Up to burst calls are allowed at once, and the bucket refills at rate calls per second.
+    Callers only wait when the bucket is empty.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int,
+        clock: typing.Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.clock = clock
+
+        self.tokens = float(self.burst)
+        self.updated = self.clock()
+        self.lock = asyncio.Lock()
+
+    def refill(self) -> None:
+        """Add the tokens which have accumulated since the last refill."""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> float:
+        """Take a token from the bucket, waiting if there is not one available.
+
+        Returns the time spent waiting.
+        """
+        async with self.lock:
+            self.refill()
+            waited = 0.0
+            if self.tokens < 1:
+                waited = (1 - self.tokens) / self.rate
+                await asyncio.sleep(waited)
+                self.refill()
+            self.tokens -= 1
+            return waited
+
+
+class RateLimiter:
+    """Separate rate limits for commands which read and write to the SLURM database."""
+
+    def __init__(self, read: TokenBucket, write: TokenBucket) -> None:
+        self.read = read
+        self.write = write
+
+    @classmethod
+    def from_settings(cls, settings: settings_module.SyncSettings) -> "RateLimiter":
+        """Create the rate limiter from the settings."""
+        return cls(
+            read=TokenBucket(settings.sacctmgr_read_rate, settings.sacctmgr_read_burst),
+            write=TokenBucket(
+                settings.sacctmgr_write_rate, settings.sacctmgr_write_burst
+            ),
+        )
+
+    @staticmethod
+    def subcommand(args: typing.Sequence[str]) -> str:
+        """Get the sacctmgr subcommand, which is the first argument which isn't a flag."""
+        return next((x for x in args[1:] if not x.startswith("-")), "")
+
+    @classmethod
+    def command_class(cls, args: typing.Sequence[str]) -> str:
+        """Work out whether a command reads or writes to the SLURM database."""
+        return "read" if cls.subcommand(args) in READ_COMMANDS else "write"
+
+    async def acquire(self, args: typing.Sequence[str]) -> float:
+        """Wait until the rate limit allows the given command to be run."""
+        command_class = self.command_class(args)
+        bucket = self.read if command_class == "read" else self.write
+        waited = await bucket.acquire()
+        metrics.RATELIMIT_WAIT.inc(waited, command_class=command_class)
+        if waited:
+            logger.debug("Waited %.2fs for rate limit before running %s", waited, args)
+        return waited
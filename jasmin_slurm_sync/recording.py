@@ -0,0 +1,215 @@
+import json
+import logging
+import pathlib
+import re
+import shlex
+import subprocess as sp
+import typing
+
+import httpx
+
+from . import identity, portal, ratelimit
+from . import settings as settings_module
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+# Keys of portal responses which are removed before they are saved.
+SECRET_KEYS = re.compile(r"secret|token|password|key", re.IGNORECASE)
+
+
+def strip_secrets(data: typing.Any) -> typing.Any:
+    """Remove anything which looks like a credential from decoded JSON."""
+    if isinstance(data, dict):
+        return {
+            k: strip_secrets(v) for k, v in data.items() if not SECRET_KEYS.search(k)
+        }
+    if isinstance(data, list):
+        return [strip_secrets(x) for x in data]
+    return data
+
+
+class Recording:
+    """Everything a sync reads from the portals and SLURM, so it can be run again offline.
+
+    Portal responses are kept by URL and sacctmgr output by command line.
+    Credentials are never recorded. When replaying, the writes which would have been made
+    are kept instead, along with the contents of any files of accounts loaded in bulk.
+    """
+
+    def __init__(self) -> None:
+        self.responses: dict[str, typing.Any] = {}
+        self.outputs: dict[str, dict[str, typing.Any]] = {}
+        self.unix_users: dict[str, bool] = {}
+        self.writes: list[list[str]] = []
+        # Contents of the files given to sacctmgr load, by the name they are saved as.
+        self.load_files: dict[str, str] = {}
+
+    @staticmethod
+    def key(args: list[str]) -> str:
+        return shlex.join(args)
+
+    def save(self, path: pathlib.Path) -> None:
+        """Save what has been read into a directory."""
+        path.mkdir(parents=True, exist_ok=True)
+        (path / "portal.json").write_text(json.dumps(self.responses))
+        (path / "sacctmgr.json").write_text(json.dumps(self.outputs))
+        (path / "unix_users.json").write_text(json.dumps(self.unix_users))
+        logger.info(
+            "Recorded %s portal responses and %s sacctmgr commands to %s",
+            len(self.responses),
+            len(self.outputs),
+            path,
+        )
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> "Recording":
+        """Load a recording saved by save."""
+        recording = cls()
+        recording.responses = json.loads((path / "portal.json").read_text())
+        recording.outputs = json.loads((path / "sacctmgr.json").read_text())
+        recording.unix_users = json.loads((path / "unix_users.json").read_text())
+        return recording
+
+    def save_writes(self, path: pathlib.Path) -> None:
+        """Save the writes captured while replaying, and the files they load."""
+        (path / "writes.json").write_text(json.dumps(self.writes, indent=2) + "\n")
+        for name, contents in self.load_files.items():
+            (path / name).write_text(contents)
+        logger.info("Captured %s sacctmgr writes in %s", len(self.writes), path)
+
+    async def respond(self, request: httpx.Request) -> httpx.Response:
+        """Serve a recorded portal response."""
+        url = str(request.url)
+        if url not in self.responses:
+            logger.warning("No recorded response for %s", url)
+            return httpx.Response(404, request=request)
+        return httpx.Response(200, json=self.responses[url], request=request)
+
+
+class RecordingFetcher(portal.PortalFetcher):
+    """Fetch from the portals, recording the responses."""
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        settings: settings_module.SyncSettings,
+        recording: Recording,
+    ) -> None:
+        super().__init__(client, settings)
+        self.recording = recording
+
+    async def get_json(self, url: str) -> typing.Any:
+        data = await super().get_json(url)
+        self.recording.responses[url] = strip_secrets(data)
+        return data
+
+
+class RecordingRunner(utils.CommandRunner):
+    """Run SLURM commands, recording the output of those which read from the database."""
+
+    def __init__(
+        self,
+        limiter: ratelimit.RateLimiter,
+        max_workers: int,
+        recording: Recording,
+    ) -> None:
+        super().__init__(limiter, max_workers)
+        self.recording = recording
+
+    async def run(
+        self, args: list[str], check: bool = True
+    ) -> sp.CompletedProcess[bytes]:
+        result = await super().run(args, check)
+        if ratelimit.RateLimiter.command_class(args) == "read":
+            self.recording.outputs[self.recording.key(args)] = {
+                "returncode": result.returncode,
+                "stdout": result.stdout.decode("utf-8"),
+                "stderr": result.stderr.decode("utf-8"),
+            }
+        return result
+
+
+class ReplayRunner(utils.CommandRunner):
+    """Answer SLURM reads from a recording, and capture writes rather than running them.
+
+    Nothing is rate limited, so only the time taken by the syncer itself is measured.
+    """
+
+    def __init__(
+        self,
+        limiter: ratelimit.RateLimiter,
+        max_workers: int,
+        recording: Recording,
+    ) -> None:
+        super().__init__(limiter, max_workers)
+        self.recording = recording
+
+    def capture_load_file(self, args: list[str]) -> list[str]:
+        """Keep the file given to sacctmgr load, which is deleted once it has been run.
+
+        Returns the command with the file renamed to where it will be saved.
+        """
+        captured = []
+        for arg in args:
+            if arg.startswith("file="):
+                name = f"load-{len(self.recording.load_files) + 1}.cfg"
+                self.recording.load_files[name] = pathlib.Path(
+                    arg.removeprefix("file=")
+                ).read_text()
+                arg = f"file={name}"
+            captured.append(arg)
+        return captured
+
+    async def run(
+        self, args: list[str], check: bool = True
+    ) -> sp.CompletedProcess[bytes]:
+        if ratelimit.RateLimiter.command_class(args) == "write":
+            if "load" in args:
+                args = self.capture_load_file(args)
+            logger.info("Captured %s", self.recording.key(args))
+            self.recording.writes.append(args)
+            return sp.CompletedProcess(args, 0, b"", b"")
+
+        output = self.recording.outputs.get(self.recording.key(args))
+        if output is None:
+            logger.warning("No recorded output for %s", self.recording.key(args))
+            output = {"returncode": 1, "stdout": "", "stderr": ""}
+        result = sp.CompletedProcess(
+            args,
+            output["returncode"],
+            output["stdout"].encode("utf-8"),
+            output["stderr"].encode("utf-8"),
+        )
+        if check and result.returncode:
+            raise sp.CalledProcessError(
+                result.returncode, args, result.stdout, result.stderr
+            )
+        return result
+
+
+class RecordingUnixUsers(identity.UnixUsers):
+    """Look up Unix users, recording whether they exist."""
+
+    def __init__(self, recording: Recording) -> None:
+        super().__init__()
+        self.recording = recording
+
+    async def exists(self, username: str) -> bool:
+        exists = await super().exists(username)
+        self.recording.unix_users[username] = exists
+        return exists
+
+
+class ReplayUnixUsers(identity.UnixUsers):
+    """Answer whether Unix users exist from a recording."""
+
+    def __init__(self, recording: Recording) -> None:
+        super().__init__()
+        self.recording = recording
+
+    async def exists(self, username: str) -> bool:
+        return self.recording.unix_users.get(username, False)
+
+    async def prefetch(self, usernames: typing.Iterable[str]) -> None:
+        pass
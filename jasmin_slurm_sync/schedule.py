@@ -0,0 +1,49 @@
+import logging
+import random
+import typing
+
+from . import settings as settings_module
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """Decide how long to wait before the next sync in daemon mode.
+
+    Syncs start every daemon_sleep_time seconds, less the time the last one took.
+    After a sync which made changes, or which didn't finish, the next one comes sooner.
+    After daemon_idle_cycles syncs in a row which made no changes,
+    the period doubles with each further one, up to daemon_max_period.
+    """
+
+    def __init__(self) -> None:
+        # Syncs in a row which made no changes.
+        self.idle = 0
+
+    def period(
+        self, settings: settings_module.SyncSettings, changes: typing.Optional[int]
+    ) -> float:
+        """Time from the start of the last sync to the start of the next one.
+
+        changes is the number of changes the last sync made, or None if it didn't finish.
+        """
+        if changes is None or changes > 0:
+            self.idle = 0
+            return min(settings.daemon_busy_period, settings.daemon_sleep_time)
+
+        self.idle += 1
+        backoff = max(0, self.idle - settings.daemon_idle_cycles + 1)
+        return min(
+            settings.daemon_max_period, settings.daemon_sleep_time * 2.0**backoff
+        )
+
+    def next_delay(
+        self,
+        settings: settings_module.SyncSettings,
+        elapsed: float,
+        changes: typing.Optional[int],
+    ) -> float:
+        """Time to sleep before the next sync, with jitter so syncs don't line up."""
+        delay = max(0.0, self.period(settings, changes) - elapsed)
+        jitter = settings.daemon_jitter
+        return delay * random.uniform(1 - jitter, 1 + jitter)  # nosec B311
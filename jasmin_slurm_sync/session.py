@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import time
+
+import jasmin_account_api_client
+
+from . import portal
+from . import settings as settings_module
+
+logger = logging.getLogger(__name__)
+
+
+class PortalSession:
+    """An authenticated client for the portals, kept between syncs.
+
+    Its connections to the portals are reused, and a new token is only fetched
+    when the current one is about to expire.
+    """
+
+    def __init__(self, settings: settings_module.SyncSettings) -> None:
+        self.settings = settings
+        self.client = jasmin_account_api_client.AuthenticatedClient(
+            settings.api_client_base_url,
+            httpx_args={"limits": portal.pool_limits(settings)},
+        )
+        self.expires_at = 0.0
+
+    def authenticate(self) -> None:
+        """Fetch a new token."""
+        token = self.client.client_credentials_flow(
+            self.settings.api_client_id,
+            self.settings.api_client_secret,
+            self.settings.api_client_scopes,
+        )
+        lifetime = float(self.settings.api_token_lifetime)
+        # Use the lifetime given by the portal, if there is one.
+        if isinstance(token, dict) and token.get("expires_in"):
+            lifetime = float(token["expires_in"])
+        self.expires_at = time.monotonic() + lifetime
+
+    @property
+    def expiring(self) -> bool:
+        """Whether the token should be replaced before it is used again."""
+        return (
+            time.monotonic() >= self.expires_at - self.settings.api_token_refresh_margin
+        )
+
+    async def refresh(self) -> None:
+        """Fetch a new token if the current one is about to expire."""
+        if self.expiring:
+            logger.info("Fetching a new token for the portals.")
+            await asyncio.to_thread(self.authenticate)
+
+    async def close(self) -> None:
+        """Close the connections to the portals."""
+        await self.client.get_async_httpx_client().aclose()
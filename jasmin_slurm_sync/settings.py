@@ -1,7 +1,9 @@
 import copy
+import hashlib
 import pathlib
 import typing
 
+import pydantic
 import pydantic_settings
 
 
@@ -10,7 +12,79 @@ class SyncSettings(pydantic_settings.BaseSettings):
 
     model_config = pydantic_settings.SettingsConfigDict(toml_file="config.toml")
 
+    # Target time in seconds between the starts of syncs in daemon mode.
     daemon_sleep_time: int = 600
+    # Time between syncs after one which made changes, or didn't finish.
+    daemon_busy_period: int = 120
+    # After this many syncs in a row which made no changes, the time between syncs
+    # doubles with each further one, up to daemon_max_period seconds.
+    daemon_idle_cycles: int = 3
+    daemon_max_period: int = 3600
+    # Fraction of the time between syncs to add or remove at random.
+    daemon_jitter: float = 0.1
+    # Syncs which take longer than this many seconds are stopped, or 0 for no limit.
+    daemon_cycle_deadline: int = 1800
+    # In daemon mode, only users whose inputs have changed are synced,
+    # except every this many cycles, when every user is.
+    full_reconcile_every: int = 6
+    # Maximum number of users to put in a single sacctmgr command.
+    sacctmgr_batch_size: pydantic.PositiveInt = 100
+    # Rate limits for sacctmgr commands in commands per second,
+    # and the number of commands which can be run in a burst before the limit applies.
+    sacctmgr_read_rate: pydantic.PositiveFloat = 5.0
+    sacctmgr_read_burst: int = 10
+    sacctmgr_write_rate: pydantic.PositiveFloat = 1.0
+    sacctmgr_write_burst: int = 10
+    # Maximum number of sacctmgr commands to run at the same time.
+    sacctmgr_max_workers: int = 4
+    # Create accounts with a single sacctmgr load when at least this many are needed,
+    # or 0 to always create them one at a time.
+    sacctmgr_load_threshold: int = 2
+    # Apply users' changes while the rest of the users' grants are being fetched,
+    # once sync_pipeline_batch_users users have changes, so they can be batched together,
+    # or the first of them has waited sync_pipeline_flush_interval seconds.
+    # At most sync_pipeline_queue_size users' changes wait to be applied.
+    sync_pipeline: bool = True
+    sync_pipeline_batch_users: int = 100
+    sync_pipeline_flush_interval: float = 5
+    sync_pipeline_queue_size: int = 1000
+    # How long to remember that a Unix user exists, or doesn't, in seconds.
+    unix_user_ttl: int = 3600
+    unix_user_negative_ttl: int = 300
+    # Look up Unix users by listing them all with getpwall, which needs enumeration
+    # to be turned on in sssd. Otherwise up to unix_user_lookup_workers are looked up at once.
+    unix_user_enumerate: bool = False
+    unix_user_lookup_workers: int = 8
+    # Name of the cluster to load accounts into. Found using sacctmgr if not set.
+    slurm_cluster: typing.Optional[str] = None
+    # In daemon mode, keep the SLURM associations between cycles
+    # and only re-read what has changed according to sacctmgr's transaction history.
+    # Everything is re-read if the snapshot is older than slurm_snapshot_max_age seconds,
+    # or more than slurm_max_incremental_changes users and accounts have changed.
+    slurm_incremental_refresh: bool = True
+    slurm_snapshot_max_age: int = 3600
+    slurm_max_incremental_changes: int = 500
+
+    # Maximum number of requests to the portals in flight at once,
+    # and the number of connections to keep open to them.
+    portal_max_in_flight: int = 20
+    portal_max_connections: int = 20
+    # Timeout in seconds for each request to the portals.
+    portal_request_timeout: float = 30
+    # Number of times to retry a failed request, and the backoff between retries in seconds.
+    portal_retries: int = 4
+    portal_retry_backoff: float = 0.5
+    portal_retry_backoff_max: float = 30
+    # Fetch listings from the portals this many items at a time, using limit and offset,
+    # or 0 to fetch each listing in a single request.
+    # Up to portal_page_concurrency pages of a listing are fetched at once.
+    portal_page_size: int = 0
+    portal_page_concurrency: int = 4
+
+    # Lifetime in seconds assumed for portal tokens if the portal doesn't give one,
+    # and how long before a token expires to fetch a new one.
+    api_token_lifetime: int = 3600
+    api_token_refresh_margin: int = 300
 
     api_client_base_url: str
     api_client_id: str
@@ -46,3 +120,33 @@ def load_settings(path: pathlib.Path) -> SyncSettings:
     Settings = copy.deepcopy(SyncSettings)
     Settings.model_config = pydantic_settings.SettingsConfigDict(toml_file=path)
     return Settings()
+
+
+class SettingsLoader:
+    """Load settings from a file, only reading them again when the file has changed.
+
+    The file's modification time and size are checked first,
+    and its contents are only parsed if their hash has changed too.
+    """
+
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self.stat: typing.Optional[tuple[int, int]] = None
+        self.digest: typing.Optional[str] = None
+        self.settings: typing.Optional[SyncSettings] = None
+
+    def load(self) -> tuple[SyncSettings, bool]:
+        """Get the settings, and whether they have changed since they were last loaded."""
+        stat = self.path.stat()
+        key = (stat.st_mtime_ns, stat.st_size)
+        if self.settings is not None and key == self.stat:
+            return self.settings, False
+
+        digest = hashlib.sha256(self.path.read_bytes()).hexdigest()
+        self.stat = key
+        if self.settings is not None and digest == self.digest:
+            return self.settings, False
+
+        self.settings = load_settings(self.path)
+        self.digest = digest
+        return self.settings, True
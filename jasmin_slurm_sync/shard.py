@@ -0,0 +1,46 @@
+import dataclasses
+import zlib
+
+from . import settings as settings_module
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Shard:
+    """One of count shards of the users, which are split between them by a hash of their names."""
+
+    index: int
+    count: int
+
+    @classmethod
+    def parse(cls, text: str) -> "Shard":
+        """Parse a shard given as index/count, counting from 0."""
+        index, sep, count = text.partition("/")
+        if not sep:
+            raise ValueError(f"Shard {text} should be given as index/count.")
+        shard = cls(int(index), int(count))
+        if not 0 <= shard.index < shard.count:
+            raise ValueError(
+                f"The index of shard {text} should be at least 0 and less than the count."
+            )
+        return shard
+
+    def __contains__(self, username: object) -> bool:
+        # crc32 rather than hash, so every process agrees on the shards.
+        return (
+            isinstance(username, str)
+            and zlib.crc32(username.encode("utf-8")) % self.count == self.index
+        )
+
+
+def share_settings(
+    settings: settings_module.SyncSettings, count: int
+) -> settings_module.SyncSettings:
+    """Settings for one of count workers, which share the sacctmgr rate limits between them."""
+    return settings.model_copy(
+        update={
+            "sacctmgr_read_rate": settings.sacctmgr_read_rate / count,
+            "sacctmgr_read_burst": max(1, settings.sacctmgr_read_burst // count),
+            "sacctmgr_write_rate": settings.sacctmgr_write_rate / count,
+            "sacctmgr_write_burst": max(1, settings.sacctmgr_write_burst // count),
+        }
+    )
@@ -0,0 +1,89 @@
+import logging
+import typing
+
+from .models import association
+
+logger = logging.getLogger(__name__)
+
+
+def user_hash(
+    portal_services: typing.AbstractSet[str],
+    slurm_accounts: typing.AbstractSet[str],
+    existing_default_account: str,
+) -> int:
+    """Hash of everything which decides what changes a user needs."""
+    return hash(
+        (
+            frozenset(portal_services),
+            frozenset(slurm_accounts),
+            existing_default_account,
+        )
+    )
+
+
+class SyncState:
+    """State carried between sync cycles when running as a daemon.
+
+    Remembers a hash of the inputs of every user which was synced successfully,
+    so that users whose portal grants and SLURM associations haven't changed can be skipped,
+    and a snapshot of the SLURM associations which can be updated incrementally.
+    """
+
+    def __init__(self) -> None:
+        self.cycle = 0
+        self.full = True
+        self.fingerprint: typing.Optional[int] = None
+
+        # Hashes of users which have been synced successfully.
+        self.user_hashes: dict[str, int] = {}
+        # Hashes of users being synced this cycle, and those which have succeeded.
+        self.candidates: dict[str, int] = {}
+        self.synced: dict[str, int] = {}
+
+        # Snapshot of the SLURM associations, when it was last read in full and last updated.
+        self.associations: typing.Optional[association.AssociationSnapshot] = None
+        self.associations_loaded = 0.0
+        self.associations_updated = 0.0
+
+    def start_cycle(self, fingerprint: int, full_every: int) -> None:
+        """Start a new cycle, deciding whether every user should be reconciled.
+
+        A full reconciliation is done every full_every cycles,
+        and whenever the fingerprint of things shared by all users changes.
+        """
+        self.full = (
+            full_every <= 1
+            or self.cycle % full_every == 0
+            or fingerprint != self.fingerprint
+        )
+        self.fingerprint = fingerprint
+        self.cycle += 1
+        self.candidates = {}
+        self.synced = {}
+        logger.debug(
+            "Starting cycle %s, full reconciliation: %s", self.cycle, self.full
+        )
+
+    def is_dirty(self, username: str, content_hash: int) -> bool:
+        """Check whether a user needs to be reconciled this cycle."""
+        if self.full or self.user_hashes.get(username) != content_hash:
+            self.candidates[username] = content_hash
+            return True
+        return False
+
+    def mark_synced(self, username: str) -> None:
+        """Record that a user has been synced successfully."""
+        self.synced[username] = self.candidates[username]
+
+    def mark_failed(self, username: str) -> None:
+        """Record that a user's changes could not all be made, so they are synced again."""
+        self.synced.pop(username, None)
+
+    def finish_cycle(self) -> None:
+        """Remember the users which were synced, once all changes have been applied."""
+        if self.full:
+            # Forget about users which no longer exist.
+            self.user_hashes = self.synced
+        else:
+            self.user_hashes.update(self.synced)
+        self.synced = {}
@@ -1,10 +1,19 @@
+import asyncio
 import logging
 import typing
 
+import httpx
 import jasmin_account_api_client
 
-from .. import cli, errors, models
+from .. import cli, errors, executor, identity
+from .. import journal as journal_module
+from .. import metrics, models, plan, portal, ratelimit, tracing
+from .. import recording as recording_module
+from .. import session as session_module
+from .. import shard as shard_module
 from .. import settings as settings_module
+from .. import state as state_module
+from .. import utils
 from . import account, user
 
 logger = logging.getLogger(__name__)
@@ -13,6 +22,23 @@ logger = logging.getLogger(__name__)
 class SLURMSyncer(account.AccountSyncingMixin, user.UserSyncingMixin):
     """Sync users' SLURM Accounts."""
 
+    unix_users: identity.UnixUsers
+
+    # Cached properties holding what was read from SLURM and the portals in a cycle.
+    CYCLE_PROPERTIES = (
+        "slurm_associations",
+        "portal_user_services",
+        "portal_slurm_users",
+        "users_to_be_synced",
+        "all_slurm_users",
+        "all_default_accounts",
+        "expected_slurm_accounts",
+        "account_names_available",
+        "existing_slurm_accounts",
+        "accounts_to_be_synced",
+        "account_index",
+    )
+
     def __init__(
         self,
         settings: settings_module.SyncSettings,
@@ -21,71 +47,545 @@ class SLURMSyncer(account.AccountSyncingMixin, user.UserSyncingMixin):
         api_client: typing.Optional[
             jasmin_account_api_client.AuthenticatedClient
         ] = None,
+        state: typing.Optional[state_module.SyncState] = None,
     ) -> None:
         """Initialise a connection to the jasmin acounts portal."""
         self.settings = settings
         self.args = args
+        # State kept from previous cycles, so that unchanged users can be skipped.
+        self.state = state_module.SyncState() if state is None else state
+
+        # Only the users in this shard are synced, if there is one.
+        self.shard = (
+            None if args.shard is None else shard_module.Shard.parse(args.shard)
+        )
+        # When the users are split into shards, only the first shard changes accounts,
+        # unless they were changed before the users were split between workers.
+        self.plan_account_changes = self.shard is None or self.shard.index == 0
+        # Users whose grants could not be fetched from the portal this run.
+        self.portal_failed_users: set[str] = set()
+        limiter = ratelimit.RateLimiter.from_settings(settings)
+
+        # When replaying, everything is read from the recording, and nothing is changed.
+        self.recording: typing.Optional[recording_module.Recording] = None
+        # Only set when the syncer made its own connection to the portals.
+        self.session: typing.Optional[session_module.PortalSession] = None
+        if args.replay is not None:
+            self.recording = recording_module.Recording.load(args.replay)
+            self.portal = portal.PortalFetcher(
+                httpx.AsyncClient(
+                    transport=httpx.MockTransport(self.recording.respond)
+                ),
+                settings,
+            )
+            self.runner = recording_module.ReplayRunner(
+                limiter, settings.sacctmgr_max_workers, self.recording
+            )
+            self.unix_users = recording_module.ReplayUnixUsers(self.recording)
+        else:
+            self.connect(api_client, limiter)
+
+        # Changes are journaled if asked to, so an interrupted sync can be resumed.
+        self.journal = (
+            journal_module.Journal(args.journal) if args.journal is not None else None
+        )
+        # Everything which changes SLURM goes through the executor.
+        self.executor = executor.Executor(settings, args, self.runner, self.journal)
 
+    def connect(
+        self,
+        api_client: typing.Optional[jasmin_account_api_client.AuthenticatedClient],
+        limiter: ratelimit.RateLimiter,
+    ) -> None:
+        """Connect to the portals and SLURM, recording what is read if asked to."""
         # Init connection to jasmin accounts api.
         if api_client is None:
-            self.api_client = jasmin_account_api_client.AuthenticatedClient(
-                settings.api_client_base_url
+            self.session = session_module.PortalSession(self.settings)
+            self.session.authenticate()
+            self.api_client = self.session.client
+        else:
+            self.api_client = api_client
+
+        client = self.api_client.get_async_httpx_client()
+        max_workers = self.settings.sacctmgr_max_workers
+        if self.args.record is not None:
+            self.recording = recording_module.Recording()
+            self.portal = recording_module.RecordingFetcher(
+                client, self.settings, self.recording
             )
-            self.api_client.client_credentials_flow(
-                settings.api_client_id,
-                settings.api_client_secret,
-                settings.api_client_scopes,
+            self.runner = recording_module.RecordingRunner(
+                limiter, max_workers, self.recording
             )
+            self.unix_users = recording_module.RecordingUnixUsers(self.recording)
         else:
-            self.api_client = api_client
+            self.portal = portal.PortalFetcher(client, self.settings)
+            self.runner = utils.CommandRunner(limiter, max_workers)
+            self.unix_users = identity.UnixUsers.from_settings(self.settings)
+
+    def forget(self, *names: str) -> None:
+        """Forget cached properties, so they are fetched again next time they are used."""
+        for name in names:
+            self.__dict__.pop(name, None)
+
+    def remember(self, **values: typing.Any) -> None:
+        """Use values which are already known for cached properties, rather than reading them."""
+        loop = asyncio.get_running_loop()
+        for name, value in values.items():
+            known: asyncio.Future[typing.Any] = loop.create_future()
+            known.set_result(value)
+            self.__dict__[name] = known
+
+    async def new_cycle(self) -> None:
+        """Forget what was read in the last cycle, so the syncer can be used again.
+
+        The connections to the portals are kept, with a new token if it was about to expire.
+        """
+        self.forget(*self.CYCLE_PROPERTIES)
+        self.portal_failed_users = set()
+        self.executor.failed_users = set()
+        await self.refresh_token()
+
+    async def refresh_token(self) -> None:
+        """Fetch a new token for the portals if the current one is about to expire."""
+        if self.session is not None:
+            await self.session.refresh()
+            self.portal.client = self.api_client.get_async_httpx_client()
 
-    async def users(self) -> typing.AsyncIterator[models.user.User]:
+    async def close(self) -> None:
+        """Close the connections to the portals, if the syncer made them itself."""
+        if self.session is not None:
+            await self.session.close()
+
+    async def make_user(
+        self,
+        username: str,
+        portal_services: typing.AbstractSet[str],
+        changes: plan.Plan,
+    ) -> models.user.User:
+        """Create the model for a user from what is known about SLURM and the portals."""
+        return models.user.User(
+            username=username,
+            portal_services=portal_services,
+            slurm_accounts=(await self.all_slurm_users).get(username, frozenset()),
+            existing_default_account=(await self.all_default_accounts).get(
+                username, ""
+            ),
+            account_names_available=(await self.account_names_available),
+            settings=self.settings,
+            args=self.args,
+            changes=changes,
+            unix_users=self.unix_users,
+        )
+
+    async def make_account(
+        self, account_name: str, changes: plan.Plan
+    ) -> models.account.Account:
+        """Create the model for an account from what is known about SLURM and the portals."""
+        return models.account.Account(
+            account_name=account_name,
+            index=(await self.account_index),
+            settings=self.settings,
+            args=self.args,
+            changes=changes,
+        )
+
+    async def user_if_dirty(
+        self,
+        username: str,
+        portal_services: typing.AbstractSet[str],
+        changes: plan.Plan,
+    ) -> typing.Optional[models.user.User]:
+        """Create the model for a user, unless they shouldn't be synced this cycle."""
+        if username in self.portal_failed_users:
+            logger.warning(
+                "Not syncing user %s, as their grants could not be fetched.",
+                username,
+            )
+            return None
+        if username in self.settings.unmanaged_users:
+            return None
+
+        # Skip users whose inputs are the same as when they were last synced.
+        if self.state.is_dirty(
+            username,
+            state_module.user_hash(
+                portal_services,
+                (await self.all_slurm_users).get(username, frozenset()),
+                (await self.all_default_accounts).get(username, ""),
+            ),
+        ):
+            return await self.make_user(username, portal_services, changes)
+        return None
+
+    async def users(self, changes: plan.Plan) -> typing.AsyncIterator[models.user.User]:
         """Get list of users whose SLURM accounts should be synced."""
+        # Fetching the users' services records which users could not be fetched.
+        portal_user_services = await self.portal_user_services
+
         # Convert each user model to the user class.
         for username in await self.users_to_be_synced:
-            if username not in self.settings.unmanaged_users:
-                yield models.user.User(
-                    username=username,
-                    portal_services=(await self.portal_user_services).get(
-                        username, set()
-                    ),
-                    slurm_accounts=self.all_slurm_users.get(username, set()),
-                    existing_default_account=self.all_default_accounts.get(
-                        username, ""
-                    ),
-                    accounts_available=(await self.expected_slurm_accounts),
-                    settings=self.settings,
-                    args=self.args,
-                )
+            user = await self.user_if_dirty(
+                username, portal_user_services.get(username, frozenset()), changes
+            )
+            if user is not None:
+                yield user
 
-    async def accounts(self) -> typing.AsyncIterable[models.account.Account]:
-        """Get list of SLURM accounts which should be synced."""
-        expected = await self.expected_slurm_accounts
+    async def plan_user(self, user: models.user.User) -> None:
+        """Plan the changes for a user, recording that they were synced if they succeeded."""
+        try:
+            with tracing.Span("user", user=user.username):
+                await user.plan_sync()
+        except errors.UserSyncError:
+            logger.warning("User %s failed to sync.", user.username)
+        else:
+            self.state.mark_synced(user.username)
 
+    async def accounts(
+        self, changes: plan.Plan
+    ) -> typing.AsyncIterable[models.account.Account]:
+        """Get list of SLURM accounts which should be synced."""
         for account_name in await self.accounts_to_be_synced:
             if account_name not in self.settings.unmanaged_accounts:
-                yield models.account.Account(
-                    account_name=account_name,
-                    existing_slurm_accounts=self.existing_slurm_accounts,
-                    expected_slurm_accounts=expected,
-                    settings=self.settings,
-                    args=self.args,
-                )
+                yield await self.make_account(account_name, changes)
+
+    async def sync_users(self, usernames: set[str]) -> None:
+        """Sync some users straight away.
+
+        The users' grants and associations are fetched again,
+        but what is already known about the accounts is reused.
+        """
+        usernames = usernames - set(self.settings.unmanaged_users)
+        await self.reload_users(await self.slurm_associations, usernames)
+        account_names_available = await self.account_names_available
+
+        async def user_services(username: str) -> set[str]:
+            grants = await self.fetch_user_grants(username)
+            if grants is None:
+                raise errors.GrantsUnavailable
+            # Users without the role get no accounts, as they would in a full sync.
+            if not self.has_list_users_role(grants):
+                return set()
+            return self.services_from_grants(username, grants, account_names_available)
+
+        sorted_usernames = sorted(usernames)
+        all_services = await asyncio.gather(
+            *(user_services(x) for x in sorted_usernames), return_exceptions=True
+        )
 
-    async def sync(self) -> None:
-        """Call sync on each account and user in turn."""
-        # Sync root accounts first so they are available when other accounts are created.
-        async for account in self.accounts():
-            if getattr(account.expected, "parent", None) == "root":
-                account.sync_account()
-        # Then sync all other acounts
-        async for account in self.accounts():
-            if getattr(account.expected, "parent", None) != "root":
-                account.sync_account()
-
-        # Then sync the users.
-        async for user in self.users():
+        changes = plan.Plan()
+        failed = []
+        for username, services in zip(sorted_usernames, all_services):
             try:
-                user.sync_slurm_accounts()
+                if isinstance(services, BaseException):
+                    raise services
+                user = await self.make_user(username, services, changes)
+                await user.plan_sync()
             except errors.UserSyncError:
-                logger.warning("User %s failed to sync.", user.username)
+                logger.warning("User %s failed to sync.", username)
+                failed.append(username)
+        already_failed = set(self.executor.failed_users)
+        await self.executor.apply(changes)
+        failed.extend(sorted(self.executor.failed_users - already_failed))
+        if failed:
+            raise errors.UserSyncError(f"Failed to sync {', '.join(failed)}")
+
+    async def sync_accounts(self, account_names: typing.Iterable[str]) -> None:
+        """Sync some accounts straight away, creating their parents first if needed.
+
+        The accounts are fetched again from the projects portal and SLURM.
+        """
+        self.forget(
+            "expected_slurm_accounts",
+            "account_names_available",
+            "existing_slurm_accounts",
+            "accounts_to_be_synced",
+            "account_index",
+        )
+        expected = {x.name: x for x in await self.expected_slurm_accounts}
+        parents = {getattr(expected.get(x), "parent", "root") for x in account_names}
+        # Parents go first, so they exist before their children are created.
+        # SLURM hasn't been read again yet, so only the expected hierarchy is used.
+        ordered_names = [
+            name
+            for level in models.account.AccountIndex(expected.values(), []).levels(
+                (parents - {"root"}) | set(account_names)
+            )
+            for name in level
+        ]
+
+        await self.reload_accounts(await self.slurm_associations, set(ordered_names))
+        to_be_synced = await self.accounts_to_be_synced
+        changes = plan.Plan()
+        for name in ordered_names:
+            if name in self.settings.unmanaged_accounts:
+                logger.info("Not syncing %s, because account is not managed.", name)
+            elif name in to_be_synced:
+                (await self.make_account(name, changes)).plan_sync()
+        await self.executor.apply(changes)
+
+    async def prefetch(self) -> None:
+        """Fetch the state of SLURM and the portals concurrently."""
+        await asyncio.gather(
+            metrics.timed("slurm_read", self.slurm_associations),
+            metrics.timed("portal_fetch", self.portal_user_services),
+        )
+
+    async def sync_selected(self) -> None:
+        """Sync only the users and accounts given on the command line."""
+        if self.args.account:
+            await self.sync_accounts(self.args.account)
+        if self.args.user:
+            await self.sync_users(set(self.args.user))
+
+    async def plan_accounts(self, changes: plan.Plan) -> None:
+        """Work out the changes needed to make the SLURM accounts match the portals.
+
+        When the users are split into shards, only the first shard changes accounts,
+        or none of them if the accounts were changed before the users were split.
+        """
+        if not self.plan_account_changes:
+            return
+        with metrics.Timer() as timer, tracing.Span("phase", phase="account_plan"):
+            accounts = {x.account_name: x async for x in self.accounts(changes)}
+            # Plan a level of the hierarchy at a time, from the top down,
+            # so parents are created or moved before their children.
+            for level in (await self.account_index).levels(accounts):
+                for name in level:
+                    with tracing.Span("account", account=name):
+                        accounts[name].plan_sync()
+        metrics.PHASE_DURATION.set(timer.elapsed, phase="account_plan")
+
+    async def start_cycle(self) -> None:
+        """Start a cycle of syncing users, deciding whether they all need reconciling."""
+        self.state.start_cycle(
+            hash(
+                (
+                    await self.account_names_available,
+                    self.settings.model_dump_json(),
+                )
+            ),
+            self.settings.full_reconcile_every,
+        )
+
+    async def report(self, changes: plan.Plan) -> None:
+        """Record how many users and accounts were examined and changed."""
+        account_index = await self.account_index
+        changed_users, changed_accounts = changes.changed()
+        metrics.EXAMINED.set(len(await self.users_to_be_synced), kind="user")
+        metrics.EXAMINED.set(
+            len(account_index.expected.keys() | account_index.existing.keys()),
+            kind="account",
+        )
+        metrics.CHANGED.set(len(changed_users), kind="user")
+        metrics.CHANGED.set(len(changed_accounts), kind="account")
+        logger.info(
+            "Reconciled %s of %s users (full reconciliation: %s).",
+            len(self.state.candidates),
+            len(await self.users_to_be_synced),
+            self.state.full,
+        )
+
+    async def plan(self) -> plan.Plan:
+        """Work out every change needed to make SLURM match the portals."""
+        changes = plan.Plan()
+        await self.prefetch()
+        await self.plan_accounts(changes)
+
+        # Then plan the users.
+        await self.start_cycle()
+        with metrics.Timer() as timer, tracing.Span("phase", phase="user_plan"):
+            users = [x async for x in self.users(changes)]
+            # Look up the users who need changes in bulk, rather than one at a time.
+            await self.unix_users.prefetch(
+                x.username for x in users if x.to_be_added or x.to_be_removed
+            )
+            for user in users:
+                await self.plan_user(user)
+        metrics.PHASE_DURATION.set(timer.elapsed, phase="user_plan")
+
+        await self.report(changes)
+        return changes
+
+    async def pipeline_users(self) -> typing.AsyncIterator[models.user.User]:
+        """Yield the users to be synced as soon as what they need is known.
+
+        Users only in SLURM come first, then users from the portal as their grants arrive.
+        The time until the last user's grants arrive is recorded as the portal_fetch phase.
+        """
+        portal_users = await self.portal_slurm_users
+        for username in (await self.users_to_be_synced) - portal_users:
+            user = await self.user_if_dirty(username, frozenset(), plan.Plan())
+            if user is not None:
+                yield user
+        with metrics.Timer() as timer:
+            async for username, services in self.stream_user_services():
+                user = await self.user_if_dirty(username, services, plan.Plan())
+                if user is not None:
+                    yield user
+        metrics.PHASE_DURATION.set(timer.elapsed, phase="portal_fetch")
+
+    async def pipeline(self) -> int:
+        """Sync users as their grants arrive, rather than waiting for every user's grants.
+
+        Accounts are synced first, so users can be added to new ones.
+        Then each user's changes are planned as soon as their grants arrive,
+        and applied while the rest are fetched, in batches of sync_pipeline_batch_users users
+        or whatever has waited sync_pipeline_flush_interval seconds.
+        At most sync_pipeline_queue_size users' changes wait to be applied,
+        after which fetching waits for the writes to catch up.
+
+        Returns the number of changes made.
+        """
+        applied = plan.Plan()
+        await asyncio.gather(
+            metrics.timed("slurm_read", self.slurm_associations),
+            self.expected_slurm_accounts,
+            self.portal_slurm_users,
+        )
+        await self.plan_accounts(applied)
+        await metrics.timed("account_apply", self.executor.apply(applied))
+
+        await self.start_cycle()
+        if self.settings.unix_user_enumerate:
+            # Listing every Unix user once is cheaper than looking them up as they arrive.
+            await self.unix_users.prefetch(await self.users_to_be_synced)
+        queue: asyncio.Queue[typing.Optional[models.user.User]] = asyncio.Queue(
+            self.settings.sync_pipeline_queue_size
+        )
+
+        async def produce() -> None:
+            async for user in self.pipeline_users():
+                await self.plan_user(user)
+                if user.changes:
+                    await queue.put(user)
+            await queue.put(None)
+
+        async def consume() -> None:
+            loop = asyncio.get_running_loop()
+            pending = plan.Plan()
+            pending_users = 0
+            # When the changes waiting to be applied should be applied, however few there are.
+            flush_at = 0.0
+            finished = False
+            while not finished:
+                timeout = max(0.0, flush_at - loop.time()) if pending_users else None
+                try:
+                    user = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                else:
+                    if user is None:
+                        finished = True
+                    else:
+                        if not pending_users:
+                            flush_at = (
+                                loop.time() + self.settings.sync_pipeline_flush_interval
+                            )
+                        for operation in user.changes.operations:
+                            pending.add(operation)
+                            applied.add(operation)
+                        pending_users += 1
+                if pending_users and (
+                    finished
+                    or pending_users >= self.settings.sync_pipeline_batch_users
+                    or loop.time() >= flush_at
+                ):
+                    await self.executor.apply(pending)
+                    pending = plan.Plan()
+                    pending_users = 0
+
+        with metrics.Timer() as timer, tracing.Span("phase", phase="user_pipeline"):
+            tasks = {asyncio.ensure_future(produce()), asyncio.ensure_future(consume())}
+            done, running = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_EXCEPTION
+            )
+            # If either stage failed, stop the other rather than leaving it waiting.
+            for task in running:
+                task.cancel()
+            await asyncio.gather(*running, return_exceptions=True)
+            for task in done:
+                task.result()
+        metrics.PHASE_DURATION.set(timer.elapsed, phase="user_pipeline")
+
+        await self.report(applied)
+        return len(applied)
+
+    def save_recording(self) -> None:
+        """Save what was read while recording, or the writes captured while replaying."""
+        if self.recording is None:
+            return
+        if self.args.replay is not None:
+            self.recording.save_writes(self.args.replay)
+        elif self.args.record is not None:
+            self.recording.save(self.args.record)
+
+    def finish_cycle(self) -> None:
+        """Remember the users which were synced, leaving out any whose changes failed."""
+        if self.executor.failed_users:
+            logger.warning(
+                "Could not make every change for %s users: %s",
+                len(self.executor.failed_users),
+                ", ".join(sorted(self.executor.failed_users)),
+            )
+        for username in self.executor.failed_users:
+            self.state.mark_failed(username)
+        self.state.finish_cycle()
+
+    async def resume(self) -> int:
+        """Make the changes left over from a sync which was interrupted, if there is a journal.
+
+        Returns the number of changes resumed.
+        """
+        if self.journal is None:
+            return 0
+        resumed: int = await metrics.timed("resume", self.executor.resume())
+        return resumed
+
+    async def sync(self) -> int:
+        """Plan the changes for each account and user, then apply them.
+
+        Changes left over from an interrupted sync are made first. When running forever,
+        that is all the cycle does, and everything else is checked in the next one.
+        Returns the number of changes made.
+        """
+        try:
+            resumed = await self.resume()
+            if resumed and self.args.run_forever:
+                return resumed
+            made = resumed + await self.plan_and_apply()
+            if self.journal is not None:
+                self.journal.finish()
+            return made
+        finally:
+            # Record even if the sync failed, as that may be what needs investigating.
+            self.save_recording()
+
+    async def plan_and_apply(self) -> int:
+        """Plan the changes for each account and user, then apply them."""
+        if self.args.apply_plan is not None:
+            saved = plan.Plan.load(self.args.apply_plan)
+            await self.executor.apply(saved)
+            return len(saved)
+        if self.args.targeted:
+            await self.sync_selected()
+            return 0
+
+        if self.settings.sync_pipeline and self.args.plan_out is None:
+            made = await self.pipeline()
+            logger.info("Made %s changes.", made)
+            logger.info("Peak memory use %s MiB.", utils.peak_memory() // 1024)
+            if not self.args.dry_run:
+                self.finish_cycle()
+            return made
+
+        changes = await self.plan()
+        logger.info("Planned %s changes.", len(changes))
+        if self.args.plan_out is not None:
+            changes.dump(self.args.plan_out)
+            logger.info("Wrote plan to %s", self.args.plan_out)
+
+        await metrics.timed("apply", self.executor.apply(changes))
+        logger.info("Peak memory use %s MiB.", utils.peak_memory() // 1024)
+        if not self.args.dry_run:
+            self.finish_cycle()
+        return len(changes)
@@ -1,65 +1,71 @@
 import asyncio
-import functools
 import itertools
+import typing
 
 import asyncstdlib
 import jasmin_account_api_client
 
 from .. import cli
+from .. import portal as portal_module
 from .. import settings as settings_module
 from .. import utils
 from ..models import account
+from . import association
 
 
-class AccountSyncingMixin:
+class AccountSyncingMixin(association.AssociationSyncingMixin):
     """Mixin defining logic for syning SLURM accounts."""
 
     settings: settings_module.SyncSettings
     args: cli.SyncArgParser
     api_client: jasmin_account_api_client.AuthenticatedClient
+    portal: portal_module.PortalFetcher
+    runner: utils.CommandRunner
 
     @asyncstdlib.cached_property(asyncio.Lock)
     async def expected_slurm_accounts(self) -> set[account.AccountInfo]:
         """Get a list of all the SLURM accounts from the projects portal."""
-        client = self.api_client.get_async_httpx_client()
+        base_url = self.settings.api_projects_base_url
+        consortium_names: dict[typing.Any, str] = {}
+        services = []
 
-        # Run all the web requests we need to make in paralell.
-        async with asyncio.TaskGroup() as tg:
-            all_services_task = tg.create_task(
-                client.get(self.settings.api_projects_base_url + "services/")
-            )
-            all_consortia_task = tg.create_task(
-                client.get(self.settings.api_projects_base_url + "consortia/")
-            )
+        async def fetch_consortia() -> None:
+            async for x in self.portal.iter_items(base_url + "consortia/"):
+                consortium_names[x["id"]] = x["name"]
 
-        # Get the json results and rearrange for easy access.
-        all_services = all_services_task.result().json()
-        all_consortia = {x["id"]: x for x in all_consortia_task.result().json()}
+        async def fetch_services() -> None:
+            # Keep only services which are group workspaces (category 1) and have active requirements,
+            # and only the fields which are needed from them.
+            async for x in self.portal.iter_items(base_url + "services/"):
+                if x["has_active_requirements"] and (x["category"] == 1):
+                    services.append(
+                        (
+                            x["name"],
+                            x["consortium"],
+                            int(x.get("project_fairshare", 1)),
+                            int(x.get("consortium_fairshare", 1)),
+                        )
+                    )
 
-        # Get only services which are group workspaces (category 1) and have active requirements.
-        interested_services = [
-            x
-            for x in all_services
-            if x["has_active_requirements"] and (x["category"] == 1)
-        ]
+        # Run all the web requests we need to make in paralell.
+        await asyncio.gather(fetch_consortia(), fetch_services())
 
         accounts = set()
         # Get a list of all active services.
-        for service in interested_services:
+        for name, consortium, project_fairshare, consortium_fairshare in services:
             # Group workspaces are category 1.
-            consortium = all_consortia[service["consortium"]]
             accounts.add(
                 account.AccountInfo(
-                    name=service["name"],
-                    parent=consortium["name"],
-                    fairshare=int(service.get("project_fairshare", 1)),
+                    name=name,
+                    parent=consortium_names[consortium],
+                    fairshare=project_fairshare,
                 )
             )
             accounts.add(
                 account.AccountInfo(
-                    name=consortium["name"],
+                    name=consortium_names[consortium],
                     parent="root",
-                    fairshare=int(service.get("consortium_fairshare", 1)),
+                    fairshare=consortium_fairshare,
                 )
             )
         # Add in accounts for default and noprojects so that the manager doesn't delete them.
@@ -83,43 +89,27 @@ class AccountSyncingMixin:
         return accounts
 
     @asyncstdlib.cached_property(asyncio.Lock)
-    async def account_names_available(self):
+    async def account_names_available(self) -> frozenset[str]:
         """Text list of account names which will exist once the syncer has run."""
-        return set(x.name for x in await self.expected_slurm_accounts)
+        return frozenset(x.name for x in await self.expected_slurm_accounts)
 
-    @functools.cached_property
-    def existing_slurm_accounts(self) -> set[account.AccountInfo]:
+    @asyncstdlib.cached_property(asyncio.Lock)
+    async def existing_slurm_accounts(self) -> set[account.AccountInfo]:
         """Get a list of existing SLURM accounts from SLURM."""
-        args = [
-            "sacctmgr",
-            "show",
-            "account",
-            "withassoc",
-            "format=parentname%50,account%50,fairshare%50",
-            "--parsable2",
-            "--noheader",
-        ]
-        cmd_output = utils.run_ratelimited(args, capture_output=True, check=True)
-        # sacctmgr returns a newline seperated list of strings,
-        # padded to 50 characters as specified above.
-        # padding is necessary to ensure no account names are trucated.
-        # we split on the newlines,
-        # strip any whitespace then filter out any blank lines.
-        account_bytes = cmd_output.stdout.splitlines()
-        account_lists = [x.decode("utf-8").split("|") for x in account_bytes]
-        account_tuples = [
-            account.AccountInfo(name=x[1], parent=x[0], fairshare=int(x[2]))
-            for x in account_lists
-        ]
-        # filter out accounts which have no parent: this isn't possible.
-        filtered_account_tuples = [x for x in account_tuples if x.parent]
-        return set(filtered_account_tuples)
+        return set((await self.slurm_associations).accounts.values())
 
     @asyncstdlib.cached_property(asyncio.Lock)
     async def accounts_to_be_synced(self) -> set[str]:
         """Return accounts which don't exactly match in both sets."""
-        wrong_accounts = (
-            await self.expected_slurm_accounts
-        ) ^ self.existing_slurm_accounts
+        wrong_accounts = (await self.expected_slurm_accounts) ^ (
+            await self.existing_slurm_accounts
+        )
 
         return {x.name for x in wrong_accounts}
+
+    @asyncstdlib.cached_property(asyncio.Lock)
+    async def account_index(self) -> account.AccountIndex:
+        """Existing and expected accounts, indexed by name."""
+        return account.AccountIndex(
+            await self.expected_slurm_accounts, await self.existing_slurm_accounts
+        )
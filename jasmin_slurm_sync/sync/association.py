@@ -0,0 +1,172 @@
+import asyncio
+import datetime
+import logging
+import subprocess as sp
+import time
+
+import asyncstdlib
+
+from .. import cli
+from .. import settings as settings_module
+from .. import state as state_module
+from .. import tracing, utils
+from ..models import association
+
+logger = logging.getLogger(__name__)
+
+# Seconds of transaction history to re-read to allow for clock differences with slurmdbd.
+TRANSACTION_OVERLAP = 60
+
+
+class AssociationSyncingMixin:
+    """Mixin defining logic for reading the SLURM association table."""
+
+    settings: settings_module.SyncSettings
+    args: cli.SyncArgParser
+    runner: utils.CommandRunner
+    state: state_module.SyncState
+
+    async def show_associations(self, *where: str) -> sp.CompletedProcess[bytes]:
+        """Run sacctmgr show associations, optionally filtered."""
+        return await self.runner.run(
+            [
+                "sacctmgr",
+                "show",
+                "associations",
+                *(["where", *where] if where else []),
+                f"format={','.join(association.ASSOCIATION_FORMAT)}",
+                "--parsable2",
+                "--noheader",
+            ]
+        )
+
+    async def show_users(self, *names: str) -> sp.CompletedProcess[bytes]:
+        """Run sacctmgr show user, optionally for only some users."""
+        return await self.runner.run(
+            [
+                "sacctmgr",
+                "show",
+                "user",
+                *([",".join(names)] if names else []),
+                f"format={','.join(association.USER_FORMAT)}",
+                "--parsable2",
+                "--noheader",
+            ]
+        )
+
+    async def load_associations(self) -> association.AssociationSnapshot:
+        """Read the whole association table into a new snapshot.
+
+        The account hierarchy, fairshares and users' accounts all come from a single scan of the
+        association table. Default accounts are stored against the user rather than the association,
+        so are read from the user table, without associations, at the same time.
+        """
+        started = time.time()
+        associations_output, users_output = await asyncio.gather(
+            self.show_associations(), self.show_users()
+        )
+        with tracing.Span("parse_associations"):
+            snapshot = association.AssociationSnapshot.parse(
+                associations_output.stdout, users_output.stdout
+            )
+        self.state.associations = snapshot
+        self.state.associations_loaded = self.state.associations_updated = started
+        return snapshot
+
+    async def reload_users(
+        self, snapshot: association.AssociationSnapshot, users: set[str]
+    ) -> None:
+        """Re-read some users' associations and default accounts into the snapshot."""
+        if users:
+            user_associations, user_defaults = await asyncio.gather(
+                self.show_associations(f"users={','.join(sorted(users))}"),
+                self.show_users(*sorted(users)),
+            )
+            snapshot.replace_users(
+                users, user_associations.stdout, user_defaults.stdout
+            )
+
+    async def reload_accounts(
+        self, snapshot: association.AssociationSnapshot, accounts: set[str]
+    ) -> None:
+        """Re-read some accounts, and their users, into the snapshot."""
+        if accounts:
+            account_associations = await self.show_associations(
+                f"accounts={','.join(sorted(accounts))}"
+            )
+            snapshot.replace_accounts(accounts, account_associations.stdout)
+
+    async def refresh_associations(
+        self, snapshot: association.AssociationSnapshot
+    ) -> bool:
+        """Update the snapshot with the changes made since it was last updated.
+
+        Uses sacctmgr's transaction history to find the users and accounts which have changed,
+        then re-reads only those. Returns False if the snapshot can't be updated this way.
+        """
+        started = time.time()
+        since = datetime.datetime.fromtimestamp(
+            self.state.associations_updated - TRANSACTION_OVERLAP
+        )
+        transactions_output = await self.runner.run(
+            [
+                "sacctmgr",
+                "list",
+                "transactions",
+                f"start={since.strftime('%Y-%m-%dT%H:%M:%S')}",
+                f"format={','.join(association.TRANSACTION_FORMAT)}",
+                "--parsable2",
+                "--noheader",
+            ]
+        )
+        changed = association.changed_entities(transactions_output.stdout)
+        if changed is None:
+            return False
+        users, accounts = changed
+        if len(users) + len(accounts) > self.settings.slurm_max_incremental_changes:
+            logger.info(
+                "%s users and %s accounts have changed, too many to refresh incrementally.",
+                len(users),
+                len(accounts),
+            )
+            return False
+
+        await asyncio.gather(
+            self.reload_users(snapshot, users),
+            self.reload_accounts(snapshot, accounts),
+        )
+
+        logger.info(
+            "Refreshed %s users and %s accounts from SLURM's transaction history.",
+            len(users),
+            len(accounts),
+        )
+        self.state.associations_updated = started
+        return True
+
+    @asyncstdlib.cached_property(asyncio.Lock)
+    async def slurm_associations(self) -> association.AssociationSnapshot:
+        """Get a snapshot of all the SLURM associations.
+
+        If a snapshot was kept from a previous cycle and isn't too old,
+        only the changes since then are read.
+        If only some users and accounts are being synced, the snapshot starts empty,
+        and only they are read into it.
+        """
+        if self.args.targeted:
+            return association.AssociationSnapshot.parse(b"", b"")
+
+        snapshot = self.state.associations
+        if (
+            self.settings.slurm_incremental_refresh
+            and snapshot is not None
+            and time.time() - self.state.associations_loaded
+            < self.settings.slurm_snapshot_max_age
+        ):
+            try:
+                if await self.refresh_associations(snapshot):
+                    return snapshot
+            except sp.CalledProcessError:
+                logger.warning("Could not read SLURM's transaction history.")
+            logger.info("Reloading all SLURM associations.")
+        return await self.load_associations()
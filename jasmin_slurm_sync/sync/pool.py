@@ -0,0 +1,148 @@
+import asyncio
+import concurrent.futures
+import dataclasses
+import logging
+import multiprocessing
+import sys
+import typing
+
+from .. import cli, metrics, plan
+from .. import settings as settings_module
+from .. import shard as shard_module
+from ..models import account, association
+from . import SLURMSyncer
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class SharedReads:
+    """What the parent process has read from SLURM and the portals, which every worker needs."""
+
+    associations: association.AssociationSnapshot
+    expected_accounts: set[account.AccountInfo]
+    portal_users: set[str]
+
+    def for_shard(self, shard: shard_module.Shard) -> "SharedReads":
+        """Only what is needed to sync the users in a shard."""
+        return SharedReads(
+            association.AssociationSnapshot(
+                self.associations.accounts,
+                {
+                    k: v
+                    for k, v in self.associations.user_accounts.items()
+                    if k in shard
+                },
+                {
+                    k: v
+                    for k, v in self.associations.default_accounts.items()
+                    if k in shard
+                },
+            ),
+            self.expected_accounts,
+            {x for x in self.portal_users if x in shard},
+        )
+
+    def share_with(self, syncer: SLURMSyncer) -> None:
+        """Have a worker's syncer use these, and leave the accounts alone."""
+        syncer.plan_account_changes = False
+        syncer.remember(
+            slurm_associations=self.associations,
+            expected_slurm_accounts=self.expected_accounts,
+            portal_slurm_users=self.portal_users,
+        )
+
+
+async def sync_shard(
+    settings: settings_module.SyncSettings,
+    args: cli.SyncArgParser,
+    shared: SharedReads,
+) -> dict[str, typing.Any]:
+    """Sync the users in a shard, returning what was done."""
+    syncer = SLURMSyncer(settings, args)
+    try:
+        shared.share_with(syncer)
+        changes = await syncer.sync()
+        return {
+            "changes": changes,
+            "examined": metrics.EXAMINED.get(kind="user"),
+            "changed": metrics.CHANGED.get(kind="user"),
+            "reconciled": len(syncer.state.candidates),
+            "failed": sorted(syncer.portal_failed_users),
+        }
+    finally:
+        await syncer.close()
+
+
+def run_worker(
+    argv: list[str], index: int, count: int, shared: SharedReads
+) -> dict[str, typing.Any]:
+    """Sync one shard of the users in a worker process."""
+    logging.basicConfig(level=logging.INFO)
+    args = cli.SyncArgParser().parse_args(
+        [*argv, "--shard", f"{index}/{count}", "--workers", "1"]
+    )
+    settings = shard_module.share_settings(
+        settings_module.load_settings(args.config), count
+    )
+    return asyncio.run(sync_shard(settings, args, shared))
+
+
+async def sync_in_workers(syncer: SLURMSyncer) -> int:
+    """Sync the accounts, then split the users between worker processes.
+
+    SLURM and the portal listings are only read here, and each worker is given
+    what it needs for its shard of the users, so it only fetches those users' grants.
+    Each worker has its own connections to the portals and an equal share
+    of the sacctmgr rate limits, so the limits hold overall.
+    Returns the number of changes made.
+    """
+    count = syncer.args.workers
+    await asyncio.gather(
+        metrics.timed("slurm_read", syncer.slurm_associations),
+        syncer.expected_slurm_accounts,
+        syncer.portal_slurm_users,
+    )
+    changes = plan.Plan()
+    await syncer.plan_accounts(changes)
+    await metrics.timed("account_apply", syncer.executor.apply(changes))
+    shared = SharedReads(
+        await syncer.slurm_associations,
+        await syncer.expected_slurm_accounts,
+        await syncer.portal_slurm_users,
+    )
+
+    loop = asyncio.get_running_loop()
+    with concurrent.futures.ProcessPoolExecutor(
+        count, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        results = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    pool,
+                    run_worker,
+                    sys.argv[1:],
+                    i,
+                    count,
+                    shared.for_shard(shard_module.Shard(i, count)),
+                )
+                for i in range(count)
+            )
+        )
+
+    # Merge the workers' results into a single report.
+    metrics.EXAMINED.set(sum(x["examined"] for x in results), kind="user")
+    metrics.CHANGED.set(sum(x["changed"] for x in results), kind="user")
+    metrics.CHANGED.set(len(changes.changed()[1]), kind="account")
+    failed = [y for x in results for y in x["failed"]]
+    if failed:
+        logger.warning(
+            "Could not fetch grants for %s users: %s", len(failed), ", ".join(failed)
+        )
+    logger.info(
+        "Reconciled %s of %s users in %s workers.",
+        sum(x["reconciled"] for x in results),
+        sum(x["examined"] for x in results),
+        count,
+    )
+    return len(changes) + int(sum(x["changes"] for x in results))
@@ -1,146 +1,205 @@
 import asyncio
-import collections
-import functools
 import logging
+import typing
 
 import asyncstdlib
+import httpx
 import jasmin_account_api_client
 
 from .. import cli
+from .. import portal as portal_module
 from .. import settings as settings_module
+from .. import shard as shard_module
 from .. import utils
 from ..models import account, user
+from . import association
 
 logger = logging.getLogger(__name__)
 
 
-class UserSyncingMixin:
+class UserSyncingMixin(association.AssociationSyncingMixin):
     """Mixin defining logic for sycing the accounts of SLURM users."""
 
     settings: settings_module.SyncSettings
     args: cli.SyncArgParser
     api_client: jasmin_account_api_client.AuthenticatedClient
+    portal: portal_module.PortalFetcher
+    portal_failed_users: set[str]
+    runner: utils.CommandRunner
+    shard: typing.Optional[shard_module.Shard]
 
     @asyncstdlib.cached_property(asyncio.Lock)
     async def users_to_be_synced(self) -> set[str]:
         """Return list of all users who should be synced.
 
-        This is all the ones from both SLURM AND the accounts portal.
+        This is all the ones from both SLURM AND the accounts portal, in this shard if there is one.
         """
-        return (await self.portal_slurm_users) | set(self.all_slurm_users.keys())
+        users = (await self.portal_slurm_users) | set(
+            (await self.all_slurm_users).keys()
+        )
+        if self.shard is not None:
+            users = {x for x in users if x in self.shard}
+        return users
 
     @asyncstdlib.cached_property(asyncio.Lock)
     async def portal_slurm_users(self) -> set[str]:
-        """Get the list of users from the JASMIN accounts portal."""
-        client = self.api_client.get_async_httpx_client()
+        """Get the list of users from the JASMIN accounts portal, in this shard if there is one."""
         category, service = self.settings.list_users_role.split("/")
 
-        role_user_list = (
-            await client.get(
+        # Only the usernames are kept, a page at a time.
+        return {
+            x["user"]["username"]
+            async for x in self.portal.iter_items(
                 self.settings.api_accounts_base_url
-                + f"categories/{category}/services/{service}/roles/USER/"
+                + f"categories/{category}/services/{service}/roles/USER/",
+                "accesses",
             )
-        ).json()["accesses"]
-        usernames = [x["user"]["username"] for x in role_user_list]
-        return set(usernames)
+            if self.shard is None or x["user"]["username"] in self.shard
+        }
+
+    def services_from_grants(
+        self,
+        username: str,
+        grants: list[dict[str, typing.Any]],
+        account_names_available: typing.AbstractSet[str],
+    ) -> set[str]:
+        """Convert a user's grants from the accounts portal to the SLURM accounts they should have."""
+        # Pre-populate the users' list of accounts with the default account.
+        user_accounts = {self.settings.default_account}
+        extra_accounts = set()  # Keep track of extra accounts.
+        for grant in grants:
+            if grant["role"]["name"] == "USER":
+                # Add all the group workspaces.
+                if grant["service"]["category"]["name"] == "group_workspaces":
+                    # Check that the GWS account in question will exist.
+                    if grant["service"]["name"] in account_names_available:
+                        user_accounts.add(grant["service"]["name"])
+                    else:
+                        logger.warning(
+                            "Will not add user %s to account %s, as the account does not exist.",
+                            username,
+                            grant["service"]["name"],
+                        )
+                # Add extra mappings.
+                service_name = (
+                    f"{grant['service']['category']['name']}/{grant['service']['name']}"
+                )
+                if service_name in self.settings.extra_account_mapping.keys():
+                    # Keep track of extra accounts so we know who to add to the no_project account.
+                    extra_accounts.update(
+                        self.settings.extra_account_mapping[service_name]
+                    )
+                    user_accounts.update(
+                        self.settings.extra_account_mapping[service_name]
+                    )
+        # Add the no project account to users who have no other account.
+        if len(user_accounts - extra_accounts) <= 1:
+            user_accounts.add(self.settings.no_project_account)
+        return user_accounts
 
-    @asyncstdlib.cached_property(asyncio.Lock)
-    async def portal_user_services(self) -> dict[str, set[str]]:
-        """Get a list of services for each user."""
-        account_names_available = await self.account_names_available
+    async def fetch_user_grants(
+        self, username: str
+    ) -> typing.Optional[list[dict[str, typing.Any]]]:
+        """Get a user's grants from the accounts portal.
 
-        client = self.api_client.get_async_httpx_client()
-        tasks = []
-        async with asyncio.TaskGroup() as tg:
-            for username in await self.portal_slurm_users:
-                tasks.append(
-                    tg.create_task(
-                        client.get(
-                            self.settings.api_accounts_base_url
-                            + f"users/{username}/grants/"
-                        ),
-                        name=username,
-                    )
-                )
-        # Pre-populate each users' list of accounts with the default account.
-        user_accounts = collections.defaultdict(
-            functools.partial(set, [self.settings.default_account])
+        If they can't be fetched, the user is recorded in portal_failed_users and None is returned.
+        """
+        try:
+            grants: list[dict[str, typing.Any]] = await self.portal.get_json(
+                self.settings.api_accounts_base_url + f"users/{username}/grants/"
+            )
+        except (httpx.HTTPError, ValueError) as err:
+            logger.error(
+                "Could not get grants for user %s, not syncing them: %s",
+                username,
+                err,
+            )
+            self.portal_failed_users.add(username)
+            return None
+        return grants
+
+    def has_list_users_role(self, grants: list[dict[str, typing.Any]]) -> bool:
+        """Check whether a user's grants include the role which makes them a SLURM user."""
+        return any(
+            grant["role"]["name"] == "USER"
+            and f"{grant['service']['category']['name']}/{grant['service']['name']}"
+            == self.settings.list_users_role
+            for grant in grants
         )
-        for task in tasks:
-            result = task.result().json()
-            username = task.get_name()
-            extra_accounts = set()  # Keep track of extra accounts.
-            for grant in result:
-                if grant["role"]["name"] == "USER":
-                    # Add all the group workspaces.
-                    if grant["service"]["category"]["name"] == "group_workspaces":
-                        # Check that the GWS account in question will exist.
-                        if grant["service"]["name"] in account_names_available:
-                            user_accounts[username].add(grant["service"]["name"])
-                        else:
-                            logger.warning(
-                                "Will not add user %s to account %s, as the account does not exist.",
-                                username,
-                                grant["service"]["name"],
-                            )
-                    # Add extra mappings.
-                    service_name = f"{grant['service']['category']['name']}/{grant['service']['name']}"
-                    if service_name in self.settings.extra_account_mapping.keys():
-                        # Keep track of extra accounts so we know who to add to the no_project account.
-                        extra_accounts.update(
-                            self.settings.extra_account_mapping[service_name]
-                        )
-                        user_accounts[username].update(
-                            self.settings.extra_account_mapping[service_name]
-                        )
-            # Add the no project account to users who have no other account.
-            if len(user_accounts[username] - extra_accounts) <= 1:
-                user_accounts[username].add(self.settings.no_project_account)
-        return user_accounts
 
-    @functools.cached_property
-    def all_slurm_users(self) -> dict[str, set[str]]:
-        """Get a list of all SLURM users, with their accounts, from SLURM."""
-        args = [
-            "sacctmgr",
-            "show",
-            "user",
-            "withassoc",
-            "format=user%50,account%50",
-            "--noheader",
-        ]
-        cmd_output = utils.run_ratelimited(args, capture_output=True, check=True)
-        # sacctmgr returns a newline seperated list of strings,
-        # padded to 50 characters as specified above.
-        # padding is necessary to ensure no account names are trucated.
-        # we split on the newlines,
-        # strip any whitespace then filter out any blank lines.
-        accounts_strings = cmd_output.stdout.splitlines()
-        accounts_pairs = (x.decode("utf-8").split() for x in accounts_strings)
-        valid_pairs = (x for x in accounts_pairs if len(x) == 2)
-
-        # Convert the user: account pairs into a dict of sets
-        # for
-        user_accounts = collections.defaultdict(set)
-        for user, account in valid_pairs:
-            user_accounts[user].add(account)
+    async def stream_user_services(
+        self,
+    ) -> typing.AsyncIterator[tuple[str, frozenset[str]]]:
+        """Yield the services of each user from the portal, as soon as their grants arrive.
 
-        return user_accounts
+        Users whose grants could not be fetched are left out, and recorded in portal_failed_users
+        so that they are not synced. Users with the same services share a single frozenset of them.
+        At most portal_max_in_flight users are fetched, or waiting to be taken, at once,
+        so fetching waits when whatever is taking the users falls behind.
+        """
+        account_names_available = await self.account_names_available
+        interner = utils.Interner()
+        usernames = iter(await self.portal_slurm_users)
+        limit = self.settings.portal_max_in_flight
+        slots = asyncio.Semaphore(limit)
+        # Each user's services, and None when a worker has run out of users.
+        results: asyncio.Queue[
+            typing.Optional[tuple[str, typing.Optional[frozenset[str]]]]
+        ] = asyncio.Queue()
+
+        async def fetch_user_services(
+            username: str,
+        ) -> tuple[str, typing.Optional[frozenset[str]]]:
+            grants = await self.fetch_user_grants(username)
+            if grants is None:
+                return username, None
+            # Only keep the accounts, not the whole response.
+            return username, interner(
+                self.services_from_grants(username, grants, account_names_available)
+            )
+
+        async def fetch_users() -> None:
+            try:
+                for username in usernames:
+                    await slots.acquire()
+                    results.put_nowait(await fetch_user_services(username))
+            finally:
+                results.put_nowait(None)
+
+        workers = [asyncio.ensure_future(fetch_users()) for _ in range(limit)]
+        try:
+            finished = 0
+            while finished < len(workers):
+                result = await results.get()
+                if result is None:
+                    finished += 1
+                    # Stop straight away if the worker failed.
+                    for worker in workers:
+                        if worker.done():
+                            worker.result()
+                    continue
+                slots.release()
+                username, services = result
+                if services is not None:
+                    yield username, services
+        finally:
+            for worker in workers:
+                worker.cancel()
 
-    @functools.cached_property
-    def all_default_accounts(self) -> dict[str, str]:
+    @asyncstdlib.cached_property(asyncio.Lock)
+    async def portal_user_services(self) -> dict[str, frozenset[str]]:
+        """Get a list of services for each user."""
+        return {
+            username: services
+            async for username, services in self.stream_user_services()
+        }
+
+    @asyncstdlib.cached_property(asyncio.Lock)
+    async def all_slurm_users(self) -> dict[str, frozenset[str]]:
+        """Get a list of all SLURM users, with their accounts, from SLURM."""
+        return (await self.slurm_associations).user_accounts
+
+    @asyncstdlib.cached_property(asyncio.Lock)
+    async def all_default_accounts(self) -> dict[str, str]:
         """Get a list of all SLURM users, with their default accounts, from SLURM."""
-        args = [
-            "sacctmgr",
-            "show",
-            "user",
-            "withassoc",
-            "format=user%50,defaultaccount%50",
-            "--noheader",
-            "--parsable2",
-        ]
-        cmd_output = utils.run_ratelimited(args, capture_output=True, check=True)
-        user_bytes = cmd_output.stdout.splitlines()
-        user_list = [x.decode("utf-8").split("|") for x in user_bytes]
-        default_accounts = {x[0]: x[1] for x in user_list}
-        return default_accounts
+        return (await self.slurm_associations).default_accounts
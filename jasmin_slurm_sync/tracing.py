@@ -0,0 +1,75 @@
+import cProfile
+import json
+import logging
+import pathlib
+import time
+import typing
+
+# Spans are logged here at debug level, as a JSON object per line.
+logger = logging.getLogger("jasmin_slurm_sync.spans")
+
+
+class Span:
+    """Context manager which logs how long its block took, and what it was doing.
+
+    Costs almost nothing unless span logging is turned on.
+    """
+
+    def __init__(self, name: str, **attributes: typing.Any) -> None:
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self) -> "Span":
+        self.enabled = logger.isEnabledFor(logging.DEBUG)
+        if self.enabled:
+            self.started = time.time()
+            self.perf_started = time.perf_counter()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: typing.Optional[type[BaseException]],
+        *exc_info: typing.Any,
+    ) -> None:
+        if self.enabled:
+            record = {
+                "span": self.name,
+                "start": self.started,
+                "duration": time.perf_counter() - self.perf_started,
+                **self.attributes,
+            }
+            if exc_type is not None:
+                record["error"] = exc_type.__name__
+            logger.debug(json.dumps(record, default=str))
+
+
+def log_spans(path: pathlib.Path) -> None:
+    """Write spans to a file, and only there."""
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+
+
+class Profile:
+    """Context manager which profiles its block, and saves the stats to a directory.
+
+    Each block gets its own file, named after the time it started,
+    which can be read with pstats or snakeviz.
+    """
+
+    def __init__(self, directory: pathlib.Path) -> None:
+        self.directory = directory
+        self.profiler = cProfile.Profile()
+
+    def __enter__(self) -> "Profile":
+        self.path = self.directory / time.strftime("cycle-%Y%m%dT%H%M%S.prof")
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info: typing.Any) -> None:
+        self.profiler.disable()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.profiler.dump_stats(self.path)
+        logging.getLogger(__name__).info("Saved profile to %s", self.path)
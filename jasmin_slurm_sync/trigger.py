@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import os
+import pathlib
+import typing
+
+logger = logging.getLogger(__name__)
+
+# Things which can be synced on request.
+KINDS = {"user", "account"}
+
+Handler = typing.Callable[[str, str], typing.Awaitable[None]]
+
+
+class TriggerServer:
+    """Listen on a Unix socket for requests to sync a single user or account straight away.
+
+    Each request is a line of the form "user <username>" or "account <account name>".
+    Once the sync has finished, the server replies "ok", or "error <message>" if it failed.
+    Requests for something which is already being synced are coalesced:
+    the sync is run once more after the current one finishes, however many requests arrive.
+    """
+
+    def __init__(self, path: pathlib.Path, handler: Handler) -> None:
+        self.path = path
+        self.handler = handler
+
+        self.in_flight: dict[tuple[str, str], asyncio.Task[None]] = {}
+        self.rerun: set[tuple[str, str]] = set()
+
+    async def start(self) -> asyncio.AbstractServer:
+        """Start listening on the socket."""
+        # Remove the socket left behind by a previous run.
+        self.path.unlink(missing_ok=True)
+        server = await asyncio.start_unix_server(
+            self.handle_connection, path=str(self.path)
+        )
+        os.chmod(self.path, 0o600)
+        logger.info("Listening for sync requests on %s", self.path)
+        return server
+
+    async def run(self, key: tuple[str, str]) -> None:
+        """Sync something, again if it was requested while it was being synced."""
+        try:
+            while True:
+                self.rerun.discard(key)
+                await self.handler(*key)
+                if key not in self.rerun:
+                    break
+        finally:
+            del self.in_flight[key]
+
+    async def trigger(self, kind: str, name: str) -> None:
+        """Request that something be synced, and wait until it has been."""
+        key = (kind, name)
+        if key in self.in_flight:
+            logger.debug("Sync of %s %s already in progress.", kind, name)
+            self.rerun.add(key)
+        else:
+            self.in_flight[key] = asyncio.create_task(self.run(key))
+        # Shield the sync from the request being cancelled, as other requests may be waiting for it.
+        await asyncio.shield(self.in_flight[key])
+
+    async def handle_request(self, line: str) -> str:
+        """Handle a single request and return the reply."""
+        try:
+            kind, name = line.split()
+        except ValueError:
+            return "error expected '<kind> <name>'"
+        if kind not in KINDS:
+            return f"error kind must be one of {', '.join(sorted(KINDS))}"
+
+        logger.info("Received request to sync %s %s.", kind, name)
+        try:
+            await self.trigger(kind, name)
+        except Exception as err:
+            logger.exception("Failed to sync %s %s.", kind, name)
+            return f"error {type(err).__name__} {err}".strip()
+        return "ok"
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Handle requests from a client, one per line, until it disconnects."""
+        try:
+            while line := await reader.readline():
+                reply = await self.handle_request(line.decode("utf-8").strip())
+                writer.write(reply.encode("utf-8") + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
@@ -1,21 +1,65 @@
+import asyncio
 import logging
+import resource
 import subprocess as sp
-import time
+import sys
 import typing
 
+from . import metrics, ratelimit, tracing
+
 logger = logging.getLogger(__name__)
 
 
-def run_ratelimited(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
-    """Call subprocess to call a slurm command.
+def peak_memory() -> int:
+    """Peak resident memory of this process, in KiB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class CommandRunner:
+    """Run SLURM commands without blocking the event loop.
 
-    Enforces rate limiting.
+    Enforces rate limiting, and limits the number of commands running at once.
     """
-    logger.debug("sp.run %s, %s", args, kwargs)
-    try:
-        result = sp.run(*args, **kwargs)
-    except sp.CalledProcessError as err:
-        logger.critical("Command output was: %s", err.output)
-        raise err
-    time.sleep(1)
-    return result
+
+    def __init__(self, limiter: ratelimit.RateLimiter, max_workers: int) -> None:
+        self.limiter = limiter
+        self.semaphore = asyncio.Semaphore(max_workers)
+
+    async def run(
+        self, args: list[str], check: bool = True
+    ) -> sp.CompletedProcess[bytes]:
+        """Call a slurm command in a subprocess and capture its output."""
+        subcommand = ratelimit.RateLimiter.subcommand(args)
+        await self.limiter.acquire(args)
+        async with self.semaphore:
+            logger.debug("Running %s", args)
+            with metrics.Timer() as timer, tracing.Span(
+                "sacctmgr", command=subcommand, args=args
+            ):
+                process = await asyncio.create_subprocess_exec(
+                    *args, stdout=sp.PIPE, stderr=sp.PIPE
+                )
+                stdout, stderr = await process.communicate()
+        metrics.SACCTMGR_CALLS.inc(command=subcommand)
+        metrics.SACCTMGR_DURATION.observe(timer.elapsed, command=subcommand)
+        result = sp.CompletedProcess(args, process.returncode or 0, stdout, stderr)
+        if check and result.returncode:
+            logger.critical("Command output was: %s", stdout)
+            raise sp.CalledProcessError(result.returncode, args, stdout, stderr)
+        return result
+
+
+class Interner:
+    """Share one frozenset of interned names between everything with the same names.
+
+    Most users are members of the same few combinations of accounts,
+    so with tens of thousands of users this saves holding a separate set for each of them.
+    """
+
+    def __init__(self) -> None:
+        self.sets: dict[frozenset[str], frozenset[str]] = {}
+
+    def __call__(self, names: typing.Iterable[str]) -> frozenset[str]:
+        """Return the shared frozenset of the given names."""
+        names = frozenset(sys.intern(x) for x in names)
+        return self.sets.setdefault(names, names)
@@ -1,9 +1,24 @@
 """Reusable test cases for jasmin-slurm-sync."""
 
 import pathlib
+import random
+import subprocess as sp
+import typing
 import unittest
+import unittest.mock
 
+import benchmarks.portal
+import benchmarks.sacctmgr
 import jasmin_slurm_sync.cli
+import jasmin_slurm_sync.ratelimit
+import jasmin_slurm_sync.settings
+
+try:
+    import jasmin_slurm_sync.sync
+except ModuleNotFoundError:  # The portal API client is installed from git.
+    SYNC_AVAILABLE = False
+else:
+    SYNC_AVAILABLE = True
 
 
 class CliArgsMixin(unittest.TestCase):
@@ -16,3 +31,67 @@ class CliArgsMixin(unittest.TestCase):
         args.dry_run = False
         args.run_forever = False
         self.args = args
+
+
+class SyntheticSyncMixin(CliArgsMixin):
+    """Mixin for syncing against the benchmarks' synthetic portal and fake sacctmgr.
+
+    Every account exists in SLURM to start with, but none of the users do.
+    sacctmgr reads and writes, and users' grants being fetched, are recorded in events in order.
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.settings = jasmin_slurm_sync.settings.load_settings(
+            self.args.config
+        ).model_copy(
+            update={
+                "unmanaged_users": [],
+                "extra_account_mapping": {},
+                "slurm_cluster": benchmarks.sacctmgr.CLUSTER,
+                "sacctmgr_read_rate": 1000000.0,
+                "sacctmgr_write_rate": 1000000.0,
+            }
+        )
+        self.portal = benchmarks.portal.SyntheticPortal(
+            self.settings, 60, 10, 3, random.Random(0)
+        )
+        self.store = benchmarks.sacctmgr.Store(dict(self.portal.accounts))
+        self.events: list[str] = []
+
+        # The synthetic users don't have Unix accounts.
+        patcher = unittest.mock.patch("pwd.getpwnam")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_syncer(self) -> "jasmin_slurm_sync.sync.SLURMSyncer":
+        """A syncer which reads and changes the synthetic portal and fake sacctmgr."""
+        syncer = jasmin_slurm_sync.sync.SLURMSyncer(
+            self.settings,
+            self.args,
+            api_client=benchmarks.portal.FakeApiClient(self.portal),  # type: ignore
+        )
+
+        async def run(
+            args: list[str], check: bool = True
+        ) -> sp.CompletedProcess[bytes]:
+            self.events.append(
+                jasmin_slurm_sync.ratelimit.RateLimiter.command_class(args)
+            )
+            output = benchmarks.sacctmgr.run(self.store, args[1:])
+            return sp.CompletedProcess(args, 0, "\n".join(output).encode(), b"")
+
+        fetch_user_grants = syncer.fetch_user_grants
+
+        async def fetch(username: str) -> typing.Any:
+            grants = await fetch_user_grants(username)
+            self.events.append("fetch")
+            return grants
+
+        for patcher in [
+            unittest.mock.patch.object(syncer.runner, "run", side_effect=run),
+            unittest.mock.patch.object(syncer, "fetch_user_grants", side_effect=fetch),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        return syncer
@@ -0,0 +1,109 @@
+import unittest
+
+import jasmin_slurm_sync.models.association
+from jasmin_slurm_sync.models.account import AccountInfo
+
+ASSOCIATIONS = b"""root||1|
+root||root|1
+consortium|root||10
+gws1|consortium||2
+gws1||alice|1
+gws1||bob|1
+default-account|root||1
+default-account||alice|1
+"""
+
+USERS = b"""alice|default-account
+bob|gws1
+root|root
+"""
+
+
+class AssociationSnapshotTestCase(unittest.TestCase):
+    """Test parsing sacctmgr output into an association snapshot."""
+
+    def setUp(self) -> None:
+        self.snapshot = jasmin_slurm_sync.models.association.AssociationSnapshot.parse(
+            ASSOCIATIONS, USERS
+        )
+
+    def test_accounts(self):
+        """Accounts are indexed by name, without the root account."""
+        self.assertEqual(
+            self.snapshot.accounts,
+            {
+                "consortium": AccountInfo("consortium", "root", 10),
+                "gws1": AccountInfo("gws1", "consortium", 2),
+                "default-account": AccountInfo("default-account", "root", 1),
+            },
+        )
+
+    def test_user_accounts(self):
+        """Each user's accounts are indexed by username."""
+        self.assertEqual(
+            self.snapshot.user_accounts["alice"], {"gws1", "default-account"}
+        )
+        self.assertEqual(self.snapshot.user_accounts["bob"], {"gws1"})
+        self.assertEqual(self.snapshot.user_accounts["root"], {"root"})
+
+    def test_user_accounts_shared(self):
+        """Users with the same accounts share one frozenset of them."""
+        self.snapshot.replace_users(["carol"], b"gws1||carol|1\n", b"")
+        self.assertIs(
+            self.snapshot.user_accounts["carol"], self.snapshot.user_accounts["bob"]
+        )
+
+    def test_default_accounts(self):
+        """Default accounts are indexed by username."""
+        self.assertEqual(self.snapshot.default_accounts["bob"], "gws1")
+
+
+class IncrementalRefreshTestCase(unittest.TestCase):
+    """Test updating a snapshot with only what has changed."""
+
+    def setUp(self) -> None:
+        self.snapshot = jasmin_slurm_sync.models.association.AssociationSnapshot.parse(
+            ASSOCIATIONS, USERS
+        )
+
+    def test_replace_users(self):
+        """Re-reading a user replaces their accounts and default account."""
+        self.snapshot.replace_users(
+            ["alice", "carol"],
+            b"gws1||carol|1\n",
+            b"carol|gws1\n",
+        )
+        self.assertNotIn("alice", self.snapshot.user_accounts)
+        self.assertNotIn("alice", self.snapshot.default_accounts)
+        self.assertEqual(self.snapshot.user_accounts["carol"], {"gws1"})
+        self.assertEqual(self.snapshot.user_accounts["bob"], {"gws1"})
+
+    def test_replace_accounts(self):
+        """Re-reading an account replaces it and its members."""
+        self.snapshot.replace_accounts(["gws1"], b"gws1|root||5\ngws1||bob|1\n")
+        self.assertEqual(self.snapshot.accounts["gws1"], AccountInfo("gws1", "root", 5))
+        self.assertEqual(self.snapshot.user_accounts["alice"], {"default-account"})
+        self.assertEqual(self.snapshot.user_accounts["bob"], {"gws1"})
+
+    def test_changed_entities(self):
+        """Users and accounts are found in transactions which change associations."""
+        changed = jasmin_slurm_sync.models.association.changed_entities(
+            b"Add Associations|(id_assoc=5)|acct='gws1', user='alice'\n"
+            b"Modify Users|(name='bob' || name='carol')|default_acct='gws1'\n"
+            b"Add Accounts|(name='gws2')|description='gws2'\n"
+            b"Add QOS|(name='high')|priority=10\n"
+        )
+        self.assertEqual(changed, ({"alice", "bob", "carol"}, {"gws1", "gws2"}))
+
+    def test_changed_entities_account_association(self):
+        """An account's own association, with an empty user, only changes the account."""
+        changed = jasmin_slurm_sync.models.association.changed_entities(
+            b"Add Associations|id_assoc=7|cluster='c', acct='gws1', user='', partition=''\n"
+        )
+        self.assertEqual(changed, (set(), {"gws1"}))
+
+    def test_changed_entities_ambiguous(self):
+        """Transactions which don't say what changed need a full reload."""
+        changed_entities = jasmin_slurm_sync.models.association.changed_entities
+        self.assertIsNone(changed_entities(b"Remove Associations|(id_assoc=5)|\n"))
+        self.assertIsNone(changed_entities(b"Add Clusters|(name='c')|\n"))
@@ -0,0 +1,126 @@
+import subprocess as sp
+import unittest
+import unittest.mock
+
+import jasmin_slurm_sync.batch
+import jasmin_slurm_sync.ratelimit
+import jasmin_slurm_sync.settings
+import jasmin_slurm_sync.utils
+
+from . import cases
+
+
+class GroupChangesTestCase(unittest.TestCase):
+    """Test grouping of association changes into sacctmgr commands."""
+
+    def test_group_by_accounts(self):
+        """Users needing the same accounts are put in the same group."""
+        groups = jasmin_slurm_sync.batch.group_changes(
+            {"a": {"gws1"}, "b": {"gws1"}, "c": {"gws1"}}
+        )
+        self.assertEqual(groups, [(["a", "b", "c"], ["gws1"])])
+
+    def test_group_by_account(self):
+        """When every user needs different accounts, group per account."""
+        groups = jasmin_slurm_sync.batch.group_changes(
+            {"a": {"gws1", "gws2"}, "b": {"gws1"}, "c": {"gws2"}}
+        )
+        self.assertEqual(groups, [(["a", "b"], ["gws1"]), (["a", "c"], ["gws2"])])
+
+    def test_every_change_is_covered_once(self):
+        """Each user, account pair appears in exactly one group."""
+        changes = {"a": {"x", "y"}, "b": {"y"}, "c": {"x", "y"}, "d": {"z"}}
+        pairs = [
+            (user, account)
+            for users, accounts in jasmin_slurm_sync.batch.group_changes(changes)
+            for user in users
+            for account in accounts
+        ]
+        expected = [(u, a) for u, accounts in changes.items() for a in accounts]
+        self.assertCountEqual(pairs, expected)
+
+
+class AssociationBatchTestCase(cases.CliArgsMixin, unittest.IsolatedAsyncioTestCase):
+    """Test applying batched association changes."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.settings = jasmin_slurm_sync.settings.load_settings(self.args.config)
+        runner = jasmin_slurm_sync.utils.CommandRunner(
+            jasmin_slurm_sync.ratelimit.RateLimiter.from_settings(self.settings),
+            self.settings.sacctmgr_max_workers,
+        )
+        self.batch = jasmin_slurm_sync.batch.AssociationBatch(
+            self.settings, self.args, runner
+        )
+        patcher = unittest.mock.patch.object(
+            runner,
+            "run",
+            new_callable=unittest.mock.AsyncMock,
+            return_value=sp.CompletedProcess([], 0, b"", b""),
+        )
+        self.run = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_flush_order_and_coalescing(self):
+        """Additions, default account changes then removals, one command each."""
+        for username in ["u1", "u2", "u3"]:
+            self.batch.add_user_to_account(username, "gws1")
+            self.batch.update_default_account(username, "default-account")
+        self.batch.remove_user_from_account("u1", "old")
+        await self.batch.flush()
+
+        commands = [x.args[0] for x in self.run.call_args_list]
+        self.assertEqual(
+            commands,
+            [
+                ["sacctmgr", "-i", "add", "user", "u1,u2,u3", "account=gws1"],
+                [
+                    "sacctmgr",
+                    "-i",
+                    "modify",
+                    "user",
+                    "u1,u2,u3",
+                    "set",
+                    "defaultaccount=default-account",
+                ],
+                ["sacctmgr", "-i", "remove", "user", "u1", "account=old"],
+            ],
+        )
+
+    async def test_batch_size(self):
+        """Commands are split when there are more users than the batch size."""
+        self.settings.sacctmgr_batch_size = 2
+        for username in ["u1", "u2", "u3"]:
+            self.batch.add_user_to_account(username, "gws1")
+        await self.batch.flush()
+        self.assertEqual(self.run.call_count, 2)
+
+    async def test_fallback_to_single_user(self):
+        """A failing batched command is retried one user at a time."""
+        self.run.side_effect = [
+            sp.CalledProcessError(1, []),
+            sp.CompletedProcess([], 0, b"", b""),
+            sp.CompletedProcess([], 0, b"", b""),
+        ]
+        self.batch.add_user_to_account("u1", "gws1")
+        self.batch.add_user_to_account("u2", "gws1")
+        await self.batch.flush()
+        commands = [x.args[0][4] for x in self.run.call_args_list]
+        self.assertEqual(commands, ["u1,u2", "u1", "u2"])
+
+    async def test_failing_user(self):
+        """A user whose command fails on its own is recorded, and the rest carry on."""
+        self.run.side_effect = [
+            sp.CalledProcessError(1, []),
+            sp.CalledProcessError(1, []),
+            sp.CompletedProcess([], 0, b"", b""),
+            sp.CompletedProcess([], 0, b"", b""),
+        ]
+        self.batch.add_user_to_account("u1", "gws1")
+        self.batch.add_user_to_account("u2", "gws1")
+        self.batch.update_default_account("u2", "gws1")
+        await self.batch.flush()
+        commands = [x.args[0][4] for x in self.run.call_args_list]
+        self.assertEqual(commands, ["u1,u2", "u1", "u2", "u2"])
+        self.assertEqual(self.batch.failed, {"u1"})
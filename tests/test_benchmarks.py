@@ -0,0 +1,46 @@
+import unittest
+
+import benchmarks.sacctmgr
+
+
+class FakeSacctmgrTestCase(unittest.TestCase):
+    """Test the fake sacctmgr used by the benchmarks."""
+
+    def setUp(self) -> None:
+        self.store = benchmarks.sacctmgr.Store(
+            {"gws1": ("root", 2)}, {"alice": ("gws1", ["gws1"])}
+        )
+
+    def run_command(self, *args: str) -> list[str]:
+        return benchmarks.sacctmgr.run(self.store, list(args))
+
+    def test_show_associations(self):
+        """Associations are listed in the format read by the syncer."""
+        self.assertEqual(
+            self.run_command(
+                "show",
+                "associations",
+                "format=account,parentname,user,fairshare",
+                "--parsable2",
+                "--noheader",
+            ),
+            ["root|||1", "gws1|root||2", "gws1||alice|1"],
+        )
+
+    def test_changes(self):
+        """Changes made by the executor are applied to the store."""
+        self.run_command(
+            "-i", "create", "account", "name=gws2", "parent=gws1", "fairshare=1"
+        )
+        self.run_command("-i", "add", "user", "alice,bob", "account=gws2")
+        self.run_command("-i", "modify", "user", "bob", "set", "defaultaccount=gws1")
+        self.run_command("-i", "remove", "user", "alice", "account=gws1")
+        self.assertEqual(self.store.accounts["gws2"], ("gws1", 1))
+        self.assertEqual(
+            self.store.users, {"alice": ("gws1", ["gws2"]), "bob": ("gws1", ["gws2"])}
+        )
+
+    def test_unknown_account(self):
+        """Adding users to accounts which don't exist fails, as it would in SLURM."""
+        with self.assertRaises(ValueError):
+            self.run_command("-i", "add", "user", "alice", "account=gws3")
@@ -0,0 +1,75 @@
+import pathlib
+import tempfile
+import unittest
+
+import jasmin_slurm_sync.cli
+
+
+class SyncArgParserTestCase(unittest.TestCase):
+    """Test parsing command line arguments."""
+
+    def test_selectors(self):
+        """Users and accounts can be repeated and read from files."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            user_file = pathlib.Path(tmpdir) / "users.txt"
+            user_file.write_text("carol\ndave\n")
+            args = jasmin_slurm_sync.cli.SyncArgParser().parse_args(
+                [
+                    "--user",
+                    "alice",
+                    "--user",
+                    "bob",
+                    "--user_file",
+                    str(user_file),
+                    "--account",
+                    "gws1",
+                ]
+            )
+        self.assertEqual(args.user, ["alice", "bob", "carol", "dave"])
+        self.assertEqual(args.account, ["gws1"])
+        self.assertTrue(args.targeted)
+
+    def test_full_sync(self):
+        """Without selectors, everything is synced."""
+        args = jasmin_slurm_sync.cli.SyncArgParser().parse_args([])
+        self.assertFalse(args.targeted)
+
+    def test_selectors_not_allowed_forever(self):
+        """Selecting users doesn't make sense for the daemon."""
+        with self.assertRaises(SystemExit):
+            jasmin_slurm_sync.cli.SyncArgParser().parse_args(
+                ["--user", "alice", "--run_forever"]
+            )
+
+    def test_selectors_not_allowed_plan_out(self):
+        """Plans are only written for full syncs."""
+        with self.assertRaises(SystemExit):
+            jasmin_slurm_sync.cli.SyncArgParser().parse_args(
+                ["--account", "gws1", "--plan_out", "plan.json"]
+            )
+
+    def test_shard(self):
+        """Shards must be valid, and are only used for one-shot full syncs."""
+        args = jasmin_slurm_sync.cli.SyncArgParser().parse_args(["--shard", "1/4"])
+        self.assertEqual(args.shard, "1/4")
+        for argv in [
+            ["--shard", "4/4"],
+            ["--shard", "1"],
+            ["--shard", "0/2", "--run_forever"],
+            ["--workers", "2", "--user", "alice"],
+            ["--workers", "0"],
+        ]:
+            with self.subTest(argv=argv), self.assertRaises(SystemExit):
+                jasmin_slurm_sync.cli.SyncArgParser().parse_args(argv)
+
+    def test_journal(self):
+        """Journals are only kept when changes are really made, by a single process."""
+        args = jasmin_slurm_sync.cli.SyncArgParser().parse_args(
+            ["--journal", "journal.jsonl", "--run_forever"]
+        )
+        self.assertEqual(args.journal, pathlib.Path("journal.jsonl"))
+        for extra in [["--dry_run"], ["--workers", "2"], ["--replay", "recording"]]:
+            with self.subTest(extra=extra), self.assertRaises(SystemExit):
+                jasmin_slurm_sync.cli.SyncArgParser().parse_args(
+                    ["--journal", "journal.jsonl", *extra]
+                )
@@ -0,0 +1,59 @@
+import unittest
+import unittest.mock
+
+import jasmin_slurm_sync.identity
+
+# Enough of a passwd entry for getpwall.
+Entry = unittest.mock.NonCallableMock
+
+
+class UnixUsersTestCase(unittest.IsolatedAsyncioTestCase):
+    """Test looking up and caching whether Unix users exist."""
+
+    def setUp(self) -> None:
+        self.users = jasmin_slurm_sync.identity.UnixUsers(ttl=100, negative_ttl=10)
+        self.now = 1000.0
+        patcher = unittest.mock.patch("time.monotonic", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def getpwnam(self, username: str) -> None:
+        if username != "alice":
+            raise KeyError(username)
+
+    async def test_cached(self):
+        """Users are only looked up again once their answer expires."""
+        with unittest.mock.patch("pwd.getpwnam", side_effect=self.getpwnam) as lookup:
+            self.assertTrue(await self.users.exists("alice"))
+            self.assertFalse(await self.users.exists("bob"))
+            self.assertTrue(await self.users.exists("alice"))
+            self.assertFalse(await self.users.exists("bob"))
+            self.assertEqual(lookup.call_count, 2)
+
+            # Missing users expire sooner than those who exist.
+            self.now += 50
+            self.assertTrue(await self.users.exists("alice"))
+            self.assertFalse(await self.users.exists("bob"))
+            self.assertEqual(lookup.call_count, 3)
+
+    async def test_prefetch(self):
+        """Users are looked up in bulk, skipping those already known."""
+        with unittest.mock.patch("pwd.getpwnam", side_effect=self.getpwnam) as lookup:
+            await self.users.exists("alice")
+            await self.users.prefetch(["alice", "bob", "carol"])
+            self.assertEqual(lookup.call_count, 3)
+            self.assertFalse(await self.users.exists("carol"))
+            self.assertEqual(lookup.call_count, 3)
+
+    async def test_prefetch_enumerate(self):
+        """Every user is listed at once when enumeration is on."""
+        self.users.enumerate_users = True
+        entries = [Entry(pw_name="alice"), Entry(pw_name="root")]
+        with unittest.mock.patch(
+            "pwd.getpwall", return_value=entries
+        ) as getpwall, unittest.mock.patch("pwd.getpwnam") as lookup:
+            await self.users.prefetch(["alice", "bob"])
+            self.assertTrue(await self.users.exists("alice"))
+            self.assertFalse(await self.users.exists("bob"))
+        getpwall.assert_called_once()
+        lookup.assert_not_called()
@@ -0,0 +1,155 @@
+import pathlib
+import subprocess as sp
+import tempfile
+import unittest
+import unittest.mock
+
+import jasmin_slurm_sync.executor
+import jasmin_slurm_sync.plan
+import jasmin_slurm_sync.ratelimit
+import jasmin_slurm_sync.settings
+import jasmin_slurm_sync.utils
+from jasmin_slurm_sync.journal import Journal
+from jasmin_slurm_sync.plan import AddAssociation, CreateAccount, SetFairshare
+
+from . import cases
+
+
+class JournalTestCase(cases.CliArgsMixin, unittest.IsolatedAsyncioTestCase):
+    """Test journaling changes so interrupted syncs can be resumed."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.journal = Journal(pathlib.Path(tmpdir.name) / "journal.jsonl")
+
+    def test_pending(self):
+        """Changes which were planned but not done are pending, in the order planned."""
+        self.assertEqual(len(self.journal.pending()), 0)
+        self.journal.planned(
+            [
+                CreateAccount("gws1", "root", 2),
+                AddAssociation("alice", "gws1"),
+                AddAssociation("bob", "gws1"),
+            ]
+        )
+        self.journal.done([CreateAccount("gws1", "root", 2)])
+        self.journal.done([AddAssociation("alice", "gws1")])
+        self.journal.planned([SetFairshare("gws2", 5)])
+        self.assertEqual(
+            self.journal.pending().operations,
+            [SetFairshare("gws2", 5), AddAssociation("bob", "gws1")],
+        )
+
+    def test_incomplete_line(self):
+        """A last line cut short by a crash is ignored."""
+        self.journal.planned([AddAssociation("alice", "gws1")])
+        with self.journal.path.open("a") as f:
+            f.write('{"done": [{"op": "add_assoc')
+        self.assertEqual(
+            self.journal.pending().operations, [AddAssociation("alice", "gws1")]
+        )
+
+    def test_finish(self):
+        """The journal is emptied once a sync has succeeded."""
+        self.journal.planned([AddAssociation("alice", "gws1")])
+        self.journal.finish()
+        self.assertEqual(self.journal.path.read_text(), "")
+        self.assertEqual(len(self.journal.pending()), 0)
+
+    def make_executor(self, run) -> jasmin_slurm_sync.executor.Executor:
+        """An executor which journals its changes, running commands with run."""
+        settings = jasmin_slurm_sync.settings.load_settings(self.args.config)
+        runner = jasmin_slurm_sync.utils.CommandRunner(
+            jasmin_slurm_sync.ratelimit.RateLimiter.from_settings(settings), 1
+        )
+        patcher = unittest.mock.patch.object(runner, "run", side_effect=run)
+        self.run = patcher.start()
+        self.addCleanup(patcher.stop)
+        return jasmin_slurm_sync.executor.Executor(
+            settings, self.args, runner, self.journal
+        )
+
+    async def test_interrupted_apply(self):
+        """Only the changes which weren't made are left pending when a sync is interrupted."""
+
+        async def run(args, check=True):
+            if "bob" in args:
+                raise RuntimeError("Interrupted")
+            return sp.CompletedProcess(args, 0, b"", b"")
+
+        executor = self.make_executor(run)
+        changes = jasmin_slurm_sync.plan.Plan(
+            [
+                CreateAccount("gws1", "root", 2),
+                AddAssociation("alice", "gws1"),
+                AddAssociation("bob", "gws2"),
+            ]
+        )
+        with self.assertRaises(RuntimeError):
+            await executor.apply(changes)
+        self.assertEqual(
+            self.journal.pending().operations, [AddAssociation("bob", "gws2")]
+        )
+
+    async def test_resume(self):
+        """Only the changes which weren't made are made when resuming."""
+        executor = self.make_executor(
+            lambda args, check=True: sp.CompletedProcess(args, 0, b"", b"")
+        )
+        self.journal.planned(
+            [CreateAccount("gws1", "root", 2), AddAssociation("alice", "gws1")]
+        )
+        self.journal.done([CreateAccount("gws1", "root", 2)])
+        self.assertEqual(await executor.resume(), 1)
+        self.assertEqual([x.args[0][2] for x in self.run.await_args_list], ["add"])
+        self.assertEqual(len(self.journal.pending()), 0)
+
+    async def test_interrupted_resume(self):
+        """Resuming again after being interrupted doesn't repeat any changes."""
+
+        async def run(args, check=True):
+            raise RuntimeError("Interrupted")
+
+        executor = self.make_executor(run)
+        self.journal.planned([AddAssociation("alice", "gws1")])
+        for _ in range(2):
+            with self.assertRaises(RuntimeError):
+                await executor.resume()
+            self.assertEqual(
+                self.journal.pending().operations, [AddAssociation("alice", "gws1")]
+            )
+
+    async def test_failed_resume(self):
+        """Changes which still fail are set aside, rather than resumed every time."""
+
+        async def run(args, check=True):
+            raise sp.CalledProcessError(1, args)
+
+        executor = self.make_executor(run)
+        self.journal.planned([AddAssociation("alice", "missing")])
+        for resumed in [1, 0]:
+            self.assertEqual(await executor.resume(), resumed)
+            self.assertEqual(len(self.journal.pending()), 0)
+        self.assertEqual(self.run.await_count, 1)
+        self.assertIn("missing", self.journal.failed_path.read_text())
+
+    async def test_failed_account_resume(self):
+        """Changes skipped after an account change fails are resumed next time, not set aside."""
+
+        async def run(args, check=True):
+            raise sp.CalledProcessError(1, args)
+
+        executor = self.make_executor(run)
+        self.journal.planned(
+            [CreateAccount("gws1", "root", 2), AddAssociation("alice", "gws1")]
+        )
+        self.assertEqual(await executor.resume(), 1)
+        self.assertEqual(
+            self.journal.pending().operations, [AddAssociation("alice", "gws1")]
+        )
+        self.assertNotIn("alice", self.journal.failed_path.read_text())
+        self.assertEqual(await executor.resume(), 1)
+        self.assertEqual(len(self.journal.pending()), 0)
+        self.assertEqual(len(self.journal.failed_path.read_text().splitlines()), 2)
@@ -0,0 +1,79 @@
+import asyncio
+import pathlib
+import tempfile
+import unittest
+
+import jasmin_slurm_sync.metrics
+
+
+class MetricsTestCase(unittest.IsolatedAsyncioTestCase):
+    """Test rendering metrics in the Prometheus text format."""
+
+    def setUp(self) -> None:
+        self.registry = jasmin_slurm_sync.metrics.Registry()
+
+    def test_counter(self):
+        """Counters are added up for each combination of labels."""
+        counter = self.registry.counter("calls_total", "Calls made.")
+        counter.inc(command="show")
+        counter.inc(2, command="show")
+        counter.inc(command="add")
+        self.assertEqual(
+            self.registry.render(),
+            "# HELP calls_total Calls made.\n"
+            "# TYPE calls_total counter\n"
+            'calls_total{command="add"} 1.0\n'
+            'calls_total{command="show"} 3.0\n',
+        )
+
+    def test_clear(self):
+        """Cleared metrics have no values until they are set again."""
+        gauge = self.registry.gauge("phase_seconds", "Time taken.")
+        gauge.set(1, phase="plan")
+        gauge.clear()
+        gauge.set(2, phase="apply")
+        self.assertEqual(gauge.get(phase="plan"), 0)
+        self.assertEqual(
+            list(gauge.samples()), [("phase_seconds", (("phase", "apply"),), 2)]
+        )
+
+    def test_histogram(self):
+        """Histogram buckets are cumulative, with a sum and count."""
+        histogram = jasmin_slurm_sync.metrics.Histogram(
+            "duration_seconds", "Durations.", buckets=[0.1, 1]
+        )
+        self.registry.register(histogram)
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(5)
+        self.assertEqual(
+            self.registry.render().splitlines()[2:],
+            [
+                'duration_seconds_bucket{le="0.1"} 2.0',
+                'duration_seconds_bucket{le="1.0"} 2.0',
+                'duration_seconds_bucket{le="+Inf"} 3.0',
+                "duration_seconds_sum 5.15",
+                "duration_seconds_count 3.0",
+            ],
+        )
+
+    def test_write(self):
+        """Metrics are written to a file for the textfile collector."""
+        self.registry.gauge("last_success", "Last success.").set(1234)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "sync.prom"
+            self.registry.write(path)
+            self.assertIn("last_success 1234.0\n", path.read_text())
+
+    async def test_serve(self):
+        """Metrics are served over HTTP."""
+        self.registry.gauge("last_success", "Last success.").set(1234)
+        server = await self.registry.serve("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(b"GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        response = await reader.read()
+        writer.close()
+        server.close()
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 OK\r\n"))
+        self.assertIn(b"last_success 1234.0\n", response)
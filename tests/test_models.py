@@ -0,0 +1,79 @@
+import unittest
+
+import jasmin_slurm_sync.identity
+import jasmin_slurm_sync.models.account
+import jasmin_slurm_sync.models.user
+import jasmin_slurm_sync.plan
+import jasmin_slurm_sync.settings
+from jasmin_slurm_sync.models.account import AccountInfo
+
+from . import cases
+
+
+class ModelsTestCase(cases.CliArgsMixin):
+    """Test building the models from shared, indexed state."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.settings = jasmin_slurm_sync.settings.load_settings(self.args.config)
+        self.changes = jasmin_slurm_sync.plan.Plan()
+        self.index = jasmin_slurm_sync.models.account.AccountIndex(
+            expected_slurm_accounts=[
+                AccountInfo("gws1", "consortium", 2),
+                AccountInfo("gws2", "consortium", 1),
+            ],
+            existing_slurm_accounts=[
+                AccountInfo("gws1", "root", 2),
+                AccountInfo("old", "root", 1),
+            ],
+        )
+
+    def account(self, name: str) -> jasmin_slurm_sync.models.account.Account:
+        return jasmin_slurm_sync.models.account.Account(
+            name, self.index, self.settings, self.args, self.changes
+        )
+
+    def test_account_lookup(self):
+        """Accounts find their existing and expected details by name."""
+        self.assertEqual(self.account("gws1").existing, AccountInfo("gws1", "root", 2))
+        self.assertEqual(
+            self.account("gws1").expected, AccountInfo("gws1", "consortium", 2)
+        )
+        self.assertIsNone(self.account("gws2").existing)
+        self.assertIsNone(self.account("old").expected)
+
+    def test_account_plan(self):
+        """Accounts plan the changes which make them match the portal."""
+        for name in ["gws1", "gws2", "old"]:
+            self.account(name).plan_sync()
+        self.assertEqual(
+            self.changes.operations,
+            [
+                jasmin_slurm_sync.plan.SetParent("gws1", "consortium"),
+                jasmin_slurm_sync.plan.CreateAccount("gws2", "consortium", 1),
+                jasmin_slurm_sync.plan.DeactivateAccount("old"),
+            ],
+        )
+
+    def test_account_levels(self):
+        """Accounts are grouped by their depth once SLURM matches the portal."""
+        self.assertEqual(
+            self.index.levels(["gws1", "gws2", "old", "consortium"]),
+            [["consortium", "old"], ["gws1", "gws2"]],
+        )
+
+    def test_user_changes(self):
+        """Users work out which accounts to add and remove."""
+        user = jasmin_slurm_sync.models.user.User(
+            username="carol",
+            portal_services={"gws1", "gws2"},
+            slurm_accounts={"gws1", "old"},
+            existing_default_account="default-account",
+            account_names_available=frozenset(self.index.expected),
+            settings=self.settings,
+            args=self.args,
+            changes=self.changes,
+            unix_users=jasmin_slurm_sync.identity.UnixUsers(),
+        )
+        self.assertEqual(user.to_be_added, {"gws2"})
+        self.assertEqual(user.to_be_removed, {"old"})
@@ -0,0 +1,52 @@
+import unittest
+
+import jasmin_slurm_sync.metrics
+
+from . import cases
+
+if cases.SYNC_AVAILABLE:
+    import benchmarks.scenario
+
+
+@unittest.skipUnless(cases.SYNC_AVAILABLE, "jasmin_account_api_client is not installed")
+class PipelineTestCase(cases.SyntheticSyncMixin, unittest.IsolatedAsyncioTestCase):
+    """Test applying users' changes while their grants are still being fetched."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.settings.sync_pipeline_batch_users = 5
+        self.settings.sync_pipeline_queue_size = 5
+        self.settings.portal_max_in_flight = 2
+        self.syncer = self.make_syncer()
+
+    async def test_overlap(self):
+        """Changes are applied before the last user's grants have been fetched."""
+        made = await self.syncer.pipeline()
+        self.assertGreater(made, 0)
+        self.assertLess(
+            self.events.index("write"),
+            len(self.events) - 1 - self.events[::-1].index("fetch"),
+        )
+        self.assertTrue(
+            benchmarks.scenario.converged(self.portal, self.settings, self.store)
+        )
+
+    async def test_flush_interval(self):
+        """Changes are applied once they have waited long enough, however few there are."""
+        self.settings.sync_pipeline_batch_users = 1000
+        self.settings.sync_pipeline_flush_interval = 0
+        await self.syncer.pipeline()
+        self.assertLess(
+            self.events.index("write"),
+            len(self.events) - 1 - self.events[::-1].index("fetch"),
+        )
+
+    async def test_phases(self):
+        """Fetching the grants is timed, as it is when the whole plan is made first."""
+        jasmin_slurm_sync.metrics.PHASE_DURATION.clear()
+        await self.syncer.pipeline()
+        for phase in ["slurm_read", "portal_fetch", "user_pipeline"]:
+            with self.subTest(phase=phase):
+                self.assertGreater(
+                    jasmin_slurm_sync.metrics.PHASE_DURATION.get(phase=phase), 0
+                )
@@ -0,0 +1,245 @@
+import json
+import pathlib
+import subprocess as sp
+import tempfile
+import unittest
+import unittest.mock
+
+import jasmin_slurm_sync.executor
+import jasmin_slurm_sync.plan
+import jasmin_slurm_sync.ratelimit
+import jasmin_slurm_sync.settings
+import jasmin_slurm_sync.utils
+from jasmin_slurm_sync.plan import (
+    AddAssociation,
+    CreateAccount,
+    DeactivateAccount,
+    SetFairshare,
+    SetParent,
+)
+
+from . import cases
+
+
+class PlanTestCase(unittest.TestCase):
+    """Test building and saving plans."""
+
+    def setUp(self) -> None:
+        self.plan = jasmin_slurm_sync.plan.Plan(
+            [
+                AddAssociation("alice", "gws1"),
+                CreateAccount("gws1", "root", 2),
+                SetFairshare("gws2", 5),
+            ]
+        )
+
+    def test_order(self):
+        """Account changes come before changes to users."""
+        self.assertEqual(
+            self.plan.operations,
+            [
+                CreateAccount("gws1", "root", 2),
+                SetFairshare("gws2", 5),
+                AddAssociation("alice", "gws1"),
+            ],
+        )
+
+    def test_round_trip(self):
+        """A saved plan loads back the same."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "plan.json"
+            self.plan.dump(path)
+            self.assertEqual(
+                json.loads(path.read_text())["operations"][0],
+                {
+                    "op": "create_account",
+                    "account": "gws1",
+                    "parent": "root",
+                    "fairshare": 2,
+                },
+            )
+            loaded = jasmin_slurm_sync.plan.Plan.load(path)
+        self.assertEqual(loaded.operations, self.plan.operations)
+
+    def test_invalid(self):
+        """Unknown operations and versions are rejected."""
+        from_json = jasmin_slurm_sync.plan.Plan.from_json
+        with self.assertRaises(ValueError):
+            from_json({"version": 0, "operations": []})
+        with self.assertRaises(ValueError):
+            from_json({"version": 1, "operations": [{"op": "drop_database"}]})
+        with self.assertRaises(ValueError):
+            from_json({"version": 1, "operations": [{"op": "set_parent"}]})
+
+    def test_account_command(self):
+        """Account changes become the same sacctmgr commands as before."""
+        self.assertEqual(
+            jasmin_slurm_sync.executor.account_command(SetFairshare("gws2", 5)),
+            [
+                "sacctmgr",
+                "-i",
+                "modify",
+                "account",
+                "where",
+                "name=gws2",
+                "set",
+                "fairshare=5",
+            ],
+        )
+
+    def test_load_file(self):
+        """New accounts are listed under their parents, parents first."""
+        self.assertEqual(
+            jasmin_slurm_sync.executor.load_file(
+                "cluster1",
+                [
+                    CreateAccount("consortium", "root", 10),
+                    CreateAccount("gws1", "consortium", 2),
+                    CreateAccount("gws2", "consortium", 1),
+                ],
+            ),
+            "Cluster - 'cluster1'\n"
+            "Parent - 'root'\n"
+            "Account - 'consortium':Description='consortium':Fairshare=10\n"
+            "Parent - 'consortium'\n"
+            "Account - 'gws1':Description='gws1':Fairshare=2\n"
+            "Account - 'gws2':Description='gws2':Fairshare=1\n",
+        )
+
+
+class ExecutorTestCase(cases.CliArgsMixin, unittest.IsolatedAsyncioTestCase):
+    """Test applying plans to SLURM."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.settings = jasmin_slurm_sync.settings.load_settings(self.args.config)
+        runner = jasmin_slurm_sync.utils.CommandRunner(
+            jasmin_slurm_sync.ratelimit.RateLimiter.from_settings(self.settings), 1
+        )
+        self.executor = jasmin_slurm_sync.executor.Executor(
+            self.settings, self.args, runner
+        )
+        patcher = unittest.mock.patch.object(
+            runner,
+            "run",
+            new_callable=unittest.mock.AsyncMock,
+            return_value=sp.CompletedProcess([], 0, b"", b""),
+        )
+        self.run = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_apply(self):
+        """Accounts are changed one at a time, then users in bulk."""
+        await self.executor.apply(
+            jasmin_slurm_sync.plan.Plan(
+                [
+                    AddAssociation("alice", "gws1"),
+                    AddAssociation("bob", "gws1"),
+                    CreateAccount("gws1", "root", 2),
+                ]
+            )
+        )
+        self.assertEqual(
+            [x.args[0][:4] for x in self.run.await_args_list],
+            [
+                ["sacctmgr", "-i", "create", "account"],
+                ["sacctmgr", "-i", "add", "user"],
+            ],
+        )
+
+    def test_account_levels(self):
+        """Parents are changed before their children, and deactivations come last."""
+        levels = jasmin_slurm_sync.executor.account_levels(
+            [
+                DeactivateAccount("old-consortium"),
+                SetParent("gws1", "new-consortium"),
+                SetFairshare("gws1", 3),
+                CreateAccount("new-consortium", "root", 10),
+                SetFairshare("gws2", 1),
+            ]
+        )
+        self.assertEqual(
+            levels,
+            [
+                [
+                    [CreateAccount("new-consortium", "root", 10)],
+                    [SetFairshare("gws2", 1)],
+                ],
+                [[SetParent("gws1", "new-consortium"), SetFairshare("gws1", 3)]],
+                [[DeactivateAccount("old-consortium")]],
+            ],
+        )
+
+    async def test_apply_levels(self):
+        """An account is moved only once its new parent has been created."""
+        self.settings.sacctmgr_load_threshold = 0
+        await self.executor.apply(
+            jasmin_slurm_sync.plan.Plan(
+                [
+                    SetParent("gws1", "new-consortium"),
+                    CreateAccount("new-consortium", "root", 10),
+                ]
+            )
+        )
+        self.assertEqual(
+            [x.args[0][-1] for x in self.run.await_args_list],
+            ["fairshare=10", "parent=new-consortium"],
+        )
+
+    async def test_load_accounts(self):
+        """Several new accounts are created with a single sacctmgr load."""
+        self.run.return_value = sp.CompletedProcess([], 0, b"cluster1\n", b"")
+        await self.executor.apply(
+            jasmin_slurm_sync.plan.Plan(
+                [CreateAccount("gws1", "root", 2), CreateAccount("gws2", "root", 1)]
+            )
+        )
+        self.assertEqual(
+            [x.args[0][2] for x in self.run.await_args_list], ["cluster", "load"]
+        )
+
+    async def test_load_accounts_fallback(self):
+        """Accounts are created one at a time if they can't be loaded."""
+
+        async def run(args, check=True):
+            if "load" in args:
+                raise sp.CalledProcessError(1, args)
+            return sp.CompletedProcess(args, 0, b"cluster1\n", b"")
+
+        self.run.side_effect = run
+        await self.executor.apply(
+            jasmin_slurm_sync.plan.Plan(
+                [CreateAccount("gws1", "root", 2), CreateAccount("gws2", "root", 1)]
+            )
+        )
+        self.assertEqual(
+            [x.args[0][2] for x in self.run.await_args_list],
+            ["cluster", "load", "create", "create"],
+        )
+
+    async def test_cluster_fallback(self):
+        """Accounts are created one at a time if the cluster can't be found."""
+
+        async def run(args, check=True):
+            if "cluster" in args:
+                raise sp.CalledProcessError(1, args)
+            return sp.CompletedProcess(args, 0, b"", b"")
+
+        self.run.side_effect = run
+        await self.executor.apply(
+            jasmin_slurm_sync.plan.Plan(
+                [CreateAccount("gws1", "root", 2), CreateAccount("gws2", "root", 1)]
+            )
+        )
+        self.assertEqual(
+            [x.args[0][2] for x in self.run.await_args_list],
+            ["cluster", "create", "create"],
+        )
+
+    async def test_dry_run(self):
+        """Nothing is run in dry run mode."""
+        self.args.dry_run = True
+        await self.executor.apply(
+            jasmin_slurm_sync.plan.Plan([CreateAccount("gws1", "root", 2)])
+        )
+        self.run.assert_not_awaited()
@@ -0,0 +1,68 @@
+import asyncio
+import unittest
+
+from jasmin_slurm_sync.shard import Shard
+
+from . import cases
+
+if cases.SYNC_AVAILABLE:
+    from jasmin_slurm_sync.sync import pool
+
+
+@unittest.skipUnless(cases.SYNC_AVAILABLE, "jasmin_account_api_client is not installed")
+class SharedReadsTestCase(cases.SyntheticSyncMixin, unittest.IsolatedAsyncioTestCase):
+    """Test giving workers what the parent has already read."""
+
+    async def read_shared(self) -> "pool.SharedReads":
+        parent = self.make_syncer()
+        await asyncio.gather(
+            parent.slurm_associations,
+            parent.expected_slurm_accounts,
+            parent.portal_slurm_users,
+        )
+        return pool.SharedReads(
+            await parent.slurm_associations,
+            await parent.expected_slurm_accounts,
+            await parent.portal_slurm_users,
+        )
+
+    async def test_for_shard(self):
+        """Each shard gets only its own users, and every account."""
+        self.store.users["user000001"] = ("default-account", ["default-account"])
+        shared = await self.read_shared()
+        shards = [shared.for_shard(Shard(i, 2)) for i in range(2)]
+        self.assertEqual(
+            sorted(x for shard in shards for x in shard.portal_users),
+            sorted(shared.portal_users),
+        )
+        self.assertEqual(
+            sum(len(x.associations.user_accounts) for x in shards),
+            len(shared.associations.user_accounts),
+        )
+        for shard in shards:
+            self.assertEqual(shard.associations.accounts, shared.associations.accounts)
+
+    async def test_workers(self):
+        """Workers only fetch their users' grants, and leave the accounts alone."""
+        workspace = self.portal.services[0]["name"]
+        parent_name, fairshare = self.store.accounts[workspace]
+        self.store.accounts[workspace] = (parent_name, fairshare + 1)
+        shared = await self.read_shared()
+        self.events.clear()
+        self.portal.requests = 0
+
+        for i in range(3):
+            self.args.shard = f"{i}/3"
+            worker = self.make_syncer()
+            shared.for_shard(Shard(i, 3)).share_with(worker)
+            await worker.sync()
+
+        self.assertNotIn("read", self.events)
+        self.assertEqual(self.portal.requests, self.events.count("fetch"))
+        self.assertEqual(self.store.accounts[workspace], (parent_name, fairshare + 1))
+        for username in self.portal.grants:
+            with self.subTest(username=username):
+                self.assertEqual(
+                    set(self.store.users[username][1]),
+                    self.portal.expected_accounts(username),
+                )
@@ -0,0 +1,141 @@
+import unittest
+import unittest.mock
+
+import httpx
+
+import jasmin_slurm_sync.portal
+import jasmin_slurm_sync.settings
+
+from . import cases
+
+
+class PortalFetcherTestCase(cases.CliArgsMixin, unittest.IsolatedAsyncioTestCase):
+    """Test fetching JSON from the portals."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.settings = jasmin_slurm_sync.settings.load_settings(self.args.config)
+        self.settings.portal_retries = 2
+        self.requests: list[httpx.Request] = []
+        self.responses: list[httpx.Response] = []
+        patcher = unittest.mock.patch("asyncio.sleep", new=unittest.mock.AsyncMock())
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        return self.responses.pop(0)
+
+    def fetcher(self) -> jasmin_slurm_sync.portal.PortalFetcher:
+        client = httpx.AsyncClient(transport=httpx.MockTransport(self.handler))
+        return jasmin_slurm_sync.portal.PortalFetcher(client, self.settings)
+
+    async def test_success(self):
+        """JSON is returned on success without retrying."""
+        self.responses = [httpx.Response(200, json=[1, 2])]
+        self.assertEqual(await self.fetcher().get_json("https://example.com/"), [1, 2])
+        self.sleep.assert_not_called()
+
+    async def test_retry(self):
+        """Overloaded responses are retried after backing off."""
+        self.responses = [httpx.Response(503), httpx.Response(200, json={})]
+        self.assertEqual(await self.fetcher().get_json("https://example.com/"), {})
+        self.assertEqual(len(self.requests), 2)
+        self.sleep.assert_called_once()
+
+    async def test_give_up(self):
+        """The error is raised once the retries are used up."""
+        self.responses = [httpx.Response(429)] * 3
+        with self.assertRaises(httpx.HTTPStatusError):
+            await self.fetcher().get_json("https://example.com/")
+        self.assertEqual(len(self.requests), 3)
+
+    async def test_no_retry_on_client_error(self):
+        """Client errors are not retried."""
+        self.responses = [httpx.Response(404)]
+        with self.assertRaises(httpx.HTTPStatusError):
+            await self.fetcher().get_json("https://example.com/")
+        self.assertEqual(len(self.requests), 1)
+
+    def test_backoff_bounded(self):
+        """Backoff grows exponentially, but never past the maximum."""
+        fetcher = self.fetcher()
+        for attempt in range(20):
+            delay = fetcher.backoff(attempt)
+            self.assertLessEqual(delay, self.settings.portal_retry_backoff_max)
+            self.assertLessEqual(delay, self.settings.portal_retry_backoff * 2**attempt)
+
+
+class PaginationTestCase(cases.CliArgsMixin, unittest.IsolatedAsyncioTestCase):
+    """Test fetching listings from the portals a page at a time."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.settings = jasmin_slurm_sync.settings.load_settings(self.args.config)
+        self.settings.portal_page_size = 2
+        self.settings.portal_page_concurrency = 2
+        self.items = list(range(7))
+        self.requests: list[httpx.Request] = []
+
+    def paginated(self, request: httpx.Request) -> httpx.Response:
+        """Serve the items with limit and offset pagination."""
+        self.requests.append(request)
+        limit = int(request.url.params["limit"])
+        offset = int(request.url.params["offset"])
+        return httpx.Response(
+            200,
+            json={
+                "count": len(self.items),
+                "results": self.items[offset : offset + limit],
+            },
+        )
+
+    def fetcher(self, handler) -> jasmin_slurm_sync.portal.PortalFetcher:
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        return jasmin_slurm_sync.portal.PortalFetcher(client, self.settings)
+
+    async def items_from(self, handler, key=None) -> list:
+        fetcher = self.fetcher(handler)
+        return [x async for x in fetcher.iter_items("https://example.com/", key)]
+
+    async def test_pages(self):
+        """Every page is fetched, and the items are yielded in order."""
+        self.assertEqual(await self.items_from(self.paginated), self.items)
+        self.assertEqual(
+            [x.url.params["offset"] for x in self.requests], ["0", "2", "4", "6"]
+        )
+
+    async def test_next_links(self):
+        """Next links are followed when there is no count."""
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            self.requests.append(request)
+            if "offset" in request.url.params:
+                return httpx.Response(
+                    200, json={"results": [1, 2], "next": "https://example.com/2/"}
+                )
+            return httpx.Response(200, json={"results": [3], "next": None})
+
+        self.assertEqual(await self.items_from(handler), [1, 2, 3])
+        self.assertEqual(len(self.requests), 2)
+
+    async def test_not_paginated(self):
+        """Listings which aren't paginated are used as they are."""
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            self.requests.append(request)
+            return httpx.Response(200, json={"accesses": self.items})
+
+        self.assertEqual(await self.items_from(handler, "accesses"), self.items)
+        self.assertEqual(len(self.requests), 1)
+
+    async def test_page_size_unset(self):
+        """Listings are fetched in one request without a page size."""
+        self.settings.portal_page_size = 0
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            self.requests.append(request)
+            return httpx.Response(200, json=self.items)
+
+        self.assertEqual(await self.items_from(handler), self.items)
+        self.assertEqual(str(self.requests[0].url), "https://example.com/")
@@ -0,0 +1,63 @@
+import unittest
+import unittest.mock
+
+import jasmin_slurm_sync.ratelimit
+
+
+class FakeClock:
+    """Clock which only moves when asyncio.sleep is called."""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float) -> None:
+        self.now += delay
+
+
+class TokenBucketTestCase(unittest.IsolatedAsyncioTestCase):
+    """Test the token bucket rate limiter."""
+
+    def setUp(self) -> None:
+        self.clock = FakeClock()
+        patcher = unittest.mock.patch("asyncio.sleep", self.clock.sleep)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_burst_does_not_wait(self):
+        """Calls within the burst capacity don't wait at all."""
+        bucket = jasmin_slurm_sync.ratelimit.TokenBucket(1, 5, clock=self.clock)
+        waits = [await bucket.acquire() for _ in range(5)]
+        self.assertEqual(waits, [0.0] * 5)
+        self.assertEqual(self.clock.now, 0.0)
+
+    async def test_wait_when_empty(self):
+        """Once the bucket is empty, calls are spaced by the rate."""
+        bucket = jasmin_slurm_sync.ratelimit.TokenBucket(2, 1, clock=self.clock)
+        await bucket.acquire()
+        self.assertAlmostEqual(await bucket.acquire(), 0.5)
+        self.assertAlmostEqual(await bucket.acquire(), 0.5)
+        self.assertAlmostEqual(self.clock.now, 1.0)
+
+    async def test_refill(self):
+        """The bucket refills over time, up to the burst capacity."""
+        bucket = jasmin_slurm_sync.ratelimit.TokenBucket(1, 2, clock=self.clock)
+        await bucket.acquire()
+        await bucket.acquire()
+        self.clock.now += 100
+        waits = [await bucket.acquire() for _ in range(3)]
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(waits[2], 1.0)
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    """Test classifying sacctmgr commands."""
+
+    def test_command_class(self):
+        """show and list are reads, everything else is a write."""
+        command_class = jasmin_slurm_sync.ratelimit.RateLimiter.command_class
+        self.assertEqual(command_class(["sacctmgr", "show", "user"]), "read")
+        self.assertEqual(command_class(["sacctmgr", "-n", "list", "assoc"]), "read")
+        self.assertEqual(command_class(["sacctmgr", "-i", "add", "user"]), "write")
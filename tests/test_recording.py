@@ -0,0 +1,94 @@
+import pathlib
+import subprocess as sp
+import tempfile
+import unittest
+import unittest.mock
+
+import httpx
+
+import jasmin_slurm_sync.ratelimit
+import jasmin_slurm_sync.recording
+import jasmin_slurm_sync.utils
+
+SHOW = ["sacctmgr", "show", "user", "format=user,defaultaccount"]
+ADD = ["sacctmgr", "-i", "add", "user", "alice", "account=gws1"]
+
+
+class RecordingTestCase(unittest.IsolatedAsyncioTestCase):
+    """Test recording and replaying what a sync reads."""
+
+    def setUp(self) -> None:
+        bucket = jasmin_slurm_sync.ratelimit.TokenBucket(100, 100)
+        self.limiter = jasmin_slurm_sync.ratelimit.RateLimiter(bucket, bucket)
+        self.recording = jasmin_slurm_sync.recording.Recording()
+
+    def test_strip_secrets(self):
+        """Credentials are removed from portal responses."""
+        self.assertEqual(
+            jasmin_slurm_sync.recording.strip_secrets(
+                [{"user": {"username": "alice", "access_token": "abc"}, "Password": 1}]
+            ),
+            [{"user": {"username": "alice"}}],
+        )
+
+    async def test_record_reads(self):
+        """Only the output of commands which read from SLURM is recorded."""
+        runner = jasmin_slurm_sync.recording.RecordingRunner(
+            self.limiter, 1, self.recording
+        )
+        with unittest.mock.patch.object(
+            jasmin_slurm_sync.utils.CommandRunner,
+            "run",
+            new_callable=unittest.mock.AsyncMock,
+            return_value=sp.CompletedProcess([], 0, b"alice|gws1\n", b""),
+        ):
+            await runner.run(SHOW)
+            await runner.run(ADD)
+        self.assertEqual(list(self.recording.outputs), [self.recording.key(SHOW)])
+
+    async def test_replay(self):
+        """A saved recording is replayed, and writes are captured instead of run."""
+        self.recording.responses["https://example.com/users/"] = ["alice"]
+        self.recording.outputs[self.recording.key(SHOW)] = {
+            "returncode": 0,
+            "stdout": "alice|gws1\n",
+            "stderr": "",
+        }
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.recording.save(pathlib.Path(tmpdir))
+            recording = jasmin_slurm_sync.recording.Recording.load(pathlib.Path(tmpdir))
+
+        runner = jasmin_slurm_sync.recording.ReplayRunner(self.limiter, 1, recording)
+        self.assertEqual((await runner.run(SHOW)).stdout, b"alice|gws1\n")
+        await runner.run(ADD)
+        self.assertEqual(recording.writes, [ADD])
+        with self.assertRaises(sp.CalledProcessError):
+            await runner.run(["sacctmgr", "show", "associations"])
+
+        async with httpx.AsyncClient(
+            transport=httpx.MockTransport(recording.respond)
+        ) as client:
+            response = await client.get("https://example.com/users/")
+            self.assertEqual(response.json(), ["alice"])
+            response = await client.get("https://example.com/other/")
+            self.assertEqual(response.status_code, 404)
+
+    async def test_replay_load(self):
+        """Files of accounts loaded in bulk are kept with the captured writes."""
+        runner = jasmin_slurm_sync.recording.ReplayRunner(
+            self.limiter, 1, self.recording
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            load_file = pathlib.Path(tmpdir) / "accounts.cfg"
+            load_file.write_text("Cluster - 'cluster1'\n")
+            await runner.run(["sacctmgr", "-i", "load", f"file={load_file}"])
+            load_file.unlink()
+            self.recording.save_writes(pathlib.Path(tmpdir))
+            self.assertEqual(
+                self.recording.writes,
+                [["sacctmgr", "-i", "load", "file=load-1.cfg"]],
+            )
+            self.assertEqual(
+                (pathlib.Path(tmpdir) / "load-1.cfg").read_text(),
+                "Cluster - 'cluster1'\n",
+            )
@@ -0,0 +1,47 @@
+import unittest
+import unittest.mock
+
+import jasmin_slurm_sync.settings
+from jasmin_slurm_sync import schedule
+
+from . import cases
+
+
+class SchedulerTestCase(cases.CliArgsMixin, unittest.TestCase):
+    """Test the time between syncs adapts to what the syncs find."""
+
+    def setUp(self):
+        super().setUp()
+        self.scheduler = schedule.Scheduler()
+        # The example config uses the defaults: 600s, 120s when busy, backoff after 3.
+        self.settings = jasmin_slurm_sync.settings.load_settings(self.args.config)
+        patcher = unittest.mock.patch("random.uniform", side_effect=lambda a, b: 1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_elapsed_subtracted(self):
+        """Test the time the sync took is taken off the delay."""
+        self.assertEqual(self.scheduler.next_delay(self.settings, 100, 0), 500)
+
+    def test_overrun(self):
+        """Test the next sync starts straight away if the last one overran."""
+        self.assertEqual(self.scheduler.next_delay(self.settings, 700, 0), 0)
+
+    def test_busy(self):
+        """Test syncs come sooner after one which made changes or didn't finish."""
+        self.assertEqual(self.scheduler.next_delay(self.settings, 20, 5), 100)
+        self.assertEqual(self.scheduler.next_delay(self.settings, 20, None), 100)
+
+    def test_backoff(self):
+        """Test the period doubles after several idle syncs, up to the maximum."""
+        periods = [self.scheduler.period(self.settings, 0) for _ in range(6)]
+        self.assertEqual(periods, [600, 600, 1200, 2400, 3600, 3600])
+        # Changes reset the backoff.
+        self.assertEqual(self.scheduler.period(self.settings, 1), 120)
+        self.assertEqual(self.scheduler.period(self.settings, 0), 600)
+
+    def test_jitter(self):
+        """Test jitter is a fraction of the delay."""
+        with unittest.mock.patch("random.uniform", return_value=0.9) as uniform:
+            self.assertEqual(self.scheduler.next_delay(self.settings, 0, 0), 540)
+        uniform.assert_called_once_with(0.9, 1.1)
@@ -1,5 +1,10 @@
+import os
 import pathlib
+import tempfile
 import unittest
+import unittest.mock
+
+import pydantic
 
 import jasmin_slurm_sync.settings
 
@@ -16,3 +21,70 @@ class SettingsTestCase(unittest.TestCase):
         )
         self.assertIsInstance(settings, jasmin_slurm_sync.settings.SyncSettings)
         self.assertEqual(settings.list_users_role, "category/service")
+
+    def check_invalid(self, setting: str) -> None:
+        """Check a setting is rejected when the settings are loaded."""
+        example = (pathlib.Path(__file__).parent / "config.example.toml").read_text()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "config.toml"
+            path.write_text(f"{setting}\n{example}")
+            with self.assertRaises(pydantic.ValidationError):
+                jasmin_slurm_sync.settings.load_settings(path)
+
+    def test_invalid_batch_size(self):
+        """Batches must have at least one user in them."""
+        self.check_invalid("sacctmgr_batch_size = 0")
+
+    def test_invalid_rates(self):
+        """Rate limits must let some commands through."""
+        for setting in ["sacctmgr_read_rate = 0", "sacctmgr_write_rate = -1.0"]:
+            with self.subTest(setting=setting):
+                self.check_invalid(setting)
+
+
+class SettingsLoaderTestCase(unittest.TestCase):
+    """Test settings are only loaded again when the file changes."""
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = pathlib.Path(tmpdir.name) / "config.toml"
+        self.example = (
+            pathlib.Path(__file__).parent / "config.example.toml"
+        ).read_text()
+        self.path.write_text(self.example)
+        self.loader = jasmin_slurm_sync.settings.SettingsLoader(self.path)
+
+    def test_first_load(self):
+        """Test the settings are loaded the first time."""
+        settings, changed = self.loader.load()
+        self.assertTrue(changed)
+        self.assertEqual(settings.list_users_role, "category/service")
+
+    def test_unchanged(self):
+        """Test the same settings are returned if the file hasn't changed."""
+        first, _ = self.loader.load()
+        with unittest.mock.patch.object(
+            jasmin_slurm_sync.settings, "load_settings"
+        ) as load_settings:
+            second, changed = self.loader.load()
+        self.assertFalse(changed)
+        self.assertIs(first, second)
+        load_settings.assert_not_called()
+
+    def test_touched(self):
+        """Test a file which is touched but not changed isn't parsed again."""
+        first, _ = self.loader.load()
+        stat = self.path.stat()
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        second, changed = self.loader.load()
+        self.assertFalse(changed)
+        self.assertIs(first, second)
+
+    def test_changed(self):
+        """Test the settings are loaded again when the file changes."""
+        self.loader.load()
+        self.path.write_text("daemon_sleep_time = 60\n" + self.example)
+        settings, changed = self.loader.load()
+        self.assertTrue(changed)
+        self.assertEqual(settings.daemon_sleep_time, 60)
@@ -0,0 +1,35 @@
+import unittest
+
+import jasmin_slurm_sync.settings
+from jasmin_slurm_sync.shard import Shard, share_settings
+
+from . import cases
+
+
+class ShardTestCase(cases.CliArgsMixin, unittest.TestCase):
+    """Test splitting users between shards."""
+
+    def test_parse(self):
+        """Shards are given as index/count."""
+        self.assertEqual(Shard.parse("2/3"), Shard(2, 3))
+        for text in ["3/3", "-1/3", "2", "a/b"]:
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                Shard.parse(text)
+
+    def test_partition(self):
+        """Every user is in exactly one shard, and the shards are roughly even."""
+        shards = [Shard(i, 4) for i in range(4)]
+        usernames = [f"user{i}" for i in range(1000)]
+        for username in usernames:
+            self.assertEqual(sum(username in x for x in shards), 1)
+        for shard in shards:
+            self.assertGreater(sum(x in shard for x in usernames), 150)
+
+    def test_share_settings(self):
+        """Workers share the sacctmgr rate limits between them."""
+        settings = jasmin_slurm_sync.settings.load_settings(self.args.config)
+        shared = share_settings(settings, 4)
+        self.assertEqual(shared.sacctmgr_write_rate, settings.sacctmgr_write_rate / 4)
+        self.assertEqual(shared.sacctmgr_read_rate, settings.sacctmgr_read_rate / 4)
+        self.assertGreaterEqual(shared.sacctmgr_write_burst, 1)
+        self.assertEqual(shared.default_account, settings.default_account)
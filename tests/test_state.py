@@ -0,0 +1,65 @@
+import unittest
+
+import jasmin_slurm_sync.state
+
+
+class SyncStateTestCase(unittest.TestCase):
+    """Test remembering which users have changed between cycles."""
+
+    def setUp(self) -> None:
+        self.state = jasmin_slurm_sync.state.SyncState()
+        self.hash = jasmin_slurm_sync.state.user_hash({"gws1"}, {"gws1"}, "default")
+
+    def sync_cycle(self, users: dict[str, int], fingerprint: int = 0) -> set[str]:
+        """Run a cycle where every dirty user syncs successfully."""
+        self.state.start_cycle(fingerprint, full_every=3)
+        dirty = {x for x, h in users.items() if self.state.is_dirty(x, h)}
+        for username in dirty:
+            self.state.mark_synced(username)
+        self.state.finish_cycle()
+        return dirty
+
+    def test_unchanged_users_skipped(self):
+        """Users are only reconciled again when their inputs change."""
+        self.assertEqual(self.sync_cycle({"a": self.hash, "b": self.hash}), {"a", "b"})
+        self.assertEqual(self.sync_cycle({"a": self.hash, "b": self.hash}), set())
+        self.assertEqual(self.sync_cycle({"a": self.hash, "b": 1}), {"b"})
+
+    def test_full_reconciliation(self):
+        """Every user is reconciled every full_every cycles."""
+        users = {"a": self.hash}
+        dirty = [self.sync_cycle(users) for _ in range(4)]
+        self.assertEqual(dirty, [{"a"}, set(), set(), {"a"}])
+
+    def test_fingerprint_change(self):
+        """Changing something shared by all users reconciles every user."""
+        users = {"a": self.hash}
+        self.sync_cycle(users)
+        self.assertEqual(self.sync_cycle(users, fingerprint=1), {"a"})
+
+    def test_failed_users_retried(self):
+        """Users which didn't sync successfully are reconciled again."""
+        self.state.start_cycle(0, full_every=3)
+        self.assertTrue(self.state.is_dirty("a", self.hash))
+        self.state.finish_cycle()
+        self.assertEqual(self.sync_cycle({"a": self.hash}), {"a"})
+
+    def test_failed_changes_retried(self):
+        """Users whose changes failed are reconciled again."""
+        self.state.start_cycle(0, full_every=3)
+        self.assertTrue(self.state.is_dirty("a", self.hash))
+        self.state.mark_synced("a")
+        self.state.mark_failed("a")
+        self.state.finish_cycle()
+        self.assertEqual(self.sync_cycle({"a": self.hash}), {"a"})
+
+    def test_user_hash(self):
+        """The hash depends on the user's accounts, not their order."""
+        self.assertEqual(
+            jasmin_slurm_sync.state.user_hash({"x", "y"}, set(), ""),
+            jasmin_slurm_sync.state.user_hash({"y", "x"}, set(), ""),
+        )
+        self.assertNotEqual(
+            jasmin_slurm_sync.state.user_hash({"x"}, set(), ""),
+            jasmin_slurm_sync.state.user_hash(set(), {"x"}, ""),
+        )
@@ -0,0 +1,33 @@
+import json
+import pathlib
+import tempfile
+import unittest
+
+import jasmin_slurm_sync.tracing
+
+
+class TracingTestCase(unittest.TestCase):
+    """Test timing spans and profiles."""
+
+    def test_span(self):
+        """Spans are logged as JSON, with their attributes and any error."""
+        with self.assertLogs("jasmin_slurm_sync.spans", "DEBUG") as logs:
+            with jasmin_slurm_sync.tracing.Span("user", user="alice"):
+                pass
+            with self.assertRaises(KeyError):
+                with jasmin_slurm_sync.tracing.Span("user", user="bob"):
+                    raise KeyError("bob")
+        first, second = (json.loads(x.getMessage()) for x in logs.records)
+        self.assertEqual(first["span"], "user")
+        self.assertEqual(first["user"], "alice")
+        self.assertGreaterEqual(first["duration"], 0)
+        self.assertNotIn("error", first)
+        self.assertEqual(second["error"], "KeyError")
+
+    def test_profile(self):
+        """A profile is saved for each block."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            directory = pathlib.Path(tmpdir) / "profiles"
+            with jasmin_slurm_sync.tracing.Profile(directory) as profile:
+                sum(range(1000))
+            self.assertTrue(profile.path.exists())
@@ -0,0 +1,68 @@
+import asyncio
+import pathlib
+import tempfile
+import unittest
+
+import jasmin_slurm_sync.trigger
+
+
+class TriggerServerTestCase(unittest.IsolatedAsyncioTestCase):
+    """Test requesting syncs over the trigger socket."""
+
+    async def asyncSetUp(self) -> None:
+        self.calls: list[tuple[str, str]] = []
+        self.release = asyncio.Event()
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = pathlib.Path(tmpdir.name) / "trigger.sock"
+        self.server = jasmin_slurm_sync.trigger.TriggerServer(self.path, self.handler)
+        self.listener = await self.server.start()
+
+    async def asyncTearDown(self) -> None:
+        self.listener.close()
+        await self.listener.wait_closed()
+
+    async def handler(self, kind: str, name: str) -> None:
+        self.calls.append((kind, name))
+        await self.release.wait()
+        if name == "broken":
+            raise ValueError("broken")
+
+    async def request(self, line: str) -> str:
+        reader, writer = await asyncio.open_unix_connection(str(self.path))
+        writer.write(line.encode("utf-8") + b"\n")
+        reply = await reader.readline()
+        writer.close()
+        return reply.decode("utf-8").strip()
+
+    async def test_sync_user(self):
+        """A request syncs the user and replies once it is done."""
+        self.release.set()
+        self.assertEqual(await self.request("user alice"), "ok")
+        self.assertEqual(self.calls, [("user", "alice")])
+
+    async def test_bad_requests(self):
+        """Malformed requests are rejected without syncing anything."""
+        self.release.set()
+        self.assertTrue((await self.request("user")).startswith("error"))
+        self.assertTrue((await self.request("group gws1")).startswith("error"))
+        self.assertEqual(self.calls, [])
+
+    async def test_failure_reported(self):
+        """Errors while syncing are sent back to the client."""
+        self.release.set()
+        self.assertEqual(
+            await self.request("account broken"), "error ValueError broken"
+        )
+        self.assertEqual(self.server.in_flight, {})
+
+    async def test_coalesced(self):
+        """Requests while a sync is in flight cause at most one more sync."""
+        first = asyncio.create_task(self.request("user alice"))
+        await asyncio.sleep(0.1)
+        others = [asyncio.create_task(self.request("user alice")) for _ in range(5)]
+        await asyncio.sleep(0.1)
+        self.release.set()
+        replies = await asyncio.gather(first, *others)
+        self.assertEqual(replies, ["ok"] * 6)
+        self.assertEqual(self.calls, [("user", "alice")] * 2)
@@ -0,0 +1,51 @@
+import asyncio
+import subprocess as sp
+import sys
+import time
+import unittest
+
+import jasmin_slurm_sync.ratelimit
+import jasmin_slurm_sync.utils
+
+
+class CommandRunnerTestCase(unittest.IsolatedAsyncioTestCase):
+    """Test running commands asynchronously."""
+
+    def setUp(self) -> None:
+        bucket = jasmin_slurm_sync.ratelimit.TokenBucket(100, 100)
+        self.limiter = jasmin_slurm_sync.ratelimit.RateLimiter(bucket, bucket)
+
+    async def test_output_captured(self):
+        """The output of the command is returned."""
+        runner = jasmin_slurm_sync.utils.CommandRunner(self.limiter, 1)
+        result = await runner.run([sys.executable, "-c", "print('hello')"])
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout.strip(), b"hello")
+
+    async def test_check(self):
+        """A failing command raises CalledProcessError unless check is False."""
+        runner = jasmin_slurm_sync.utils.CommandRunner(self.limiter, 1)
+        args = [sys.executable, "-c", "raise SystemExit(3)"]
+        with self.assertRaises(sp.CalledProcessError):
+            await runner.run(args)
+        self.assertEqual((await runner.run(args, check=False)).returncode, 3)
+
+    async def test_runs_concurrently(self):
+        """Commands run at the same time, up to the worker limit."""
+        runner = jasmin_slurm_sync.utils.CommandRunner(self.limiter, 4)
+        args = [sys.executable, "-c", "import time; time.sleep(0.5)"]
+        start = time.monotonic()
+        await asyncio.gather(*(runner.run(args) for _ in range(4)))
+        self.assertLess(time.monotonic() - start, 1.5)
+
+
+class InternerTestCase(unittest.TestCase):
+    """Test sharing sets of names."""
+
+    def test_shared(self):
+        """Equal sets of names give the same frozenset."""
+        interner = jasmin_slurm_sync.utils.Interner()
+        first = interner(["gws1", "default-account"])
+        self.assertIs(interner({"default-account", "gws1"}), first)
+        self.assertEqual(first, {"gws1", "default-account"})
+        self.assertIsNot(interner(["gws1"]), first)